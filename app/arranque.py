@@ -0,0 +1,84 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# ---------------------------------------------------------
+# TIEMPO DE ARRANQUE
+# ---------------------------------------------------------
+# Cada worker de uvicorn y cada pod nuevo importa app.main antes de atender
+# /login. Las dependencias pesadas (motores de PDF, passlib, requests) se
+# importan en su primer uso; este chequeo mide el import en un intérprete
+# limpio con `-X importtime` y muestra los módulos que más tardan.
+# Con --presupuesto termina con código 1 si el arranque lo supera, para
+# correrlo en CI o antes de construir la imagen.
+# Uso: python -m app.arranque [--presupuesto MS] [--top N] [--repeticiones N]
+
+MODULO = "app.main"
+PRESUPUESTO_MS = float(os.getenv("ARRANQUE_PRESUPUESTO_MS", "0"))
+
+def medir(modulo=MODULO):
+    """
+    Importa `modulo` en un proceso nuevo. Retorna (ms totales, filas) donde
+    cada fila es (propio_us, acumulado_us, nombre) tal como la reporta
+    -X importtime en stderr.
+    """
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True, text=True,
+    )
+    total_ms = (time.perf_counter() - inicio) * 1000
+    if proceso.returncode != 0:
+        errores = [l for l in proceso.stderr.splitlines() if not l.startswith("import time:")]
+        sys.exit("❌ No se pudo importar {}:\n{}".format(modulo, "\n".join(errores[-15:])))
+
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not linea.startswith("import time:"):
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|", 2)
+        if not propio.strip().isdigit():
+            continue  # encabezado
+        filas.append((int(propio), int(acumulado), nombre.rstrip()))
+    return total_ms, filas
+
+def reporte(filas, top):
+    """Módulos de primer nivel (paquetes) ordenados por tiempo acumulado"""
+    raices = {}
+    for propio, _, nombre in filas:
+        paquete = nombre.strip().split(".")[0]
+        raices[paquete] = raices.get(paquete, 0) + propio
+
+    print(f"\n{'ms propio':>10}  paquete")
+    for paquete, us in sorted(raices.items(), key=lambda p: p[1], reverse=True)[:top]:
+        print(f"{us / 1000:>10.1f}  {paquete}")
+
+    print(f"\n{'ms acum.':>10}  {'ms propio':>10}  módulo")
+    for propio, acumulado, nombre in sorted(filas, key=lambda f: f[1], reverse=True)[:top]:
+        print(f"{acumulado / 1000:>10.1f}  {propio / 1000:>10.1f}  {nombre.strip()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo de import de la aplicación")
+    parser.add_argument("--presupuesto", type=float, default=PRESUPUESTO_MS,
+                        help="ms máximos de arranque (0 = sin límite)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--repeticiones", type=int, default=3,
+                        help="se toma la mejor medición (la primera calienta la caché de disco)")
+    parser.add_argument("--modulo", default=MODULO)
+    args = parser.parse_args()
+
+    mediciones = [medir(args.modulo) for _ in range(args.repeticiones)]
+    total_ms, filas = min(mediciones, key=lambda m: m[0])
+    reporte(filas, args.top)
+
+    import_ms = sum(propio for propio, _, _ in filas) / 1000
+    print(f"\nimport {args.modulo}: {import_ms:.0f} ms | proceso completo: {total_ms:.0f} ms")
+
+    if args.presupuesto and total_ms > args.presupuesto:
+        print(f"❌ Arranque sobre el presupuesto de {args.presupuesto:.0f} ms")
+        sys.exit(1)
+    if args.presupuesto:
+        print(f"✅ Arranque dentro del presupuesto de {args.presupuesto:.0f} ms")
@@ -1,10 +1,14 @@
+import json
+import os
+from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from . import database, models, schemas
+from .cache import CacheTTL
 from fastapi import Request
 
 
@@ -29,7 +33,127 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+# ---------------------------------------------------------
+# PRINCIPAL (usuario autenticado) EN CACHÉ
+# ---------------------------------------------------------
+# Las rutas protegidas solo necesitan id, documento, rol y sede del usuario.
+# Esa proyección se guarda en caché por número de documento (el "sub" del
+# token) durante PRINCIPAL_CACHE_TTL segundos, de modo que validar la sesión
+# no consulta la base de datos en cada petición.
+# Por defecto la caché es local al proceso; con PRINCIPAL_CACHE_URL=redis://...
+# se comparte entre workers/pods (requiere el paquete `redis`).
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_MAX = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+PRINCIPAL_CACHE_URL = os.getenv("PRINCIPAL_CACHE_URL", "")
+
+@dataclass(frozen=True)
+class RolPrincipal:
+    nombre: str
+
+@dataclass(frozen=True)
+class SedePrincipal:
+    nombre: str
+    ciudad: str
+
+@dataclass(frozen=True)
+class Principal:
+    """Proyección mínima del Usuario. Expone .rol.nombre y .sede.ciudad igual que el modelo."""
+    id: int
+    numero_documento: str
+    nombres: str
+    apellidos: str
+    sede_id: int
+    rol: RolPrincipal
+    sede: SedePrincipal
+
+    @classmethod
+    def desde_usuario(cls, user):
+        return cls(
+            id=user.id,
+            numero_documento=user.numero_documento,
+            nombres=user.nombres,
+            apellidos=user.apellidos,
+            sede_id=user.sede_id,
+            rol=RolPrincipal(user.rol.nombre),
+            sede=SedePrincipal(user.sede.nombre, user.sede.ciudad),
+        )
+
+    @classmethod
+    def desde_dict(cls, datos):
+        datos = dict(datos)
+        datos["rol"] = RolPrincipal(**datos["rol"])
+        datos["sede"] = SedePrincipal(**datos["sede"])
+        return cls(**datos)
+
+class CachePrincipalLocal:
+    def __init__(self):
+        self._cache = CacheTTL(max_entradas=PRINCIPAL_CACHE_MAX, ttl=PRINCIPAL_CACHE_TTL)
+
+    def obtener(self, documento):
+        return self._cache.obtener(documento)
+
+    def guardar(self, documento, principal):
+        self._cache.guardar(documento, principal)
+
+    def invalidar(self, documento):
+        self._cache.invalidar(documento)
+
+class CachePrincipalRedis:
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    def _clave(self, documento):
+        return f"hce:principal:{documento}"
+
+    def obtener(self, documento):
+        datos = self._redis.get(self._clave(documento))
+        return Principal.desde_dict(json.loads(datos)) if datos else None
+
+    def guardar(self, documento, principal):
+        self._redis.setex(self._clave(documento), int(PRINCIPAL_CACHE_TTL), json.dumps(asdict(principal)))
+
+    def invalidar(self, documento):
+        self._redis.delete(self._clave(documento))
+
+cache_principal = CachePrincipalRedis(PRINCIPAL_CACHE_URL) if PRINCIPAL_CACHE_URL else CachePrincipalLocal()
+
+def guardar_principal(user):
+    """Guarda en caché al usuario recién autenticado (evita la consulta en la primera petición)"""
+    principal = Principal.desde_usuario(user)
+    cache_principal.guardar(principal.numero_documento, principal)
+    return principal
+
+def invalidar_principal(numero_documento):
+    """Llamar cuando cambian los datos del usuario"""
+    cache_principal.invalidar(numero_documento)
+
+def _consulta_usuario(db: Session, numero_documento):
+    return db.query(models.Usuario).options(
+        joinedload(models.Usuario.rol),
+        joinedload(models.Usuario.sede),
+    ).filter(models.Usuario.numero_documento == numero_documento)
+
+def obtener_principal(numero_documento, db: Optional[Session] = None):
+    """Principal desde la caché o, si no está, desde la base de datos"""
+    principal = cache_principal.obtener(numero_documento)
+    if principal is not None:
+        return principal
+
+    propia = db is None
+    db = db or database.SessionLocal()
+    try:
+        user = _consulta_usuario(db, numero_documento).first()
+        if user is None:
+            return None
+        return guardar_principal(user)
+    finally:
+        if propia:
+            db.close()
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
     """Decodifica el token y valida al usuario actual"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -46,13 +170,13 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
         
-    user = db.query(models.Usuario).filter(models.Usuario.numero_documento == token_data.username).first()
+    user = obtener_principal(token_data.username)
     if user is None:
         raise credentials_exception
     return user
 
-def get_current_user_from_cookie(request: Request, db: Session = Depends(database.get_db)):
-    """Extrae el token de la cookie y valida al usuario."""
+def _documento_desde_cookie(request: Request):
+    """numero_documento ("sub") del token guardado en la cookie, o None"""
     token = request.cookies.get("access_token")
     if not token:
         return None # No hay sesión iniciada
@@ -65,11 +189,30 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(databas
         
         # Reutilizamos la lógica de validación que ya creamos
         payload = jwt.decode(param, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-            
-        user = db.query(models.Usuario).filter(models.Usuario.numero_documento == username).first()
-        return user
+        return payload.get("sub")
+    except Exception:
+        return None
+
+def get_current_user_from_cookie(request: Request, db: Optional[Session] = None):
+    """Extrae el token de la cookie y valida al usuario (retorna un Principal)."""
+    username = _documento_desde_cookie(request)
+    if username is None:
+        return None
+    try:
+        return obtener_principal(username, db)
+    except Exception:
+        return None
+
+async def get_current_user_from_cookie_async(request: Request, db):
+    """Igual que get_current_user_from_cookie, para rutas async (db es una AsyncSession)."""
+    username = _documento_desde_cookie(request)
+    if username is None:
+        return None
+
+    principal = cache_principal.obtener(username)
+    if principal is not None:
+        return principal
+    try:
+        return await db.run_sync(lambda sesion: obtener_principal(username, sesion))
     except Exception:
-        return None
\ No newline at end of file
+        return None
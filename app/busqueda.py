@@ -0,0 +1,277 @@
+import base64
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import Numeric, and_, cast, func, literal_column, or_, select, text, tuple_
+
+from . import models
+
+# ---------------------------------------------------------
+# BÚSQUEDA DE PACIENTES
+# ---------------------------------------------------------
+# Tres modos, cada uno respaldado por un índice de la migración 0007:
+#   - "documento": prefijo del número de documento (LIKE 'abc%' sobre
+#     ix_usuarios_documento_patron, text_pattern_ops).
+#   - "nombre": todas las palabras de la consulta aparecen en
+#     "nombres apellidos", sin importar tildes ni mayúsculas (LIKE '%x%' sobre
+#     el índice GIN de trigramas ix_usuarios_nombre_trgm).
+#   - "aproximado": similitud de trigramas por palabra (operador <%, mismo
+#     índice), ordenado de más a menos parecido; tolera errores de digitación.
+# "auto" usa documento si la consulta es una sola palabra con dígitos y
+# nombre en otro caso; si la primera página por nombre sale vacía, repite
+# como aproximado.
+#
+# Los filtros de rol y sede van en el WHERE de la misma consulta (el
+# planificador combina los índices con un BitmapAnd). La paginación es por
+# llave (keyset): el cursor lleva los valores de orden de la última fila, así
+# que pedir la página 50 cuesta lo mismo que la primera.
+
+BUSQUEDA_LIMITE = int(os.getenv("BUSQUEDA_LIMITE", "20"))
+BUSQUEDA_LIMITE_MAX = int(os.getenv("BUSQUEDA_LIMITE_MAX", "100"))
+BUSQUEDA_MIN_CARACTERES = int(os.getenv("BUSQUEDA_MIN_CARACTERES", "3"))
+# pg_trgm.word_similarity_threshold para el modo aproximado (0 a 1)
+BUSQUEDA_UMBRAL = float(os.getenv("BUSQUEDA_UMBRAL", "0.5"))
+
+AUTO, DOCUMENTO, NOMBRE, APROXIMADO = "auto", "documento", "nombre", "aproximado"
+MODOS = (AUTO, DOCUMENTO, NOMBRE, APROXIMADO)
+
+# Debe coincidir con la expresión de ix_usuarios_nombre_trgm. Va como SQL
+# literal: con el espacio como parámetro el planificador no reconoce el índice.
+NOMBRE_NORMALIZADO = literal_column("f_unaccent(lower(usuarios.nombres || ' ' || usuarios.apellidos))")
+
+class BusquedaInvalida(ValueError):
+    """Consulta muy corta, modo desconocido o cursor corrupto"""
+
+def _normalizar(valor):
+    return func.f_unaccent(func.lower(valor))
+
+def _escapar_like(valor):
+    return valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def modo_de(q):
+    palabras = q.split()
+    if len(palabras) == 1 and any(c.isdigit() for c in q):
+        return DOCUMENTO
+    return NOMBRE
+
+# --- Cursor ---
+
+def _codificar_cursor(modo, llave):
+    datos = json.dumps({"m": modo, "k": [str(v) if isinstance(v, Decimal) else v for v in llave]})
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+# Tipos de la llave de orden por modo (ver _llave); la similitud viaja como texto
+_TIPOS_LLAVE = {DOCUMENTO: (str,), NOMBRE: (str, str, int), APROXIMADO: (str, int)}
+
+def _decodificar_cursor(cursor):
+    """(modo, llave) validados: el cursor llega del cliente y puede venir alterado"""
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        modo, llave = datos["m"], datos["k"]
+        tipos = _TIPOS_LLAVE[modo]
+        if not isinstance(llave, list) or len(llave) != len(tipos) or not all(
+                type(v) is t for v, t in zip(llave, tipos)):
+            raise ValueError(llave)
+        if modo == APROXIMADO:
+            llave = [Decimal(llave[0]), llave[1]]
+            if not llave[0].is_finite():
+                raise ValueError(llave)
+        return modo, llave
+    except (ValueError, KeyError, TypeError, InvalidOperation):
+        raise BusquedaInvalida("Cursor inválido")
+
+# --- Consulta ---
+
+def consulta(q, modo, rol=None, sede_id=None, limite=BUSQUEDA_LIMITE, despues_de=None):
+    """
+    SELECT de una página. `modo` ya resuelto (no "auto"); `despues_de` es la
+    llave de orden de la última fila de la página anterior.
+    """
+    U = models.Usuario
+    columnas = [U.id, U.numero_documento, U.nombres, U.apellidos, U.fecha_nacimiento, U.sede_id]
+
+    if modo == DOCUMENTO:
+        stmt = select(*columnas).where(U.numero_documento.like(_escapar_like(q) + "%", escape="\\"))
+        orden = [U.numero_documento]
+        if despues_de:
+            stmt = stmt.where(U.numero_documento > despues_de[0])
+    elif modo == NOMBRE:
+        condiciones = [
+            NOMBRE_NORMALIZADO.like(_normalizar("%" + _escapar_like(palabra) + "%"), escape="\\")
+            for palabra in q.split()
+        ]
+        stmt = select(*columnas).where(*condiciones)
+        orden = [U.apellidos, U.nombres, U.id]
+        if despues_de:
+            stmt = stmt.where(tuple_(*orden) > tuple_(*despues_de))
+    elif modo == APROXIMADO:
+        consulta_normalizada = _normalizar(q)
+        # NUMERIC para que el valor del cursor se compare exacto (real no lo es)
+        similitud = cast(func.word_similarity(consulta_normalizada, NOMBRE_NORMALIZADO), Numeric(7, 6))
+        stmt = select(*columnas, similitud.label("similitud")).where(
+            consulta_normalizada.op("<%")(NOMBRE_NORMALIZADO)
+        )
+        orden = [similitud.desc(), U.id]
+        if despues_de:
+            s, ultimo_id = despues_de
+            stmt = stmt.where(or_(similitud < s, and_(similitud == s, U.id > ultimo_id)))
+    else:
+        raise BusquedaInvalida(f"Modo desconocido: {modo}")
+
+    if rol:
+        stmt = stmt.where(U.rol_id == select(models.Rol.id).where(models.Rol.nombre == rol).scalar_subquery())
+    if sede_id is not None:
+        stmt = stmt.where(U.sede_id == sede_id)
+    return stmt.order_by(*orden).limit(limite)
+
+def _llave(modo, fila):
+    if modo == DOCUMENTO:
+        return [fila.numero_documento]
+    if modo == NOMBRE:
+        return [fila.apellidos, fila.nombres, fila.id]
+    return [fila.similitud, fila.id]
+
+def _pagina(db, q, modo, rol, sede_id, limite, despues_de):
+    if modo == APROXIMADO:
+        # Solo para esta transacción
+        db.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :umbral, true)"),
+                   {"umbral": str(BUSQUEDA_UMBRAL)})
+    # Una fila de más para saber si hay página siguiente
+    return db.execute(consulta(q, modo, rol, sede_id, limite + 1, despues_de)).all()
+
+def buscar(db, q, modo=AUTO, rol="Paciente", sede_id=None, limite=BUSQUEDA_LIMITE, cursor=None):
+    """
+    Retorna {"modo", "resultados" (filas), "siguiente" (cursor o None)}.
+    Lanza BusquedaInvalida si la consulta no se puede atender con índices.
+    """
+    q = " ".join(q.split())
+    if len(q) < BUSQUEDA_MIN_CARACTERES:
+        raise BusquedaInvalida(f"La búsqueda requiere al menos {BUSQUEDA_MIN_CARACTERES} caracteres")
+    if modo not in MODOS:
+        raise BusquedaInvalida(f"Modo desconocido: {modo}")
+    limite = max(1, min(limite, BUSQUEDA_LIMITE_MAX))
+
+    despues_de = None
+    if cursor:
+        # El cursor fija el modo: "auto" pudo haber pasado a aproximado
+        modo, despues_de = _decodificar_cursor(cursor)
+    elif modo == AUTO:
+        modo = modo_de(q)
+        filas = _pagina(db, q, modo, rol, sede_id, limite, None)
+        if not filas and modo == NOMBRE:
+            modo = APROXIMADO
+            filas = _pagina(db, q, modo, rol, sede_id, limite, None)
+        return _resultado(modo, filas, limite)
+
+    return _resultado(modo, _pagina(db, q, modo, rol, sede_id, limite, despues_de), limite)
+
+def _resultado(modo, filas, limite):
+    siguiente = _codificar_cursor(modo, _llave(modo, filas[limite - 1])) if len(filas) > limite else None
+    return {"modo": modo, "resultados": filas[:limite], "siguiente": siguiente}
+
+# --- Datos sintéticos y latencias ---
+
+SQL_SEMBRAR = text("""
+    INSERT INTO usuarios (nombres, apellidos, tipo_documento_id, numero_documento,
+                          fecha_nacimiento, genero, sede_id, rol_id, password_hash)
+    SELECT
+        (ARRAY['José','María','Juan','Ana','Luis','Sofía','Andrés','Valentina','Camilo','Lucía'])[1 + i % 10]
+            || ' ' || (ARRAY['Ángel','Inés','Tomás','Elena','Julián','Paula','Óscar'])[1 + (i / 10) % 7],
+        (ARRAY['Pérez','Gómez','Rodríguez','Martínez','López','García','Hernández','Muñoz','Díaz','Suárez'])[1 + (i / 70) % 10]
+            || ' ' || (ARRAY['Castaño','Ríos','Peña','Ortiz','Vásquez','Álvarez'])[1 + (i / 700) % 6],
+        (SELECT min(id) FROM tipos_documento),
+        :prefijo || lpad(i::text, 9, '0'),
+        DATE '1940-01-01' + (i % 29000),
+        CASE WHEN i % 2 = 0 THEN 'F' ELSE 'M' END,
+        (SELECT min(id) FROM sedes),
+        (SELECT id FROM roles WHERE nombre = 'Paciente'),
+        '!'
+    FROM generate_series(:desde, :hasta) AS i
+    ON CONFLICT (numero_documento) DO NOTHING
+""")
+
+PREFIJO_SINTETICO = "SIM"
+
+def sembrar(total, lote=50_000):
+    """Pacientes sintéticos (documento SIM000000001...) sin contraseña utilizable"""
+    from .database import engine
+
+    for desde in range(1, total + 1, lote):
+        with engine.begin() as conn:
+            conn.execute(SQL_SEMBRAR, {"prefijo": PREFIJO_SINTETICO, "desde": desde,
+                                       "hasta": min(desde + lote - 1, total)})
+        print(f"--- {min(desde + lote - 1, total)}/{total} pacientes sintéticos ---")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE usuarios"))
+
+def limpiar():
+    from .database import engine
+
+    with engine.begin() as conn:
+        borrados = conn.execute(text("DELETE FROM usuarios WHERE numero_documento LIKE :p"),
+                                {"p": PREFIJO_SINTETICO + "%"}).rowcount
+    print(f"🗑️ {borrados} pacientes sintéticos eliminados")
+
+def medir(consultas, repeticiones=20):
+    """Latencia p50/p95 de la primera y de la décima página por consulta y modo"""
+    import time
+
+    from .database import SessionLocal
+
+    def _percentil(tiempos, p):
+        tiempos = sorted(tiempos)
+        return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))] * 1000
+
+    db = SessionLocal()
+    try:
+        for q, modo in consultas:
+            tiempos, profundos = [], []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                pagina = buscar(db, q, modo)
+                tiempos.append(time.perf_counter() - inicio)
+                db.rollback()
+
+                # Avanzar 9 páginas y medir la décima
+                for _ in range(9):
+                    if not pagina["siguiente"]:
+                        break
+                    pagina = buscar(db, q, cursor=pagina["siguiente"])
+                if pagina["siguiente"]:
+                    inicio = time.perf_counter()
+                    buscar(db, q, cursor=pagina["siguiente"])
+                    profundos.append(time.perf_counter() - inicio)
+                db.rollback()
+
+            linea = f"{modo:>10} {q!r:<22} p50 {_percentil(tiempos, 0.5):7.1f} ms | p95 {_percentil(tiempos, 0.95):7.1f} ms"
+            if profundos:
+                linea += f" | página 11 p50 {_percentil(profundos, 0.5):7.1f} ms"
+            print(linea)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    # Uso:
+    #   python -m app.busqueda sembrar 1000000
+    #   python -m app.busqueda medir [consulta ...]   (por defecto un conjunto fijo)
+    #   python -m app.busqueda limpiar
+    import sys
+
+    orden = sys.argv[1] if len(sys.argv) > 1 else "medir"
+    if orden == "sembrar":
+        sembrar(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    elif orden == "limpiar":
+        limpiar()
+    elif orden == "medir":
+        consultas = [(q, AUTO) for q in sys.argv[2:]] or [
+            ("SIM00001", DOCUMENTO),
+            ("SIM0000123", DOCUMENTO),
+            ("jose perez", NOMBRE),
+            ("maria angel gomez rios", NOMBRE),
+            ("rodriges", APROXIMADO),
+            ("valentna suares", APROXIMADO),
+        ]
+        medir(consultas)
+    else:
+        sys.exit(f"Orden desconocida: {orden}")
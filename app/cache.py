@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------------------------------------
+# CACHÉ EN MEMORIA (TTL + LRU)
+# ---------------------------------------------------------
+# Caché por proceso, segura entre hilos. Cada entrada vence a los `ttl`
+# segundos y, al superar `max_entradas`, se descarta la menos usada.
+# Las entradas vencidas se conservan hasta ser desalojadas para permitir
+# revalidarlas (ETag / _lastUpdated) en lugar de descargarlas de nuevo.
+
+class CacheTTL:
+    def __init__(self, max_entradas=1024, ttl=60.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (valor, expira)
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        """Valor vigente o None"""
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None or item[1] < time.monotonic():
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return item[0]
+
+    def obtener_vencido(self, clave):
+        """Valor aunque haya vencido (para revalidar), o None si no está"""
+        with self._lock:
+            item = self._datos.get(clave)
+            return item[0] if item else None
+
+    def guardar(self, clave, valor, ttl=None):
+        expira = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def refrescar(self, clave, ttl=None):
+        """Renueva la vigencia de una entrada revalidada"""
+        with self._lock:
+            item = self._datos.get(clave)
+            if item:
+                self._datos[clave] = (item[0], time.monotonic() + (self.ttl if ttl is None else ttl))
+                self._datos.move_to_end(clave)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def invalidar_si(self, condicion):
+        """Elimina las entradas cuya clave cumpla `condicion(clave)`"""
+        with self._lock:
+            for clave in [c for c in self._datos if condicion(c)]:
+                del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
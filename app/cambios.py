@@ -0,0 +1,63 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+# ---------------------------------------------------------
+# FEED DE CAMBIOS (sincronización delta)
+# ---------------------------------------------------------
+# Usuario, EncuentroMedico y ObservacionClinica llevan `version` (tomada de
+# la secuencia global hce_cambios_seq en cada INSERT/UPDATE) y
+# `actualizado_en`. Con la última versión procesada como marca de agua,
+# "version > marca ORDER BY version" devuelve solo lo que cambió, usando el
+# índice en lugar de recorrer la tabla completa.
+#
+# La versión sale de nextval al ejecutar la sentencia, pero las
+# transacciones se confirman en otro orden: una transacción que tomó la
+# versión 10 puede confirmar después de que un lector ya vio la 11 y avanzó
+# su marca. Por eso los lectores solo llegan hasta un horizonte seguro: se
+# detienen antes de la primera fila escrita por una transacción que empezó
+# hace menos de CAMBIOS_MARGEN segundos (`actualizado_en` es el now() de la
+# transacción). Es exacto mientras ninguna transacción de escritura dure
+# más de CAMBIOS_MARGEN / 2; las filas recientes aparecen con ese retraso.
+
+# Debe ser al menos el doble de la transacción de escritura más larga
+CAMBIOS_MARGEN = float(os.getenv("CAMBIOS_MARGEN", "120"))
+
+MODELOS = {
+    "Patient": models.Usuario,
+    "Encounter": models.EncuentroMedico,
+    "Observation": models.ObservacionClinica,
+}
+
+# Columnas que nunca salen por el feed
+COLUMNAS_PRIVADAS = {"password_hash"}
+
+def filtro_seguro(db: Session, modelo, desde):
+    """Condiciones para leer version > desde sin pasar el horizonte seguro"""
+    corte = func.now() - timedelta(seconds=CAMBIOS_MARGEN)
+    # Usa el índice de actualizado_en: solo se miran las filas recientes
+    horizonte = db.query(func.min(modelo.version)).filter(
+        modelo.version > desde, modelo.actualizado_en >= corte
+    ).scalar()
+    condiciones = [modelo.version > desde]
+    if horizonte is not None:
+        condiciones.append(modelo.version < horizonte)
+    return condiciones
+
+def cambios_desde(db: Session, recurso, desde=0, limite=500):
+    """Filas de `recurso` con version > desde hasta el horizonte seguro, en orden de versión"""
+    modelo = MODELOS[recurso]
+    return db.query(modelo).filter(
+        *filtro_seguro(db, modelo, desde)
+    ).order_by(modelo.version).limit(limite).all()
+
+def serializar(fila):
+    return {
+        columna.key: getattr(fila, columna.key)
+        for columna in fila.__table__.columns
+        if columna.key not in COLUMNAS_PRIVADAS
+    }
@@ -0,0 +1,277 @@
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# ---------------------------------------------------------
+# PRUEBAS DE CARGA (contra un servidor en ejecución)
+# ---------------------------------------------------------
+# Clientes virtuales en hilos, cada uno con su sesión keep-alive de
+# requests, que repiten una petición sin pausa durante `duracion` segundos.
+# Se reportan p50/p95/p99 y los códigos de respuesta por grupo.
+#
+#   login: p99 de una ruta de lectura (encuentros del paciente por la API)
+#          primero sola y luego durante una tormenta de POST /token. Con el
+#          pool de hashing de app/utils.py la lectura debe mantenerse plana
+#          y los logins que no caben recibir 429. Con --tolerancia termina
+#          con código 1 si el p99 de la lectura crece más que ese factor.
+#
+#   clinicos: N médicos (500 por defecto) abriendo el dashboard y buscando
+#          pacientes con su historial, contra uno o varios servidores. Para
+#          comparar la ruta síncrona con la asíncrona se levantan dos
+#          instancias (DB_ASYNC=0 y DB_ASYNC=1) y se pasan ambas con --url.
+#          Con cientos de hilos el generador compite por el GIL: conviene
+#          correrlo en otra máquina que el servidor.
+#
+#   pdf:   N pacientes pidiendo su historia en PDF a la vez, mientras otros
+#          clientes leen encuentros. Mide el tiempo hasta tener el PDF en
+#          frío (generación en el pool de app/cola_pdf.py; requiere un
+#          PDF_CACHE_DIR sin los PDF de esos pacientes) y de nuevo desde el
+#          caché, y el p99 de la lectura sin y con las exportaciones en curso:
+#          antes de la cola la exportación ocupaba el worker y la lectura
+#          esperaba detrás de ella.
+#
+# Uso: python -m app.carga login --url http://localhost:8000 --documento 3003 --password secreto
+#      python -m app.carga clinicos --url http://localhost:8000 --url http://localhost:8001 \
+#          --documento 1001 --password secreto --pacientes 3003,3004
+#      python -m app.carga pdf --url http://localhost:8000 --paciente 3003:secreto --paciente 3004:secreto
+
+def percentil(tiempos, p):
+    if not tiempos:
+        return 0.0
+    tiempos = sorted(tiempos)
+    return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))] * 1000
+
+class Registro:
+    """Latencias y códigos de respuesta de un grupo de clientes"""
+
+    def __init__(self):
+        self.tiempos = []
+        self.estados = Counter()
+        self._lock = threading.Lock()
+
+    def anotar(self, estado, segundos):
+        with self._lock:
+            self.tiempos.append(segundos)
+            self.estados[estado] += 1
+
+    def p99(self):
+        return percentil(self.tiempos, 0.99)
+
+    def resumen(self, duracion):
+        estados = ", ".join(f"{e}: {n}" for e, n in sorted(self.estados.items(), key=str))
+        return (f"{len(self.tiempos) / duracion:7.1f} req/s | p50 {percentil(self.tiempos, 0.5):7.1f} ms | "
+                f"p95 {percentil(self.tiempos, 0.95):7.1f} ms | p99 {self.p99():7.1f} ms | {estados}")
+
+def _cliente(salida, plazo, peticion, registro):
+    import requests
+
+    with requests.Session() as sesion:
+        salida.wait()
+        while time.monotonic() < plazo["hasta"]:
+            inicio = time.perf_counter()
+            try:
+                estado = peticion(sesion).status_code
+            except requests.RequestException as e:
+                estado = type(e).__name__
+            registro.anotar(estado, time.perf_counter() - inicio)
+
+def correr(grupos, duracion):
+    """grupos: [(registro, peticion, clientes)], todos a la vez durante `duracion` segundos"""
+    salida, plazo = threading.Event(), {}
+    hilos = [
+        threading.Thread(target=_cliente, args=(salida, plazo, peticion, registro), daemon=True)
+        for registro, peticion, clientes in grupos for _ in range(clientes)
+    ]
+    # Todos parten a la vez: con cientos de hilos, crear los últimos mientras
+    # los primeros ya envían peticiones puede tardar más que la medición
+    for hilo in hilos:
+        hilo.start()
+    plazo["hasta"] = time.monotonic() + duracion
+    salida.set()
+    for hilo in hilos:
+        hilo.join()
+
+def token(url, documento, password):
+    import requests
+
+    respuesta = requests.post(f"{url}/token", data={"username": documento, "password": password}, timeout=30)
+    if respuesta.status_code != 200:
+        sys.exit(f"❌ No se pudo iniciar sesión como {documento}: {respuesta.status_code} {respuesta.text[:200]}")
+    return respuesta.json()["access_token"]
+
+# --- Escenarios ---
+
+def tormenta_login(url, documento, password, clientes=20, tormenta=100, duracion=20.0, tolerancia=None):
+    cabeceras = {"Authorization": f"Bearer {token(url, documento, password)}"}
+
+    def lectura(sesion):
+        return sesion.get(f"{url}/api/pacientes/{documento}/encuentros",
+                          params={"limite": 20}, headers=cabeceras, timeout=30)
+
+    def login(sesion):
+        return sesion.post(f"{url}/token", data={"username": documento, "password": password}, timeout=30)
+
+    base = Registro()
+    print(f"--- {clientes} clientes leyendo encuentros durante {duracion:.0f}s, sin logins ---")
+    correr([(base, lectura, clientes)], duracion)
+    print(f"lectura {base.resumen(duracion)}")
+
+    durante, logins = Registro(), Registro()
+    print(f"--- Lo mismo con {tormenta} clientes haciendo login sin pausa ---")
+    correr([(durante, lectura, clientes), (logins, login, tormenta)], duracion)
+    print(f"lectura {durante.resumen(duracion)}")
+    print(f"login   {logins.resumen(duracion)}")
+
+    factor = durante.p99() / base.p99() if base.p99() else float("inf")
+    print(f"\np99 de la lectura: {base.p99():.1f} ms -> {durante.p99():.1f} ms (x{factor:.2f})")
+    if tolerancia and factor > tolerancia:
+        print(f"❌ La tormenta de logins degrada la lectura más de x{tolerancia:g}")
+        return 1
+    return 0
+
+def clinicos(urls, documento, password, pacientes, clientes=500, duracion=30.0):
+    """Mitad de los clientes en /dashboard y mitad en /medico/buscar_paciente, por servidor"""
+    resumen = []
+    for url in urls:
+        cookies = {"access_token": f"Bearer {token(url, documento, password)}"}
+
+        def dashboard(sesion, url=url):
+            return sesion.get(f"{url}/dashboard", cookies=cookies, allow_redirects=False, timeout=60)
+
+        def buscar(sesion, url=url):
+            return sesion.get(f"{url}/medico/buscar_paciente", params={"q_doc": random.choice(pacientes)},
+                              cookies=cookies, allow_redirects=False, timeout=60)
+
+        registros = {"dashboard": Registro(), "buscar": Registro()}
+        print(f"--- {url}: {clientes} médicos durante {duracion:.0f}s ---")
+        correr([(registros["dashboard"], dashboard, clientes // 2),
+                (registros["buscar"], buscar, clientes - clientes // 2)], duracion)
+        for nombre, registro in registros.items():
+            print(f"{nombre:<9} {registro.resumen(duracion)}")
+
+        tiempos = registros["dashboard"].tiempos + registros["buscar"].tiempos
+        errores = sum(n for r in registros.values() for e, n in r.estados.items() if e != 200)
+        resumen.append((url, len(tiempos) / duracion, percentil(tiempos, 0.5), percentil(tiempos, 0.99), errores))
+
+    print(f"\n{'servidor':<28} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'no 200':>7}")
+    for url, por_segundo, p50, p99, errores in resumen:
+        print(f"{url:<28} {por_segundo:>8.1f} {p50:>8.1f} {p99:>8.1f} {errores:>7}")
+
+PDF_ESPERA = 0.25  # Pausa entre consultas a la página de espera
+PDF_PLAZO = 300.0
+
+def _exportar(sesion, url, cookies):
+    """GET /exportar_pdf siguiendo la página de espera hasta recibir el PDF (o un error)"""
+    limite = time.monotonic() + PDF_PLAZO
+    respuesta = sesion.get(f"{url}/exportar_pdf", cookies=cookies, allow_redirects=False, timeout=60)
+    while time.monotonic() < limite:
+        if respuesta.status_code == 303:
+            destino = respuesta.headers["location"]
+        elif respuesta.status_code == 200 and respuesta.headers.get("content-type", "").startswith("text/html"):
+            time.sleep(PDF_ESPERA)  # Página de espera: el trabajo sigue en curso
+        else:
+            return respuesta
+        respuesta = sesion.get(f"{url}{destino}", cookies=cookies, allow_redirects=False, timeout=60)
+    return respuesta
+
+def exportaciones(url, pacientes, lectores=10, duracion=20.0):
+    """pacientes: [(documento, password)]; el primero es también el de las lecturas"""
+    import requests
+
+    cookies = [{"access_token": f"Bearer {token(url, d, p)}"} for d, p in pacientes]
+    documento = pacientes[0][0]
+    cabeceras = {"Authorization": cookies[0]["access_token"]}
+
+    def lectura(sesion):
+        return sesion.get(f"{url}/api/pacientes/{documento}/encuentros",
+                          params={"limite": 20}, headers=cabeceras, timeout=30)
+
+    def ronda(registro):
+        """Cada paciente exporta una vez, todos a la vez"""
+        salida = threading.Event()
+
+        def paciente(galletas):
+            with requests.Session() as sesion:
+                salida.wait()
+                inicio = time.perf_counter()
+                try:
+                    respuesta = _exportar(sesion, url, galletas)
+                    estado = respuesta.status_code if respuesta.headers.get(
+                        "content-type", "").startswith("application/pdf") else f"{respuesta.status_code} sin PDF"
+                except requests.RequestException as e:
+                    estado = type(e).__name__
+                registro.anotar(estado, time.perf_counter() - inicio)
+
+        hilos = [threading.Thread(target=paciente, args=(c,), daemon=True) for c in cookies]
+        for hilo in hilos:
+            hilo.start()
+        salida.set()
+        for hilo in hilos:
+            hilo.join()
+
+    base = Registro()
+    print(f"--- {lectores} clientes leyendo encuentros durante {duracion:.0f}s, sin exportaciones ---")
+    correr([(base, lectura, lectores)], duracion)
+    print(f"lectura   {base.resumen(duracion)}")
+
+    durante, frio, cache = Registro(), Registro(), Registro()
+    print(f"--- Lo mismo con {len(pacientes)} pacientes exportando su PDF a la vez ---")
+    lecturas = threading.Thread(target=correr, args=([(durante, lectura, lectores)], duracion))
+    lecturas.start()
+    ronda(frio)
+    lecturas.join()
+    print(f"lectura   {durante.resumen(duracion)}")
+
+    ronda(cache)
+    print(f"\n{'exportación':<12} {'p50 ms':>8} {'p99 ms':>8}  estados")
+    for nombre, registro in (("en frío", frio), ("desde caché", cache)):
+        estados = ", ".join(f"{e}: {n}" for e, n in sorted(registro.estados.items(), key=str))
+        print(f"{nombre:<12} {percentil(registro.tiempos, 0.5):>8.1f} {registro.p99():>8.1f}  {estados}")
+    factor = durante.p99() / base.p99() if base.p99() else float("inf")
+    print(f"\np99 de la lectura: {base.p99():.1f} ms -> {durante.p99():.1f} ms (x{factor:.2f})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pruebas de carga contra un servidor en ejecución")
+    escenarios = parser.add_subparsers(dest="escenario", required=True)
+
+    login = escenarios.add_parser("login", help="p99 de una ruta de lectura durante una tormenta de logins")
+    login.add_argument("--url", default="http://localhost:8000")
+    login.add_argument("--documento", required=True, help="paciente de prueba (lee sus propios encuentros)")
+    login.add_argument("--password", required=True)
+    login.add_argument("--clientes", type=int, default=20, help="clientes en la ruta de lectura")
+    login.add_argument("--tormenta", type=int, default=100, help="clientes haciendo login")
+    login.add_argument("--duracion", type=float, default=20.0, help="segundos por fase")
+    login.add_argument("--tolerancia", type=float, default=None,
+                       help="factor máximo de crecimiento del p99 de lectura (p. ej. 1.5)")
+
+    medicos = escenarios.add_parser("clinicos", help="médicos concurrentes en dashboard y búsqueda")
+    medicos.add_argument("--url", action="append", help="servidor a medir (repetible para comparar)")
+    medicos.add_argument("--documento", required=True, help="médico de prueba")
+    medicos.add_argument("--password", required=True)
+    medicos.add_argument("--pacientes", required=True, help="documentos a buscar, separados por coma")
+    medicos.add_argument("--clientes", type=int, default=500)
+    medicos.add_argument("--duracion", type=float, default=30.0, help="segundos por servidor")
+
+    exportar = escenarios.add_parser("pdf", help="exportaciones de PDF concurrentes (frío y caché)")
+    exportar.add_argument("--url", default="http://localhost:8000")
+    exportar.add_argument("--paciente", action="append", required=True,
+                          help="documento:password de un paciente (repetible, uno por exportación)")
+    exportar.add_argument("--lectores", type=int, default=10, help="clientes en la ruta de lectura")
+    exportar.add_argument("--duracion", type=float, default=20.0, help="segundos de lectura por fase")
+
+    args = parser.parse_args()
+    if args.escenario == "pdf":
+        pacientes = [tuple(p.split(":", 1)) for p in args.paciente]
+        if any(len(p) != 2 for p in pacientes):
+            parser.error("--paciente debe tener la forma documento:password")
+        exportaciones(args.url.rstrip("/"), pacientes, args.lectores, args.duracion)
+    if args.escenario == "login":
+        sys.exit(tormenta_login(args.url.rstrip("/"), args.documento, args.password,
+                                args.clientes, args.tormenta, args.duracion, args.tolerancia))
+    if args.escenario == "clinicos":
+        urls = [u.rstrip("/") for u in args.url or ["http://localhost:8000"]]
+        pacientes = [d.strip() for d in args.pacientes.split(",") if d.strip()]
+        clinicos(urls, args.documento, args.password, pacientes, args.clientes, args.duracion)
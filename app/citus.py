@@ -0,0 +1,297 @@
+import os
+import re
+import sys
+
+from sqlalchemy import text
+
+from .database import engine
+
+# ---------------------------------------------------------
+# DISTRIBUCIÓN EN CITUS
+# ---------------------------------------------------------
+# Las migraciones crean todas las tablas como tablas locales del coordinador,
+# así que Citus no reparte nada. Este paso (después de `alembic upgrade head`,
+# que agrega paciente_id y las llaves compuestas que Citus exige):
+#   - convierte catálogos y usuarios en tablas de referencia (copia completa
+#     en cada worker, para poder hacer JOIN localmente en cualquier shard),
+#   - distribuye encuentros_medicos y observaciones_clinicas por paciente_id,
+#     co-ubicadas: el historial de un paciente vive en un único shard y la
+#     consulta de la línea de tiempo se enruta a un solo worker.
+# Las tablas operativas (fhir_outbox, sync_checkpoints) quedan locales.
+# Es idempotente y se puede ejecutar en cada arranque.
+# Uso: python -m app.citus
+#
+# CITUS_WORKERS="host1:5432,host2:5432" registra los workers antes de
+# distribuir (si ya estaban registrados no pasa nada).
+
+CITUS_WORKERS = os.getenv("CITUS_WORKERS", "")
+CITUS_SHARD_COUNT = int(os.getenv("CITUS_SHARD_COUNT", "32"))
+
+# El orden importa: una tabla de referencia solo puede apuntar a otras de referencia
+TABLAS_REFERENCIA = ["roles", "tipos_documento", "sedes", "tipos_encuentro", "usuarios"]
+
+# (tabla, co-ubicar con)
+TABLAS_DISTRIBUIDAS = [
+    ("encuentros_medicos", None),
+    ("observaciones_clinicas", "encuentros_medicos"),
+]
+
+COLUMNA_DISTRIBUCION = "paciente_id"
+
+def citus_disponible(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'citus'"
+    )).first() is not None
+
+def registrar_workers(conn):
+    for nodo in filter(None, (n.strip() for n in CITUS_WORKERS.split(","))):
+        host, _, puerto = nodo.partition(":")
+        conn.execute(text("SELECT citus_add_node(:host, :puerto)"),
+                     {"host": host, "puerto": int(puerto or 5432)})
+        print(f"--- Worker {host}:{puerto or 5432} registrado ---")
+
+def tipo_tabla(conn, tabla):
+    """'n' = referencia, 'h' = distribuida, None = local"""
+    return conn.execute(text(
+        "SELECT partmethod FROM pg_dist_partition WHERE logicalrelid = CAST(:tabla AS regclass)"
+    ), {"tabla": tabla}).scalar()
+
+def distribuir(conn):
+    conn.execute(text(f"SET citus.shard_count = {CITUS_SHARD_COUNT}"))
+
+    for tabla in TABLAS_REFERENCIA:
+        if tipo_tabla(conn, tabla) is None:
+            conn.execute(text("SELECT create_reference_table(:tabla)"), {"tabla": tabla})
+            print(f"--- {tabla}: tabla de referencia ---")
+
+    for tabla, colocar_con in TABLAS_DISTRIBUIDAS:
+        if tipo_tabla(conn, tabla) is None:
+            conn.execute(text(
+                "SELECT create_distributed_table(:tabla, :columna, colocate_with => :colocar_con)"
+            ), {"tabla": tabla, "columna": COLUMNA_DISTRIBUCION, "colocar_con": colocar_con or "default"})
+            print(f"--- {tabla}: distribuida por {COLUMNA_DISTRIBUCION} ---")
+
+def preparar():
+    with engine.begin() as conn:
+        if not citus_disponible(conn):
+            print("⚠️ Extensión citus no disponible: las tablas quedan locales.")
+            return
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS citus"))
+
+    # citus_add_node y create_distributed_table copian datos entre nodos;
+    # cada paso en su propia transacción para no mantener bloqueos largos
+    with engine.begin() as conn:
+        registrar_workers(conn)
+    with engine.begin() as conn:
+        distribuir(conn)
+
+    print("✅ Esquema distribuido en Citus")
+
+def rebalancear():
+    """Registra CITUS_WORKERS y mueve shards a los nodos nuevos (Citus 11.1+)"""
+    with engine.begin() as conn:
+        registrar_workers(conn)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT citus_rebalance_start()"))
+        conn.execute(text("SELECT citus_rebalance_wait()"))
+        conn.commit()
+    print("✅ Shards repartidos entre los workers")
+
+# ---------------------------------------------------------
+# MEDICIÓN DEL ESCALADO (lecturas de historial)
+# ---------------------------------------------------------
+# Siembra historiales sintéticos (pacientes SIM... de app/busqueda.py) y
+# mide lecturas concurrentes de la línea de tiempo completa de pacientes al
+# azar, la consulta que la distribución por paciente_id enruta a un solo
+# shard. El escalado se ve midiendo con el coordinador solo y de nuevo tras
+# agregar workers:
+#   python -m app.citus sembrar 20000 40 3     (pacientes, encuentros y observaciones por encuentro)
+#   python -m app.citus medir --clientes 32
+#   docker compose --profile citus-workers up -d
+#   CITUS_WORKERS="citus_worker1:5432,citus_worker2:5432" python -m app.citus rebalancear
+#   python -m app.citus medir --clientes 32
+#   python -m app.citus limpiar
+# El reporte incluye los nodos con shards y cuántas tareas (shards) genera
+# la consulta de encuentros de un paciente: debe ser 1.
+
+LOTE_PACIENTES = 2000
+
+# Los encuentros se reparten entre todos los médicos existentes (con uno
+# solo el planificador ve medico_id constante y elige otros planes)
+SQL_SEMBRAR_ENCUENTROS = text("""
+    WITH medicos AS (
+        SELECT array_agg(m.id) AS ids FROM usuarios m JOIN roles r ON r.id = m.rol_id WHERE r.nombre = 'Medico'
+    )
+    INSERT INTO encuentros_medicos (paciente_id, medico_id, sede_id, tipo_id, fecha, diagnostico, tratamiento)
+    SELECT u.id,
+           COALESCE(medicos.ids[1 + (u.id + g) % cardinality(medicos.ids)], u.id),
+           u.sede_id,
+           (SELECT min(id) FROM tipos_encuentro),
+           now() - g * interval '7 days',
+           'Control ' || g,
+           'Reposo'
+    FROM usuarios u CROSS JOIN generate_series(1, :encuentros) AS g CROSS JOIN medicos
+    WHERE u.numero_documento LIKE :patron AND u.id BETWEEN :desde AND :hasta
+""")
+
+SQL_SEMBRAR_OBSERVACIONES = text("""
+    INSERT INTO observaciones_clinicas (paciente_id, encuentro_id, sede_id, fecha, descripcion, valor, unidad)
+    SELECT e.paciente_id, e.id, e.sede_id, e.fecha,
+           (ARRAY['Frecuencia cardiaca', 'Temperatura', 'Presión sistólica'])[1 + g % 3],
+           (60 + (e.id + g) % 40)::text,
+           (ARRAY['bpm', '°C', 'mmHg'])[1 + g % 3]
+    FROM encuentros_medicos e
+    JOIN usuarios u ON u.id = e.paciente_id
+    CROSS JOIN generate_series(1, :observaciones) AS g
+    WHERE u.numero_documento LIKE :patron AND e.paciente_id BETWEEN :desde AND :hasta
+""")
+
+def _patron():
+    from .busqueda import PREFIJO_SINTETICO
+    return PREFIJO_SINTETICO + "%"
+
+def _ids_sinteticos(conn):
+    return conn.execute(text("SELECT id FROM usuarios WHERE numero_documento LIKE :patron ORDER BY id"),
+                        {"patron": _patron()}).scalars().all()
+
+def sembrar_historiales(conn, patron, desde, hasta, encuentros, observaciones):
+    """Encuentros y observaciones para los usuarios con documento LIKE `patron` e id en [desde, hasta]"""
+    rango = {"patron": patron, "desde": desde, "hasta": hasta}
+    conn.execute(SQL_SEMBRAR_ENCUENTROS, {**rango, "encuentros": encuentros})
+    # Invalida los planes en caché de la conexión (p. ej. el de la revisión de
+    # la llave foránea observación -> encuentro, planeado con la tabla casi
+    # vacía como un Seq Scan por fila)
+    conn.execute(text("ANALYZE encuentros_medicos"))
+    conn.execute(SQL_SEMBRAR_OBSERVACIONES, {**rango, "observaciones": observaciones})
+
+def sembrar(pacientes, encuentros=40, observaciones=3):
+    from . import busqueda
+
+    with engine.connect() as conn:
+        if conn.execute(text("""
+            SELECT 1 FROM encuentros_medicos e JOIN usuarios u ON u.id = e.paciente_id
+            WHERE u.numero_documento LIKE :patron LIMIT 1
+        """), {"patron": _patron()}).first():
+            sys.exit("❌ Ya hay historiales sintéticos: python -m app.citus limpiar")
+
+    busqueda.sembrar(pacientes)
+    with engine.connect() as conn:
+        ids = _ids_sinteticos(conn)
+    for i in range(0, len(ids), LOTE_PACIENTES):
+        with engine.begin() as conn:
+            sembrar_historiales(conn, _patron(), ids[i], ids[min(i + LOTE_PACIENTES, len(ids)) - 1],
+                                encuentros, observaciones)
+        print(f"--- Historiales: {min(i + LOTE_PACIENTES, len(ids))}/{len(ids)} pacientes ---")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE encuentros_medicos, observaciones_clinicas"))
+
+def limpiar():
+    from . import busqueda
+
+    with engine.begin() as conn:
+        for tabla in ("observaciones_clinicas", "encuentros_medicos"):
+            borrados = conn.execute(text(
+                f"DELETE FROM {tabla} t USING usuarios u WHERE u.id = t.paciente_id AND u.numero_documento LIKE :patron"
+            ), {"patron": _patron()}).rowcount
+            print(f"🗑️ {borrados} filas sintéticas de {tabla} eliminadas")
+    busqueda.limpiar()
+
+def _topologia(db, paciente_id):
+    """(nodos con shards, tareas de la consulta de encuentros de un paciente) o (None, None) sin Citus"""
+    from . import indices, timeline
+
+    if db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'citus'")).first() is None:
+        return None, None
+    nodos = db.execute(text(
+        "SELECT count(*) FROM pg_dist_node WHERE isactive AND noderole = 'primary' AND shouldhaveshards"
+    )).scalar()
+    plan = "\n".join(db.execute(text(
+        f"EXPLAIN {indices.sql_literal(timeline._consulta_encuentros(db, paciente_id))}"
+    )).scalars())
+    tareas = re.search(r"Task Count: (\d+)", plan)
+    return nodos, int(tareas.group(1)) if tareas else None
+
+def medir(clientes=16, duracion=20.0):
+    import random
+    import threading
+    import time
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from . import timeline
+    from .carga import Registro
+
+    # Un motor propio con una conexión por cliente: el pool de la aplicación
+    # (DB_POOL_SIZE) haría esperar a los hilos y mediría la espera del pool
+    motor = create_engine(engine.url, pool_size=clientes, max_overflow=0)
+    Sesion = sessionmaker(bind=motor)
+
+    with Sesion() as db:
+        ids = _ids_sinteticos(db)
+        if not ids:
+            sys.exit("❌ No hay historiales sintéticos: python -m app.citus sembrar")
+        nodos, tareas = _topologia(db, ids[0])
+        encuentros = len(timeline.construir_timeline(db, ids[0]))
+
+    if nodos is None:
+        print("ℹ️ Sin Citus: las tablas son locales")
+    else:
+        print(f"--- Citus: {nodos} nodos con shards, {tareas} tarea(s) por historial ---")
+    print(f"--- {clientes} clientes leyendo historiales de {len(ids)} pacientes "
+          f"(~{encuentros} encuentros c/u) durante {duracion:.0f}s ---")
+
+    registro = Registro()
+    salida, plazo = threading.Event(), {}
+
+    def cliente():
+        with Sesion() as db:
+            salida.wait()
+            while time.monotonic() < plazo["hasta"]:
+                inicio = time.perf_counter()
+                try:
+                    timeline.construir_timeline(db, random.choice(ids))
+                    estado = "ok"
+                except Exception as e:
+                    estado = type(e).__name__
+                db.rollback()
+                registro.anotar(estado, time.perf_counter() - inicio)
+
+    hilos = [threading.Thread(target=cliente, daemon=True) for _ in range(clientes)]
+    for hilo in hilos:
+        hilo.start()
+    plazo["hasta"] = time.monotonic() + duracion
+    salida.set()
+    for hilo in hilos:
+        hilo.join()
+    motor.dispose()
+
+    print(f"historial {registro.resumen(duracion)}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Distribución de tablas en Citus y medición del escalado")
+    ordenes = parser.add_subparsers(dest="orden")
+    ordenes.add_parser("preparar", help="distribuye las tablas (orden por defecto)")
+    ordenes.add_parser("rebalancear", help="registra CITUS_WORKERS y reparte los shards")
+    orden_sembrar = ordenes.add_parser("sembrar", help="historiales sintéticos")
+    orden_sembrar.add_argument("pacientes", type=int, nargs="?", default=20_000)
+    orden_sembrar.add_argument("encuentros", type=int, nargs="?", default=40)
+    orden_sembrar.add_argument("observaciones", type=int, nargs="?", default=3)
+    orden_medir = ordenes.add_parser("medir", help="lecturas concurrentes de historial")
+    orden_medir.add_argument("--clientes", type=int, default=16)
+    orden_medir.add_argument("--duracion", type=float, default=20.0)
+    ordenes.add_parser("limpiar", help="borra los historiales sintéticos")
+    args = parser.parse_args()
+
+    if args.orden == "rebalancear":
+        rebalancear()
+    elif args.orden == "sembrar":
+        sembrar(args.pacientes, args.encuentros, args.observaciones)
+    elif args.orden == "medir":
+        medir(args.clientes, args.duracion)
+    elif args.orden == "limpiar":
+        limpiar()
+    else:
+        preparar()
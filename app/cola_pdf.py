@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import metricas, pdf, timeline
+
+# ---------------------------------------------------------
+# COLA DE GENERACIÓN DE PDF
+# ---------------------------------------------------------
+# Renderizar la historia (Jinja + motor de PDF) consume CPU durante segundos en
+# historias largas. Se hace en un pool de procesos y el resultado queda en
+# disco con el nombre "<usuarios.id>-v<versión>.pdf", donde la versión es la
+# mayor `version` del historial (timeline.version_historial). Mientras no
+# haya un encuentro u observación nuevos, las descargas siguientes se sirven
+# directamente del archivo; un cambio en el historial produce otra versión
+# y las anteriores se borran al generar la nueva (nunca las posteriores: un
+# trabajo atrasado no borra el PDF de un historial más reciente).
+#
+# El id del trabajo es el mismo nombre del archivo. El estado se comparte
+# por disco entre los workers de uvicorn:
+#   <trabajo>.lock   trabajo en curso; se crea con O_EXCL, así que un solo
+#                    worker lo encola aunque lleguen peticiones a varios
+#   <trabajo>.error  último error, para responder ERROR desde cualquier worker
+# Un .lock más viejo que PDF_BLOQUEO_TTL (un worker que murió con el trabajo
+# en curso) se da por abandonado y se vuelve a tomar.
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "/tmp/hce_pdf")
+PDF_BLOQUEO_TTL = float(os.getenv("PDF_BLOQUEO_TTL", "600"))
+
+LISTO = "listo"
+EN_PROCESO = "en_proceso"
+ERROR = "error"
+DESCONOCIDO = "desconocido"
+
+_pool = None
+_pool_lock = threading.Lock()
+_trabajos = {}  # trabajo_id -> Future (solo los encolados por este proceso)
+_trabajos_lock = threading.Lock()
+_estado = {"aciertos": 0, "generados": 0, "errores": 0}
+
+_TRABAJO = re.compile(r"(\d+)-v(\d+)")
+
+def trabajo_id_de(paciente_id, version):
+    return f"{paciente_id}-v{version}"
+
+def ruta_de(trabajo_id):
+    return os.path.join(PDF_CACHE_DIR, f"{trabajo_id}.pdf")
+
+def pertenece(trabajo_id, paciente_id):
+    """Un paciente solo puede consultar sus propios trabajos (y el id no puede salir del directorio)"""
+    partes = _TRABAJO.fullmatch(trabajo_id)
+    return partes is not None and int(partes.group(1)) == paciente_id
+
+def _ruta_bloqueo(trabajo_id):
+    return os.path.join(PDF_CACHE_DIR, f"{trabajo_id}.lock")
+
+def _ruta_error(trabajo_id):
+    return os.path.join(PDF_CACHE_DIR, f"{trabajo_id}.error")
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+def _tomar(trabajo_id):
+    """True si este proceso queda a cargo del trabajo; False si otro ya lo tiene"""
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    bloqueo = _ruta_bloqueo(trabajo_id)
+    for _ in range(2):
+        try:
+            fd = os.open(bloqueo, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(bloqueo) < PDF_BLOQUEO_TTL:
+                    return False
+            except FileNotFoundError:
+                continue  # Se liberó entre los dos pasos
+            # Abandonado: se borra y el O_EXCL siguiente decide quién lo toma
+            _borrar(bloqueo)
+            continue
+        with os.fdopen(fd, "w") as archivo:
+            archivo.write(str(os.getpid()))
+        return True
+    return False
+
+def _en_curso(trabajo_id):
+    try:
+        return time.time() - os.path.getmtime(_ruta_bloqueo(trabajo_id)) < PDF_BLOQUEO_TTL
+    except FileNotFoundError:
+        return False
+
+def limpiar_anteriores(paciente_id, version):
+    """Borra los PDF (y errores registrados) del paciente con versión menor a `version`"""
+    patron = re.compile(rf"{paciente_id}-v(\d+)\.(pdf|error)")
+    for nombre in os.listdir(PDF_CACHE_DIR):
+        coincide = patron.fullmatch(nombre)
+        if coincide and int(coincide.group(1)) < version:
+            _borrar(os.path.join(PDF_CACHE_DIR, nombre))
+
+# --- Ejecución dentro de los procesos del pool ---
+
+def _iniciar_proceso():
+    # El motor y la plantilla se cargan al crear el proceso, no en el primer PDF
+    from . import motores_pdf, plantillas
+    motores_pdf.motor()
+    plantillas.precompilar("pdf_template.html", "pdf_estilos.css")
+
+def _generar(paciente_id, trabajo_id):
+    from .database import SessionLocal
+
+    # Escritura atómica: nadie llega a servir un archivo a medio escribir.
+    # El historial se lee en streaming mientras se renderiza.
+    ruta = ruta_de(trabajo_id)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    db = SessionLocal()
+    try:
+        context = pdf.contexto_pdf(
+            pdf.cargar_paciente(db, paciente_id),
+            timeline.HistorialEnStreaming(db, paciente_id),
+        )
+        with open(temporal, "wb") as destino:
+            # Un fallo del motor (ErrorPdf) queda en el Future: ver _al_terminar
+            pdf.renderizar_pdf(context, destino)
+        os.replace(temporal, ruta)
+    finally:
+        db.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    limpiar_anteriores(paciente_id, int(_TRABAJO.fullmatch(trabajo_id).group(2)))
+    return ruta
+
+# --- Lado del servidor web ---
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: un fork del proceso web (con hilos) podría heredar locks
+            # tomados; el proceso nuevo tampoco hereda conexiones a la base
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=_iniciar_proceso,
+                                        mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+def _al_terminar(trabajo_id, futuro):
+    if futuro.exception() is None:
+        _estado["generados"] += 1
+    else:
+        _estado["errores"] += 1
+        print(f"❌ PDF {trabajo_id}: {futuro.exception()}")
+        # Antes de soltar el bloqueo: ningún worker debe verlo DESCONOCIDO entretanto
+        with open(_ruta_error(trabajo_id), "w") as archivo:
+            archivo.write(str(futuro.exception()))
+    _borrar(_ruta_bloqueo(trabajo_id))
+    with _trabajos_lock:
+        _trabajos.pop(trabajo_id, None)
+
+def solicitar(db, paciente_id):
+    """
+    Retorna (trabajo_id, ruta). `ruta` es el PDF ya generado para la versión
+    actual del historial, o None si quedó encolado aquí o en otro worker
+    (consultar `estado`).
+    """
+    trabajo_id = trabajo_id_de(paciente_id, timeline.version_historial(db, paciente_id))
+    ruta = ruta_de(trabajo_id)
+    if os.path.exists(ruta):
+        _estado["aciertos"] += 1
+        return trabajo_id, ruta
+
+    if not _tomar(trabajo_id):
+        return trabajo_id, None
+    # Otro worker pudo terminarlo entre la primera revisión y el bloqueo
+    if os.path.exists(ruta):
+        _borrar(_ruta_bloqueo(trabajo_id))
+        _estado["aciertos"] += 1
+        return trabajo_id, ruta
+
+    # Un trabajo fallido se reintenta al volver a solicitarlo
+    _borrar(_ruta_error(trabajo_id))
+    try:
+        futuro = _obtener_pool().submit(_generar, paciente_id, trabajo_id)
+    except Exception:
+        _borrar(_ruta_bloqueo(trabajo_id))
+        raise
+    with _trabajos_lock:
+        _trabajos[trabajo_id] = futuro
+    futuro.add_done_callback(lambda f: _al_terminar(trabajo_id, f))
+    return trabajo_id, None
+
+def estado(trabajo_id):
+    """{"trabajo_id", "estado", "error"}, visto desde cualquier worker"""
+    if os.path.exists(ruta_de(trabajo_id)):
+        return {"trabajo_id": trabajo_id, "estado": LISTO, "error": None}
+    if _en_curso(trabajo_id):
+        return {"trabajo_id": trabajo_id, "estado": EN_PROCESO, "error": None}
+    try:
+        with open(_ruta_error(trabajo_id)) as archivo:
+            return {"trabajo_id": trabajo_id, "estado": ERROR, "error": archivo.read()}
+    except FileNotFoundError:
+        return {"trabajo_id": trabajo_id, "estado": DESCONOCIDO, "error": None}
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _pendientes():
+    with _trabajos_lock:
+        return sum(1 for f in _trabajos.values() if not f.done())
+
+metricas.registrar("hce_pdf_pendientes", "gauge",
+                   "PDF en cola o generándose", _pendientes)
+metricas.registrar("hce_pdf_cache_aciertos_total", "counter",
+                   "Descargas servidas desde el PDF ya generado", lambda: _estado["aciertos"])
+metricas.registrar("hce_pdf_generados_total", "counter",
+                   "PDF generados por el pool", lambda: _estado["generados"])
+metricas.registrar("hce_pdf_errores_total", "counter",
+                   "PDF que fallaron al generarse", lambda: _estado["errores"])
@@ -1,6 +1,13 @@
-import requests
-import json
 import os
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .cache import CacheTTL
+
+logger = logging.getLogger(__name__)
 
 # URL del servidor HAPI FHIR
 # Lee desde variable de entorno o usa localhost por defecto
@@ -9,14 +16,166 @@ FHIR_PORT = os.getenv("FHIR_PORT", "8080")
 
 FHIR_SERVER_URL = f"http://{FHIR_HOST}:{FHIR_PORT}/fhir"
 
+# Tiempos máximos (segundos): conexión TCP y lectura de la respuesta de HAPI
+FHIR_CONNECT_TIMEOUT = float(os.getenv("FHIR_CONNECT_TIMEOUT", "3.05"))
+FHIR_TIMEOUT = float(os.getenv("FHIR_TIMEOUT", "10"))
+
+# Conexiones keep-alive reutilizables y reintentos ante 429/5xx
+FHIR_POOL_SIZE = int(os.getenv("FHIR_POOL_SIZE", "20"))
+FHIR_REINTENTOS = int(os.getenv("FHIR_REINTENTOS", "3"))
+FHIR_BACKOFF = float(os.getenv("FHIR_BACKOFF", "0.5"))
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Recursos por Bundle en envíos masivos
+FHIR_BUNDLE_SIZE = int(os.getenv("FHIR_BUNDLE_SIZE", "100"))
+
 # ---------------------------------------------------------
-# FUNCIONES DE ESCRITURA (SQL -> FHIR)
+# CLIENTE HTTP (conexiones persistentes)
 # ---------------------------------------------------------
+# Todas las funciones del módulo usan el mismo `cliente`, que mantiene un
+# pool de conexiones keep-alive hacia HAPI en lugar de abrir un socket por
+# petición. Los reintentos incluyen PUT y POST porque todo lo que se envía
+# son PUT con id fijo (o Bundles de PUTs), que son idempotentes.
 
-def sync_patient_to_fhir(usuario_sql):
-    """Sincroniza Paciente construyendo el JSON manualmente (FHIR R4)"""
-    print(f"--- Sincronizando Paciente: {usuario_sql.nombres} ---")
-    
+class FhirClient:
+    def __init__(
+        self,
+        base_url=FHIR_SERVER_URL,
+        connect_timeout=FHIR_CONNECT_TIMEOUT,
+        read_timeout=FHIR_TIMEOUT,
+        pool_size=FHIR_POOL_SIZE,
+        reintentos=FHIR_REINTENTOS,
+        backoff=FHIR_BACKOFF,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self._config = (pool_size, reintentos, backoff)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """requests se importa y la sesión se crea en la primera petición, no al arrancar"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._crear_sesion(*self._config)
+        return self._session
+
+    @staticmethod
+    def _crear_sesion(pool_size, reintentos, backoff):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=reintentos,
+            backoff_factor=backoff,
+            status_forcelist=ESTADOS_REINTENTABLES,
+            allowed_methods=frozenset(["GET", "PUT", "POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({
+            "Accept": "application/fhir+json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        return session
+
+    def url(self, ruta):
+        """Acepta rutas relativas ("Patient/pac-1") o URLs completas (links de paginación)"""
+        if ruta.startswith("http://") or ruta.startswith("https://"):
+            return ruta
+        return f"{self.base_url}/{ruta.lstrip('/')}" if ruta else self.base_url
+
+    def get(self, ruta, params=None, headers=None):
+        return self.session.get(self.url(ruta), params=params, headers=headers, timeout=self.timeout)
+
+    def put(self, ruta, recurso):
+        headers = {"Content-Type": "application/fhir+json"}
+        return self.session.put(self.url(ruta), json=recurso, headers=headers, timeout=self.timeout)
+
+    def post(self, ruta, recurso):
+        headers = {"Content-Type": "application/fhir+json"}
+        return self.session.post(self.url(ruta), json=recurso, headers=headers, timeout=self.timeout)
+
+    def cerrar(self):
+        if self._session is not None:
+            self._session.close()
+
+class FhirClientAsync:
+    """Variante asyncio (httpx) con la misma configuración. httpx se importa al crearla."""
+
+    def __init__(
+        self,
+        base_url=FHIR_SERVER_URL,
+        connect_timeout=FHIR_CONNECT_TIMEOUT,
+        read_timeout=FHIR_TIMEOUT,
+        pool_size=FHIR_POOL_SIZE,
+        reintentos=FHIR_REINTENTOS,
+        backoff=FHIR_BACKOFF,
+    ):
+        import httpx
+
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={"Accept": "application/fhir+json", "Accept-Encoding": "gzip, deflate"},
+        )
+
+    url = FhirClient.url
+
+    def _espera(self, intento, response):
+        """Segundos de Retry-After si HAPI lo envía (429/503); si no, backoff exponencial"""
+        espera = self.backoff * (2 ** intento)
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            espera = max(espera, float(retry_after))
+        return espera
+
+    async def _enviar(self, metodo, ruta, **kwargs):
+        intento = 0
+        while True:
+            response = None
+            try:
+                response = await self.client.request(metodo, self.url(ruta), **kwargs)
+                if response.status_code not in ESTADOS_REINTENTABLES or intento >= self.reintentos:
+                    return response
+            except self._httpx.TransportError:
+                if intento >= self.reintentos:
+                    raise
+            await asyncio.sleep(self._espera(intento, response))
+            intento += 1
+
+    async def get(self, ruta, params=None, headers=None):
+        return await self._enviar("GET", ruta, params=params, headers=headers)
+
+    async def put(self, ruta, recurso):
+        return await self._enviar("PUT", ruta, json=recurso, headers={"Content-Type": "application/fhir+json"})
+
+    async def post(self, ruta, recurso):
+        return await self._enviar("POST", ruta, json=recurso, headers={"Content-Type": "application/fhir+json"})
+
+    async def cerrar(self):
+        await self.client.aclose()
+
+cliente = FhirClient()
+
+# ---------------------------------------------------------
+# CONSTRUCCIÓN DE RECURSOS (SQL -> JSON FHIR R4)
+# ---------------------------------------------------------
+
+def construir_patient(usuario_sql):
+    """Construye el recurso Patient manualmente (FHIR R4)"""
     fhir_id = f"pac-{usuario_sql.numero_documento}"
     
     patient_json = {
@@ -41,16 +200,26 @@ def sync_patient_to_fhir(usuario_sql):
     if usuario_sql.fecha_nacimiento:
         patient_json["birthDate"] = str(usuario_sql.fecha_nacimiento)
 
-    url = f"{FHIR_SERVER_URL}/Patient/{fhir_id}"
-    return enviar_a_hapi(url, patient_json)
+    return patient_json
 
-def sync_encounter_to_fhir(encuentro_sql):
-    """Sincroniza Encuentro (Cita)"""
-    print(f"--- Sincronizando Encuentro ID: {encuentro_sql.id} ---")
-    
+def construir_reason_code(encuentro_sql):
+    """Diagnóstico como CodeableConcept: texto libre y, si existe, el concepto SNOMED CT"""
+    reason = {"text": encuentro_sql.diagnostico}
+    if encuentro_sql.codigo_snomed:
+        reason["coding"] = [
+            {
+                "system": "http://snomed.info/sct",
+                "code": encuentro_sql.codigo_snomed,
+                "display": encuentro_sql.diagnostico
+            }
+        ]
+    return reason
+
+def construir_encounter(encuentro_sql):
+    """Construye el recurso Encounter (Cita)"""
     fhir_id = f"enc-{encuentro_sql.id}"
     
-    encounter_json = {
+    return {
         "resourceType": "Encounter",
         "id": fhir_id,
         "status": "finished",
@@ -62,17 +231,7 @@ def sync_encounter_to_fhir(encuentro_sql):
         "subject": {
             "reference": f"Patient/pac-{encuentro_sql.paciente.numero_documento}"
         },
-        "reasonCode": [
-            {
-                "coding": [
-                    {
-                        "system": "http://snomed.info/sct",
-                        "code": "390906004", 
-                        "display": encuentro_sql.diagnostico
-                    }
-                ]
-            }
-        ],
+        "reasonCode": [construir_reason_code(encuentro_sql)],
         "location": [
             {
                 "location": {
@@ -81,14 +240,9 @@ def sync_encounter_to_fhir(encuentro_sql):
             }
         ]
     }
-    
-    url = f"{FHIR_SERVER_URL}/Encounter/{fhir_id}"
-    return enviar_a_hapi(url, encounter_json)
 
-def sync_observation_to_fhir(obs_sql, paciente_doc):
-    """Sincroniza Observación (Signos vitales)"""
-    print(f"--- Sincronizando Observación ID: {obs_sql.id} ---")
-    
+def construir_observation(obs_sql, paciente_doc):
+    """Construye el recurso Observation (Signos vitales)"""
     fhir_id = f"obs-{obs_sql.id}"
     
     try:
@@ -125,70 +279,292 @@ def sync_observation_to_fhir(obs_sql, paciente_doc):
     }
     
     observation_json.update(value_entry)
-    
-    url = f"{FHIR_SERVER_URL}/Observation/{fhir_id}"
+    return observation_json
+
+# ---------------------------------------------------------
+# FUNCIONES DE ESCRITURA (SQL -> FHIR)
+# ---------------------------------------------------------
+
+def sync_patient_to_fhir(usuario_sql):
+    """Sincroniza Paciente construyendo el JSON manualmente (FHIR R4)"""
+    logger.debug("Sincronizando Paciente %s", usuario_sql.numero_documento)
+    patient_json = construir_patient(usuario_sql)
+    url = f"{FHIR_SERVER_URL}/Patient/{patient_json['id']}"
+    return enviar_a_hapi(url, patient_json)
+
+def sync_encounter_to_fhir(encuentro_sql):
+    """Sincroniza Encuentro (Cita)"""
+    logger.debug("Sincronizando Encuentro %s", encuentro_sql.id)
+    encounter_json = construir_encounter(encuentro_sql)
+    url = f"{FHIR_SERVER_URL}/Encounter/{encounter_json['id']}"
+    return enviar_a_hapi(url, encounter_json)
+
+def sync_observation_to_fhir(obs_sql, paciente_doc):
+    """Sincroniza Observación (Signos vitales)"""
+    logger.debug("Sincronizando Observación %s", obs_sql.id)
+    observation_json = construir_observation(obs_sql, paciente_doc)
+    url = f"{FHIR_SERVER_URL}/Observation/{observation_json['id']}"
     return enviar_a_hapi(url, observation_json)
 
+def sync_visit_to_fhir(encuentro_sql):
+    """Sincroniza un Encuentro y todas sus Observaciones en una sola transacción FHIR"""
+    logger.debug("Sincronizando atención completa (Encuentro %s)", encuentro_sql.id)
+    paciente_doc = encuentro_sql.paciente.numero_documento
+    recursos = [construir_encounter(encuentro_sql)]
+    recursos += [construir_observation(obs, paciente_doc) for obs in encuentro_sql.observaciones]
+    resultados = enviar_bundle(recursos, tipo="transaction")
+    return all(r.ok for r in resultados)
+
 def enviar_a_hapi(url, data_json):
-    headers = {"Content-Type": "application/fhir+json"}
     try:
-        response = requests.put(url, json=data_json, headers=headers)
+        response = cliente.put(url, data_json)
         if response.status_code in [200, 201]:
-            print(f"✅ Sincronizado OK: {url.split('/')[-1]}")
+            logger.debug("✅ Sincronizado OK: %s", url.split('/')[-1])
+            _invalidar_por_recursos([data_json])
             return True
         else:
-            print(f"❌ Error HAPI {response.status_code}: {response.text}")
+            logger.error("❌ Error HAPI %s: %s", response.status_code, response.text)
             return False
     except Exception as e:
-        print(f"❌ Error Conexión: {e}")
+        logger.error("❌ Error Conexión: %s", e)
         return False
 
 # ---------------------------------------------------------
-# FUNCIONES DE LECTURA (FHIR -> FRONTEND)
+# BUNDLES (varios recursos en una sola petición HTTP)
 # ---------------------------------------------------------
+# "transaction": HAPI aplica todo o nada (p. ej. un encuentro con sus observaciones).
+# "batch": cada entrada se procesa por separado y se reporta su resultado
+#          (sincronización masiva, donde un error no debe frenar al resto).
 
-def get_patient_observations(paciente_doc):
-    """
-    Busca todas las observaciones de un paciente específico en FHIR.
-    Esta es la función que te faltaba.
-    """
-    fhir_id = f"pac-{paciente_doc}"
-    
-    # Búsqueda FHIR: GET /fhir/Observation?subject=Patient/pac-{documento}
-    url = f"{FHIR_SERVER_URL}/Observation?subject=Patient/{fhir_id}"
-    headers = {"Accept": "application/fhir+json"}
-    
+@dataclass
+class ResultadoEntrada:
+    referencia: str             # "Patient/pac-3003"
+    ok: bool
+    estado: str                 # "201 Created", "400 Bad Request", ...
+    error: Optional[str] = None
+
+def referencia_de(recurso):
+    return f"{recurso['resourceType']}/{recurso['id']}"
+
+def construir_bundle(recursos, tipo="transaction"):
+    """Arma un Bundle transaction/batch con un PUT (idempotente) por recurso"""
+    return {
+        "resourceType": "Bundle",
+        "type": tipo,
+        "entry": [
+            {
+                "fullUrl": f"{FHIR_SERVER_URL}/{referencia_de(recurso)}",
+                "resource": recurso,
+                "request": {"method": "PUT", "url": referencia_de(recurso)}
+            }
+            for recurso in recursos
+        ]
+    }
+
+def _error_de_outcome(outcome):
+    issues = (outcome or {}).get("issue", [])
+    return "; ".join(i.get("diagnostics", i.get("code", "")) for i in issues) or None
+
+def _leer_respuesta_bundle(recursos, bundle_respuesta):
+    """Empareja cada entrada de la respuesta (mismo orden que la petición) con su recurso"""
+    resultados = []
+    entradas = bundle_respuesta.get("entry", [])
+    for recurso, entrada in zip(recursos, entradas):
+        respuesta = entrada.get("response", {})
+        estado = respuesta.get("status", "")
+        ok = estado[:1] == "2"
+        error = None if ok else (_error_de_outcome(respuesta.get("outcome")) or estado)
+        resultados.append(ResultadoEntrada(referencia_de(recurso), ok, estado, error))
+
+    # Si HAPI devolvió menos entradas de las enviadas, las faltantes se consideran fallidas
+    for recurso in recursos[len(entradas):]:
+        resultados.append(ResultadoEntrada(referencia_de(recurso), False, "", "Sin respuesta en el Bundle"))
+    return resultados
+
+def enviar_bundle(recursos, tipo="transaction") -> List[ResultadoEntrada]:
+    """Envía los recursos en un único Bundle (POST a la base FHIR) y reporta el resultado por entrada"""
+    if not recursos:
+        return []
+
+    bundle = construir_bundle(recursos, tipo)
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            # HAPI devuelve un Bundle. Retornamos los entries (observaciones).
-            bundle = response.json()
-            return bundle.get('entry', [])
-        else:
-            print(f"❌ Error buscando FHIR: {response.status_code}")
-            return []
+        response = cliente.post("", bundle)
     except Exception as e:
-        print(f"❌ Error conexión FHIR: {e}")
-        return []
-    
-def get_patient_encounters(paciente_doc):
+        logger.error("❌ Error Conexión: %s", e)
+        return [ResultadoEntrada(referencia_de(r), False, "", str(e)) for r in recursos]
+
+    if response.status_code != 200:
+        # En un transaction un error rechaza el Bundle completo
+        try:
+            error = _error_de_outcome(response.json())
+        except ValueError:
+            error = None
+        error = error or response.text[:500]
+        logger.error("❌ Error HAPI %s en Bundle %s: %s", response.status_code, tipo, error)
+        return [ResultadoEntrada(referencia_de(r), False, str(response.status_code), error) for r in recursos]
+
+    resultados = _leer_respuesta_bundle(recursos, response.json())
+    _invalidar_por_recursos(r for r, res in zip(recursos, resultados) if res.ok)
+    fallidos = [r for r in resultados if not r.ok]
+    logger.info("✅ Bundle %s: %s/%s recursos OK", tipo, len(resultados) - len(fallidos), len(resultados))
+    for r in fallidos:
+        logger.error("❌ %s: %s", r.referencia, r.error)
+    return resultados
+
+def enviar_en_lotes(recursos, tipo="batch", tamano=FHIR_BUNDLE_SIZE) -> List[ResultadoEntrada]:
+    """Divide un iterable de recursos en Bundles de `tamano` entradas"""
+    resultados = []
+    lote = []
+    for recurso in recursos:
+        lote.append(recurso)
+        if len(lote) >= tamano:
+            resultados += enviar_bundle(lote, tipo)
+            lote = []
+    if lote:
+        resultados += enviar_bundle(lote, tipo)
+    return resultados
+
+# ---------------------------------------------------------
+# BÚSQUEDAS PAGINADAS
+# ---------------------------------------------------------
+# HAPI entrega los resultados por páginas (link rel="next"). Estos
+# generadores siguen los enlaces a medida que el consumidor avanza, así
+# solo hay una página en memoria y los historiales largos no se truncan.
+# _count, _elements, _sort y _summary reducen el tamaño de cada respuesta.
+
+FHIR_PAGE_SIZE = int(os.getenv("FHIR_PAGE_SIZE", "200"))
+
+def _link_siguiente(bundle):
+    for link in bundle.get("link", []):
+        if link.get("relation") == "next":
+            return link.get("url")
+    return None
+
+def _parametros_busqueda(params=None, count=None, elements=None, sort=None, summary=None):
+    params = dict(params or {})
+    if count:
+        params["_count"] = count
+    if elements:
+        params["_elements"] = elements if isinstance(elements, str) else ",".join(elements)
+    if sort:
+        params["_sort"] = sort
+    if summary:
+        params["_summary"] = summary
+    return params
+
+def paginas_bundle(response):
+    """Genera cada página (Bundle) de una búsqueda, empezando por `response`"""
+    while True:
+        if response.status_code != 200:
+            raise RuntimeError(f"HAPI respondió {response.status_code}")
+        bundle = response.json()
+        yield bundle
+        siguiente = _link_siguiente(bundle)
+        if not siguiente:
+            return
+        response = cliente.get(siguiente)
+
+def buscar_recursos(tipo, params=None, count=FHIR_PAGE_SIZE, elements=None, sort=None, summary=None):
+    """Genera los entries de `tipo?params` recorriendo todas las páginas bajo demanda"""
+    params = _parametros_busqueda(params, count, elements, sort, summary)
+    for bundle in paginas_bundle(cliente.get(tipo, params=params)):
+        yield from bundle.get("entry", [])
+
+def iterar_observaciones_paciente(paciente_doc, **opciones):
+    """Observaciones del paciente página a página (sin caché). Ej: sort="-date", elements=["code", "valueQuantity"]"""
+    return buscar_recursos("Observation", {"subject": f"Patient/pac-{paciente_doc}"}, **opciones)
+
+def iterar_encuentros_paciente(paciente_doc, **opciones):
+    """Encuentros del paciente página a página (sin caché)"""
+    return buscar_recursos("Encounter", {"subject": f"Patient/pac-{paciente_doc}"}, **opciones)
+
+# ---------------------------------------------------------
+# CACHÉ DE BÚSQUEDAS (FHIR -> FRONTEND)
+# ---------------------------------------------------------
+# Las búsquedas por paciente se guardan en memoria (clave: documento + tipo
+# de recurso). Al vencer el TTL no se descarga todo otra vez: se revalida con
+# If-None-Match si HAPI dio ETag, o preguntando con _lastUpdated + _summary=count
+# si hubo cambios desde la última consulta. Las escrituras exitosas de este
+# proceso (PUT o Bundle, es decir el outbox y app.sync_fhir) invalidan las
+# entradas del paciente afectado.
+
+FHIR_CACHE_TTL = float(os.getenv("FHIR_CACHE_TTL", "60"))
+FHIR_CACHE_MAX = int(os.getenv("FHIR_CACHE_MAX", "512"))
+
+cache_busquedas = CacheTTL(max_entradas=FHIR_CACHE_MAX, ttl=FHIR_CACHE_TTL)
+
+@dataclass
+class BusquedaCacheada:
+    entries: list
+    etag: Optional[str]
+    consultado_en: Optional[str]   # Hora del servidor (instant FHIR) de la consulta
+
+def invalidar_paciente(paciente_doc):
+    cache_busquedas.invalidar_si(lambda clave: clave[0] == paciente_doc)
+
+def _doc_paciente(recurso):
+    """Documento del paciente al que pertenece el recurso (para invalidar su caché)"""
+    if recurso.get("resourceType") == "Patient":
+        referencia = f"Patient/{recurso.get('id', '')}"
+    else:
+        referencia = recurso.get("subject", {}).get("reference", "")
+    if referencia.startswith("Patient/pac-"):
+        return referencia[len("Patient/pac-"):]
+    return None
+
+def _invalidar_por_recursos(recursos):
+    for doc in {_doc_paciente(r) for r in recursos}:
+        if doc:
+            invalidar_paciente(doc)
+
+def _sin_cambios_desde(tipo, paciente_doc, consultado_en):
+    """True si HAPI confirma que no hay recursos del paciente modificados desde `consultado_en`"""
+    params = {
+        "subject": f"Patient/pac-{paciente_doc}",
+        "_lastUpdated": f"gt{consultado_en}",
+        "_summary": "count",
+    }
+    response = cliente.get(tipo, params=params)
+    return response.status_code == 200 and response.json().get("total", 1) == 0
+
+def buscar_por_paciente(tipo, paciente_doc):
     """
-    Busca todos los encuentros (citas/diagnósticos) de un paciente en FHIR.
+    Búsqueda `tipo?subject=Patient/pac-{doc}` (todas las páginas) con caché y
+    revalidación condicional. Lanza excepción si HAPI no responde.
     """
-    fhir_id = f"pac-{paciente_doc}"
-    
-    # Búsqueda FHIR: GET /fhir/Encounter?subject=Patient/pac-{documento}
-    url = f"{FHIR_SERVER_URL}/Encounter?subject=Patient/{fhir_id}"
-    headers = {"Accept": "application/fhir+json"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            bundle = response.json()
-            return bundle.get('entry', [])
-        else:
-            print(f"❌ Error buscando Encuentros FHIR: {response.status_code}")
-            return []
-    except Exception as e:
-        print(f"❌ Error conexión FHIR Encuentros: {e}")
-        return []
\ No newline at end of file
+    clave = (paciente_doc, tipo)
+    vigente = cache_busquedas.obtener(clave)
+    if vigente is not None:
+        return vigente.entries
+
+    anterior = cache_busquedas.obtener_vencido(clave)
+    params = _parametros_busqueda({"subject": f"Patient/pac-{paciente_doc}"}, count=FHIR_PAGE_SIZE)
+    headers = {}
+    if anterior is not None:
+        if anterior.etag:
+            headers["If-None-Match"] = anterior.etag
+        elif anterior.consultado_en and _sin_cambios_desde(tipo, paciente_doc, anterior.consultado_en):
+            cache_busquedas.refrescar(clave)
+            return anterior.entries
+
+    response = cliente.get(tipo, params=params, headers=headers or None)
+    if response.status_code == 304 and anterior is not None:
+        cache_busquedas.refrescar(clave)
+        return anterior.entries
+
+    entries = []
+    consultado_en = None
+    paginas = 0
+    for bundle in paginas_bundle(response):
+        if paginas == 0:
+            consultado_en = bundle.get("meta", {}).get("lastUpdated")
+        entries.extend(bundle.get("entry", []))
+        paginas += 1
+
+    cache_busquedas.guardar(clave, BusquedaCacheada(
+        entries=entries,
+        # El ETag solo describe la primera página; con varias se revalida por _lastUpdated
+        etag=response.headers.get("ETag") if paginas == 1 else None,
+        consultado_en=consultado_en,
+    ))
+    return entries
@@ -0,0 +1,255 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import fhir_client, models
+from .database import SessionLocal
+
+# ---------------------------------------------------------
+# BANDEJA DE SALIDA (OUTBOX) SQL -> FHIR
+# ---------------------------------------------------------
+# Las rutas no llaman a HAPI: registran el recurso en `fhir_outbox` dentro
+# de la misma transacción que los datos clínicos. Un pool de hilos en
+# segundo plano toma las filas pendientes y las envía en un Bundle batch de
+# PUTs (idempotentes gracias a los ids pac-/enc-/obs-), reintentando con
+# backoff exponencial.
+# Tras FHIR_OUTBOX_MAX_INTENTOS fallos la fila queda en estado "fallido"
+# (dead letter) para revisión manual.
+#
+# Reclamar una fila la confirma como "en_proceso" y libera su bloqueo, así
+# que una ruta puede volver a encolarla mientras se envía (con datos más
+# nuevos que los del Bundle). Por eso el resultado se registra con un
+# compare-and-set sobre el reclamo: si la fila ya no está en el reclamo de
+# este worker, se deja como la dejó encolar() y el cambio nuevo sale en la
+# siguiente vuelta.
+
+FHIR_OUTBOX_WORKERS = int(os.getenv("FHIR_OUTBOX_WORKERS", "2"))
+FHIR_OUTBOX_LOTE = int(os.getenv("FHIR_OUTBOX_LOTE", "20"))
+FHIR_OUTBOX_INTERVALO = float(os.getenv("FHIR_OUTBOX_INTERVALO", "1.0"))
+FHIR_OUTBOX_MAX_INTENTOS = int(os.getenv("FHIR_OUTBOX_MAX_INTENTOS", "8"))
+FHIR_OUTBOX_BACKOFF_BASE = float(os.getenv("FHIR_OUTBOX_BACKOFF_BASE", "2.0"))
+FHIR_OUTBOX_BACKOFF_MAX = float(os.getenv("FHIR_OUTBOX_BACKOFF_MAX", "600"))
+# Tiempo que una fila puede quedar "en_proceso" antes de considerarse abandonada
+FHIR_OUTBOX_LEASE = float(os.getenv("FHIR_OUTBOX_LEASE", "300"))
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+ERROR = "error"
+SINCRONIZADO = "sincronizado"
+FALLIDO = "fallido"
+
+def _ahora():
+    return datetime.now(timezone.utc)
+
+def fhir_id_de(recurso, objeto):
+    """Id lógico en HAPI para la fila SQL (igual al usado por fhir_client)"""
+    if recurso == "Patient":
+        return f"pac-{objeto.numero_documento}"
+    if recurso == "Encounter":
+        return f"enc-{objeto.id}"
+    if recurso == "Observation":
+        return f"obs-{objeto.id}"
+    raise ValueError(f"Recurso FHIR no soportado: {recurso}")
+
+def encolar(db: Session, recurso, objeto):
+    """
+    Registra el recurso en la bandeja de salida SIN hacer commit: queda
+    dentro de la transacción de la ruta. El objeto debe tener id (db.flush()).
+    """
+    fhir_id = fhir_id_de(recurso, objeto)
+    entrada = db.query(models.SincronizacionFhir).filter(
+        models.SincronizacionFhir.fhir_id == fhir_id
+    ).first()
+
+    if entrada is None:
+        entrada = models.SincronizacionFhir(recurso=recurso, recurso_id=objeto.id, fhir_id=fhir_id)
+        db.add(entrada)
+
+    # Un cambio nuevo reinicia el ciclo de reintentos
+    entrada.recurso_id = objeto.id
+    entrada.estado = PENDIENTE
+    entrada.intentos = 0
+    entrada.ultimo_error = None
+    entrada.proximo_intento = _ahora()
+    return entrada
+
+def encolar_lote(db, recurso, objetos):
+    """
+    Como `encolar`, para muchas filas en una sola sentencia (importaciones
+    masivas). `db` puede ser una sesión o una conexión; tampoco hace commit.
+    Cada objeto necesita `id` y los atributos que usa fhir_id_de.
+    """
+    if not objetos:
+        return 0
+    ahora = _ahora()
+    stmt = pg_insert(models.SincronizacionFhir).values([
+        {"recurso": recurso, "recurso_id": o.id, "fhir_id": fhir_id_de(recurso, o),
+         "estado": PENDIENTE, "intentos": 0, "proximo_intento": ahora}
+        for o in objetos
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["fhir_id"],
+        set_={"recurso_id": stmt.excluded.recurso_id, "estado": PENDIENTE, "intentos": 0,
+              "ultimo_error": None, "proximo_intento": ahora, "actualizado": func.now()},
+    ))
+    return len(objetos)
+
+def estado_recurso(db: Session, fhir_id):
+    return db.query(models.SincronizacionFhir).filter(
+        models.SincronizacionFhir.fhir_id == fhir_id
+    ).first()
+
+# ---------------------------------------------------------
+# PROCESAMIENTO
+# ---------------------------------------------------------
+
+def reclamar_lote(db: Session, limite=FHIR_OUTBOX_LOTE):
+    """
+    Toma filas listas para enviar. SKIP LOCKED permite varios workers (y
+    varios pods) a la vez. Retorna (entradas, reclamo): `reclamo` es el
+    vencimiento del lease escrito en proximo_intento e identifica este
+    reclamo al registrar el resultado.
+    """
+    ahora = _ahora()
+    reclamo = ahora + timedelta(seconds=FHIR_OUTBOX_LEASE)
+    entradas = db.query(models.SincronizacionFhir).filter(
+        models.SincronizacionFhir.estado.in_([PENDIENTE, ERROR, EN_PROCESO]),
+        models.SincronizacionFhir.proximo_intento <= ahora,
+    ).order_by(
+        models.SincronizacionFhir.proximo_intento
+    ).limit(limite).with_for_update(skip_locked=True).all()
+
+    for entrada in entradas:
+        entrada.estado = EN_PROCESO
+        entrada.proximo_intento = reclamo
+    db.commit()
+    return entradas, reclamo
+
+def _construir(db: Session, entrada):
+    """Construye el JSON FHIR de la fila SQL referenciada. Lanza ValueError si no es posible."""
+    if entrada.recurso == "Patient":
+        objeto = db.query(models.Usuario).filter(models.Usuario.id == entrada.recurso_id).first()
+        construir = lambda: fhir_client.construir_patient(objeto)
+    elif entrada.recurso == "Encounter":
+        objeto = db.query(models.EncuentroMedico).filter(models.EncuentroMedico.id == entrada.recurso_id).first()
+        construir = lambda: fhir_client.construir_encounter(objeto)
+    elif entrada.recurso == "Observation":
+        objeto = db.query(models.ObservacionClinica).filter(models.ObservacionClinica.id == entrada.recurso_id).first()
+        construir = lambda: fhir_client.construir_observation(objeto, objeto.encuentro.paciente.numero_documento)
+    else:
+        raise ValueError(f"Recurso no soportado: {entrada.recurso}")
+
+    if objeto is None:
+        raise ValueError("La fila SQL ya no existe")
+    return construir()
+
+def _registrar_resultado(db: Session, entrada, reclamo, error):
+    """
+    Compare-and-set: solo se escribe si la fila sigue "en_proceso" con este
+    reclamo. Si encolar() la devolvió a pendiente durante el envío, o el lease
+    venció y otro worker la tomó, no se toca. Retorna si se registró.
+    """
+    if error is None:
+        valores = {"estado": SINCRONIZADO, "ultimo_error": None}
+    else:
+        intentos = entrada.intentos + 1
+        valores = {"intentos": intentos, "ultimo_error": error[:1000]}
+        if intentos >= FHIR_OUTBOX_MAX_INTENTOS:
+            valores["estado"] = FALLIDO
+        else:
+            espera = min(FHIR_OUTBOX_BACKOFF_BASE ** intentos, FHIR_OUTBOX_BACKOFF_MAX)
+            valores["estado"] = ERROR
+            valores["proximo_intento"] = _ahora() + timedelta(seconds=espera)
+
+    S = models.SincronizacionFhir
+    registrada = db.query(S).filter(
+        S.id == entrada.id, S.estado == EN_PROCESO, S.proximo_intento == reclamo,
+    ).update(valores, synchronize_session=False) == 1
+
+    if registrada and valores["estado"] == FALLIDO:
+        print(f"❌ Outbox: {entrada.fhir_id} pasa a dead letter tras {valores['intentos']} intentos")
+    return registrada
+
+def procesar_lote(db: Session):
+    """Envía un lote pendiente en un único Bundle batch. Retorna cuántas filas se procesaron."""
+    entradas, reclamo = reclamar_lote(db)
+    if not entradas:
+        return 0
+
+    errores = {}
+    recursos = []
+    for entrada in entradas:
+        try:
+            recursos.append(_construir(db, entrada))
+        except Exception as e:
+            errores[f"{entrada.recurso}/{entrada.fhir_id}"] = str(e)
+
+    # "batch" y no "transaction": un recurso rechazado no debe bloquear al resto
+    for resultado in fhir_client.enviar_bundle(recursos, tipo="batch"):
+        if not resultado.ok:
+            errores[resultado.referencia] = resultado.error or resultado.estado or "HAPI rechazó el recurso"
+
+    for entrada in entradas:
+        _registrar_resultado(db, entrada, reclamo, errores.get(f"{entrada.recurso}/{entrada.fhir_id}"))
+    db.commit()
+    return len(entradas)
+
+# ---------------------------------------------------------
+# POOL DE WORKERS EN SEGUNDO PLANO
+# ---------------------------------------------------------
+
+class PoolSincronizacion:
+    def __init__(self, num_workers=FHIR_OUTBOX_WORKERS, intervalo=FHIR_OUTBOX_INTERVALO):
+        self.num_workers = num_workers
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilos = []
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            db = SessionLocal()
+            try:
+                procesados = procesar_lote(db)
+            except Exception as e:
+                db.rollback()
+                print(f"❌ Outbox: error procesando lote: {e}")
+                procesados = 0
+            finally:
+                db.close()
+
+            if not procesados:
+                self._detener.wait(self.intervalo)
+
+    def iniciar(self):
+        self._detener.clear()
+        for i in range(self.num_workers):
+            hilo = threading.Thread(target=self._bucle, name=f"fhir-outbox-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        print(f"🔄 Outbox FHIR: {self.num_workers} workers iniciados")
+
+    def detener(self, espera=5.0):
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout=espera)
+        self._hilos = []
+
+pool = PoolSincronizacion()
+
+if __name__ == "__main__":
+    # Drena la bandeja una vez (útil para cron o para depurar): python -m app.fhir_outbox
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            procesados = procesar_lote(db)
+            if not procesados:
+                break
+            total += procesados
+        print(f"✅ Outbox drenado: {total} recursos procesados")
+    finally:
+        db.close()
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# ---------------------------------------------------------
+# SERVIDOR FHIR SIMULADO (pruebas y mediciones)
+# ---------------------------------------------------------
+# Sustituto mínimo de HAPI en memoria y sin dependencias, para probar el
+# cliente de app/fhir_client.py sin levantar el contenedor:
+#   - PUT [tipo]/[id] y POST de Bundles batch/transaction con PUTs.
+#   - GET [tipo]?subject=... paginado con link rel="next", y los parámetros
+#     _count, _elements, _sort (_id, _lastUpdated), _summary=count y
+#     _lastUpdated=gt[instante]. Cada página lleva ETag y responde 304 a un
+#     If-None-Match vigente.
+# HTTP/1.1 con keep-alive; `conexiones` cuenta los sockets aceptados para
+# comparar clientes con y sin pool. `latencia` agrega una espera fija por
+# petición (el trabajo que haría HAPI).
+
+PAGINA_DEFECTO = 20
+
+def _instante():
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+class HapiSimulado:
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.recursos = {}          # (tipo, id) -> recurso
+        self.peticiones = 0
+        self.no_modificadas = 0     # Respuestas 304
+        self.conexiones = 0
+        self._lock = threading.Lock()
+        self._servidor = None
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}/fhir"
+
+    def iniciar(self):
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Manejador)
+        self._servidor.daemon_threads = True
+        self._servidor.hapi = self
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, name="hapi-simulado", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    # --- Operaciones ---
+
+    def guardar(self, recurso):
+        """Crea o reemplaza el recurso. Retorna el estado HTTP ("201 Created" / "200 OK")."""
+        clave = (recurso["resourceType"], recurso["id"])
+        with self._lock:
+            existia = clave in self.recursos
+            self.recursos[clave] = {**recurso, "meta": {"lastUpdated": _instante()}}
+        return "200 OK" if existia else "201 Created"
+
+    def buscar(self, tipo, params):
+        """Recursos de `tipo` que cumplen `params` (solo subject), en el orden de _sort"""
+        subject = params.get("subject")
+        desde = params.get("_lastUpdated", "")
+        if desde and not desde.startswith("gt"):
+            raise ValueError(f"_lastUpdated no soportado: {desde}")
+        with self._lock:
+            encontrados = [
+                r for (t, _), r in self.recursos.items()
+                if t == tipo and (subject is None or r.get("subject", {}).get("reference") == subject)
+                and r["meta"]["lastUpdated"] > desde[2:]
+            ]
+        orden = params.get("_sort", "")
+        campo = orden.lstrip("-")
+        if campo == "_id":
+            encontrados.sort(key=lambda r: r["id"], reverse=orden.startswith("-"))
+        elif campo == "_lastUpdated":
+            encontrados.sort(key=lambda r: r["meta"]["lastUpdated"], reverse=orden.startswith("-"))
+        return encontrados
+
+    def pagina(self, tipo, params):
+        """Bundle searchset de una página, con link next si quedan resultados"""
+        encontrados = self.buscar(tipo, params)
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "meta": {"lastUpdated": _instante()},
+            "total": len(encontrados),
+        }
+        if params.get("_summary") == "count":
+            return bundle
+
+        cantidad = int(params.get("_count", PAGINA_DEFECTO))
+        desde = int(params.get("_offset", 0))
+        elementos = [e for e in params.get("_elements", "").split(",") if e]
+        entradas = []
+        for recurso in encontrados[desde:desde + cantidad]:
+            if elementos:
+                recurso = {k: v for k, v in recurso.items() if k in ("resourceType", "id", "meta", *elementos)}
+            entradas.append({"fullUrl": f"{self.url}/{tipo}/{recurso['id']}", "resource": recurso})
+        bundle["entry"] = entradas
+
+        bundle["link"] = [{"relation": "self", "url": f"{self.url}/{tipo}?{urlencode(params)}"}]
+        if desde + cantidad < len(encontrados):
+            siguiente = {**params, "_offset": desde + cantidad}
+            bundle["link"].append({"relation": "next", "url": f"{self.url}/{tipo}?{urlencode(siguiente)}"})
+        return bundle
+
+    def procesar_bundle(self, bundle):
+        entradas = []
+        for entrada in bundle.get("entry", []):
+            estado = self.guardar(entrada["resource"])
+            entradas.append({"response": {"status": estado}})
+        tipo = "transaction-response" if bundle.get("type") == "transaction" else "batch-response"
+        return {"resourceType": "Bundle", "type": tipo, "entry": entradas}
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Cabeceras y cuerpo salen en dos escrituras: sin TCP_NODELAY cada
+        # respuesta keep-alive esperaría el ACK retardado del cliente (~40 ms)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.hapi._lock:
+            self.server.hapi.conexiones += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _ruta(self):
+        partes = urlsplit(self.path)
+        ruta = partes.path.rstrip("/")
+        if ruta.startswith("/fhir"):
+            ruta = ruta[len("/fhir"):]
+        params = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+        return [p for p in ruta.split("/") if p], params
+
+    def _leer(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(largo) or b"{}")
+
+    def _responder(self, estado, cuerpo=None, cabeceras=None):
+        datos = json.dumps(cuerpo).encode() if cuerpo is not None else b""
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(datos)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _atender(self, metodo):
+        hapi = self.server.hapi
+        with hapi._lock:
+            hapi.peticiones += 1
+        if hapi.latencia:
+            time.sleep(hapi.latencia)
+
+        partes, params = self._ruta()
+        if metodo == "GET" and len(partes) == 1:
+            bundle = hapi.pagina(partes[0], params)
+            contenido = json.dumps({k: v for k, v in bundle.items() if k != "meta"}, sort_keys=True)
+            etag = f'W/"{hashlib.sha1(contenido.encode()).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match") == etag:
+                with hapi._lock:
+                    hapi.no_modificadas += 1
+                return self._responder(304, cabeceras={"ETag": etag})
+            return self._responder(200, bundle, {"ETag": etag})
+        if metodo == "GET" and len(partes) == 2:
+            recurso = hapi.recursos.get(tuple(partes))
+            return self._responder(200 if recurso else 404, recurso or {"resourceType": "OperationOutcome"})
+        if metodo == "PUT" and len(partes) == 2:
+            recurso = self._leer()
+            estado = hapi.guardar(recurso)
+            return self._responder(int(estado.split()[0]), recurso)
+        if metodo == "POST" and not partes:
+            return self._responder(200, hapi.procesar_bundle(self._leer()))
+        self._responder(400, {"resourceType": "OperationOutcome",
+                              "issue": [{"code": "not-supported", "diagnostics": f"{metodo} {self.path}"}]})
+
+    def do_GET(self):
+        self._atender("GET")
+
+    def do_PUT(self):
+        self._atender("PUT")
+
+    def do_POST(self):
+        self._atender("POST")
+
+# ---------------------------------------------------------
+# MEDICIÓN DEL CLIENTE (sincronización masiva)
+# ---------------------------------------------------------
+# Envía `total` Observations al servidor simulado de cinco formas y reporta
+# recursos por segundo y conexiones TCP abiertas:
+#   1. requests.put por recurso sin sesión (como antes de FhirClient)
+#   2. FhirClient, un PUT tras otro (keep-alive)
+#   3. FhirClient desde `concurrencia` hilos (pool de conexiones)
+#   4. FhirClient con Bundles batch de FHIR_BUNDLE_SIZE (como app.sync_fhir)
+#   5. FhirClientAsync con `concurrencia` PUTs en vuelo (si httpx está instalado)
+# Uso: python -m app.hapi_simulado [--recursos N] [--latencia S] [--concurrencia N]
+
+def _observaciones_sinteticas(total):
+    return [
+        {"resourceType": "Observation", "id": f"obs-sim-{i}", "status": "final",
+         "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4", "display": "Frecuencia cardiaca"}]},
+         "subject": {"reference": f"Patient/pac-SIM{i % 500:09d}"},
+         "valueQuantity": {"value": 60 + i % 40, "unit": "bpm", "system": "http://unitsofmeasure.org"}}
+        for i in range(total)
+    ]
+
+def medir(total=2000, latencia=0.002, concurrencia=20):
+    import asyncio
+    import importlib.util
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    from . import fhir_client
+
+    recursos = _observaciones_sinteticas(total)
+
+    def sin_sesion(url):
+        for r in recursos:
+            requests.put(f"{url}/Observation/{r['id']}", json=r, timeout=fhir_client.FHIR_TIMEOUT)
+
+    def con_sesion(url):
+        cliente = fhir_client.FhirClient(base_url=url)
+        for r in recursos:
+            cliente.put(f"Observation/{r['id']}", r)
+        cliente.cerrar()
+
+    def con_hilos(url):
+        cliente = fhir_client.FhirClient(base_url=url, pool_size=concurrencia)
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            list(pool.map(lambda r: cliente.put(f"Observation/{r['id']}", r), recursos))
+        cliente.cerrar()
+
+    def con_bundles(url):
+        cliente = fhir_client.FhirClient(base_url=url)
+        tamano = fhir_client.FHIR_BUNDLE_SIZE
+        for i in range(0, total, tamano):
+            cliente.post("", fhir_client.construir_bundle(recursos[i:i + tamano], "batch"))
+        cliente.cerrar()
+
+    def asincrono(url):
+        async def enviar():
+            cliente = fhir_client.FhirClientAsync(base_url=url, pool_size=concurrencia)
+            limite = asyncio.Semaphore(concurrencia)
+
+            async def put(r):
+                async with limite:
+                    await cliente.put(f"Observation/{r['id']}", r)
+
+            await asyncio.gather(*(put(r) for r in recursos))
+            await cliente.cerrar()
+        asyncio.run(enviar())
+
+    variantes = [
+        ("requests.put sin sesión", sin_sesion),
+        ("FhirClient (keep-alive)", con_sesion),
+        (f"FhirClient x{concurrencia} hilos", con_hilos),
+        (f"Bundles batch de {fhir_client.FHIR_BUNDLE_SIZE}", con_bundles),
+    ]
+    if importlib.util.find_spec("httpx"):
+        variantes.append((f"FhirClientAsync x{concurrencia}", asincrono))
+    else:
+        print("ℹ️ httpx no está instalado: se omite FhirClientAsync")
+
+    print(f"--- {total} Observations, latencia simulada {latencia * 1000:.0f} ms por petición ---")
+    print(f"{'variante':<28} {'recursos/s':>11} {'segundos':>9} {'conexiones':>11}")
+    for nombre, enviar in variantes:
+        with HapiSimulado(latencia=latencia) as hapi:
+            inicio = time.perf_counter()
+            enviar(hapi.url)
+            duracion = time.perf_counter() - inicio
+            assert len(hapi.recursos) == total, f"{nombre}: {len(hapi.recursos)}/{total} recursos"
+            print(f"{nombre:<28} {total / duracion:>11.0f} {duracion:>9.2f} {hapi.conexiones:>11}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cliente FHIR contra un servidor simulado")
+    parser.add_argument("--recursos", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=0.002, help="segundos por petición en el servidor")
+    parser.add_argument("--concurrencia", type=int, default=20)
+    args = parser.parse_args()
+    medir(args.recursos, args.latencia, args.concurrencia)
@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session, aliased
+
+from . import models, timeline
+
+# ---------------------------------------------------------
+# API JSON DEL HISTORIAL (encuentros y observaciones)
+# ---------------------------------------------------------
+# Para clientes móviles y de integración: en lugar de la historia completa
+# que pintan las plantillas, páginas del más reciente al más antiguo con
+# paginación por llave sobre (fecha, id), que sigue el índice
+# (paciente_id, fecha DESC, id DESC) de cada tabla y cuesta lo mismo en
+# cualquier página.
+#
+# `campos` elige qué columnas se leen y se envían (id y fecha siempre se
+# leen: son la llave del cursor). Las uniones con catálogos solo se hacen si
+# se pidió un campo que las necesite.
+#
+# ETag: se deriva de timeline.version_historial (cambia con cualquier alta o
+# edición del paciente, sus encuentros u observaciones) y de los parámetros
+# de la página, así que un If-None-Match vigente se responde con 304 sin
+# leer la página. El cambio de nombre de un médico, sede o tipo de encuentro
+# no altera la versión del paciente y no invalida el ETag.
+
+API_LIMITE = int(os.getenv("API_LIMITE", "50"))
+API_LIMITE_MAX = int(os.getenv("API_LIMITE_MAX", "500"))
+
+E, O = models.EncuentroMedico, models.ObservacionClinica
+_Medico = aliased(models.Usuario)
+
+# campo -> (expresión, unión necesaria o None)
+CAMPOS_ENCUENTRO = {
+    "id": (E.id, None),
+    "fecha": (E.fecha, None),
+    "tipo": (models.TipoEncuentro.nombre, "tipo"),
+    "sede": (models.Sede.nombre, "sede"),
+    "medico": ((_Medico.nombres + " " + _Medico.apellidos), "medico"),
+    "diagnostico": (E.diagnostico, None),
+    "codigo_snomed": (E.codigo_snomed, None),
+    "tratamiento": (E.tratamiento, None),
+    "observaciones_generales": (E.observaciones_generales, None),
+    "version": (E.version, None),
+}
+
+CAMPOS_OBSERVACION = {
+    "id": (O.id, None),
+    "fecha": (O.fecha, None),
+    "encuentro_id": (O.encuentro_id, None),
+    "descripcion": (O.descripcion, None),
+    "valor": (O.valor, None),
+    "unidad": (O.unidad, None),
+    "interpretacion": (O.interpretacion, None),
+    "sede_id": (O.sede_id, None),
+    "version": (O.version, None),
+}
+
+_UNIONES = {
+    "tipo": (models.TipoEncuentro, E.tipo_id == models.TipoEncuentro.id),
+    "sede": (models.Sede, E.sede_id == models.Sede.id),
+    "medico": (_Medico, E.medico_id == _Medico.id),
+}
+
+class ParametroInvalido(ValueError):
+    """Campo desconocido o cursor corrupto"""
+
+def campos_de(texto, disponibles):
+    """Lista validada a partir de "id,fecha,diagnostico"; vacío = todos"""
+    if not texto:
+        return list(disponibles)
+    campos = [c.strip() for c in texto.split(",") if c.strip()]
+    desconocidos = [c for c in campos if c not in disponibles]
+    if desconocidos:
+        raise ParametroInvalido(f"Campos desconocidos: {', '.join(desconocidos)} "
+                                f"(disponibles: {', '.join(disponibles)})")
+    return campos
+
+# --- Cursor (fecha, id) ---
+
+def _codificar_cursor(fecha, id_):
+    datos = json.dumps([fecha.isoformat(), id_])
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor):
+    try:
+        fecha, id_ = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(fecha), int(id_)
+    except (ValueError, TypeError):
+        raise ParametroInvalido("Cursor inválido")
+
+# --- ETag ---
+
+def etag(db: Session, paciente_id, *parametros):
+    """ETag débil de una página: versión del historial + parámetros de la petición"""
+    base = json.dumps([timeline.version_historial(db, paciente_id), *parametros], default=str)
+    return f'W/"{hashlib.sha1(base.encode()).hexdigest()[:20]}"'
+
+def coincide(if_none_match, valor):
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or valor in [v.strip() for v in if_none_match.split(",")]
+
+# --- Páginas ---
+
+def _limite(limite):
+    return max(1, min(limite, API_LIMITE_MAX))
+
+def _consulta(modelo, catalogo, campos, filtros, limite, cursor):
+    leidos = list(dict.fromkeys(["id", "fecha", *campos]))
+    stmt = select(*(catalogo[c][0].label(c) for c in leidos)).select_from(modelo)
+    for union in dict.fromkeys(catalogo[c][1] for c in leidos if catalogo[c][1]):
+        stmt = stmt.join(*_UNIONES[union])
+
+    stmt = stmt.where(*filtros)
+    if cursor:
+        stmt = stmt.where(tuple_(modelo.fecha, modelo.id) < tuple_(*_decodificar_cursor(cursor)))
+    # Una fila de más para saber si hay página siguiente
+    return stmt.order_by(modelo.fecha.desc(), modelo.id.desc()).limit(limite + 1)
+
+def _pagina(db, stmt, campos, limite):
+    filas = db.execute(stmt).all()
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = _codificar_cursor(filas[-1].fecha, filas[-1].id)
+    return {
+        "resultados": [{c: getattr(f, c) for c in campos} for f in filas],
+        "siguiente": siguiente,
+    }
+
+def consulta_encuentros(paciente_id, campos=None, limite=API_LIMITE, cursor=None):
+    """SELECT de una página de encuentros (también lo revisa app/indices.py)"""
+    return _consulta(E, CAMPOS_ENCUENTRO, campos or list(CAMPOS_ENCUENTRO),
+                     [E.paciente_id == paciente_id], _limite(limite), cursor)
+
+def consulta_observaciones(paciente_id, campos=None, limite=API_LIMITE, cursor=None, encuentro_id=None):
+    """SELECT de una página de observaciones (también lo revisa app/indices.py)"""
+    filtros = [O.paciente_id == paciente_id]
+    if encuentro_id is not None:
+        filtros.append(O.encuentro_id == encuentro_id)
+    return _consulta(O, CAMPOS_OBSERVACION, campos or list(CAMPOS_OBSERVACION),
+                     filtros, _limite(limite), cursor)
+
+def encuentros(db: Session, paciente_id, campos=None, limite=API_LIMITE, cursor=None):
+    campos = campos or list(CAMPOS_ENCUENTRO)
+    return _pagina(db, consulta_encuentros(paciente_id, campos, limite, cursor), campos, _limite(limite))
+
+def observaciones(db: Session, paciente_id, campos=None, limite=API_LIMITE, cursor=None, encuentro_id=None):
+    campos = campos or list(CAMPOS_OBSERVACION)
+    return _pagina(db, consulta_observaciones(paciente_id, campos, limite, cursor, encuentro_id),
+                   campos, _limite(limite))
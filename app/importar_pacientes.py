@@ -0,0 +1,445 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+from . import auth, fhir_outbox, metricas, models, utils
+from .database import SessionLocal, engine
+
+# ---------------------------------------------------------
+# IMPORTACIÓN MASIVA DE PACIENTES
+# ---------------------------------------------------------
+# Para cargar el padrón de una clínica (decenas de miles de pacientes) sin
+# pasar uno por uno por /admision/registrar_paciente:
+#   1. El archivo (CSV con encabezado o NDJSON) se lee y valida fila por
+#      fila; los catálogos (tipo de documento, sede) se resuelven contra un
+#      mapa en memoria cargado una sola vez.
+#   2. Cada lote de IMPORTACION_LOTE filas válidas entra con COPY a una tabla
+#      temporal y de ahí a `usuarios` con INSERT ... ON CONFLICT
+#      (numero_documento) DO UPDATE. Las filas que no cambian nada no se
+#      tocan (ni cambian de versión ni se reenvían a FHIR). Un documento que
+#      ya pertenece a un usuario que no es paciente (médico, administrador...)
+#      se rechaza: una importación de admisión no puede modificar personal.
+#   3. En la misma transacción del lote, los pacientes insertados o
+#      modificados se encolan en el outbox FHIR con una sola sentencia.
+# Cada lote se confirma por separado: si la importación se interrumpe, volver
+# a correrla con el mismo archivo es seguro (los ya cargados quedan como
+# "sin cambios").
+#
+# La contraseña es opcional y solo se aplica en la primera carga: sin ella
+# el paciente queda con un hash inutilizable (utils.HASH_INUTILIZABLE) y no
+# puede iniciar sesión hasta que admisión le asigne una. A un paciente que ya
+# existe solo se le asigna la del archivo si todavía no tenía una utilizable;
+# la que ya tenga (quizá cambiada por él) no se sobrescribe. Así, volver a
+# correr un archivo con contraseñas no las re-hashea ni marca las filas como
+# modificadas. Las contraseñas se hashean con IMPORTACION_HASH_WORKERS
+# procesos propios, no con el pool de los logins.
+#
+# Uso: python -m app.importar_pacientes archivo.csv|archivo.ndjson [--sede ID] [--rechazos rechazos.csv]
+
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", "5000"))
+IMPORTACION_HASH_WORKERS = int(os.getenv("IMPORTACION_HASH_WORKERS", str(os.cpu_count() or 2)))
+# Rechazos que se conservan con detalle (el total siempre se cuenta)
+IMPORTACION_MAX_RECHAZOS = int(os.getenv("IMPORTACION_MAX_RECHAZOS", "1000"))
+
+COLUMNAS = ["nombres", "apellidos", "tipo_documento_id", "numero_documento", "fecha_nacimiento",
+            "genero", "email", "telefono", "sede_id", "password_hash", "fhir_id"]
+
+GENEROS = {"M": "M", "F": "F", "MASCULINO": "M", "FEMENINO": "F"}
+
+SQL_TEMPORAL = text("""
+    CREATE TEMP TABLE importacion_pacientes (
+        nombres text, apellidos text, tipo_documento_id integer, numero_documento text,
+        fecha_nacimiento date, genero text, email text, telefono text, sede_id integer,
+        password_hash text, fhir_id text,
+        -- La versión se toma aquí: en Citus la sentencia sobre usuarios no
+        -- puede evaluar nextval en cada nodo
+        version bigint DEFAULT nextval('hce_cambios_seq')
+    ) ON COMMIT DROP
+""")
+
+SQL_COPY = f"COPY importacion_pacientes ({', '.join(COLUMNAS)}) FROM STDIN WITH (FORMAT csv)"
+
+SQL_UPSERT = text(f"""
+    INSERT INTO usuarios AS u ({', '.join(COLUMNAS)}, rol_id, version)
+    SELECT {', '.join(COLUMNAS)}, :rol_id, version FROM importacion_pacientes
+    ON CONFLICT (numero_documento) DO UPDATE SET
+        nombres = EXCLUDED.nombres,
+        apellidos = EXCLUDED.apellidos,
+        tipo_documento_id = EXCLUDED.tipo_documento_id,
+        fecha_nacimiento = EXCLUDED.fecha_nacimiento,
+        genero = EXCLUDED.genero,
+        email = COALESCE(EXCLUDED.email, u.email),
+        telefono = COALESCE(EXCLUDED.telefono, u.telefono),
+        sede_id = EXCLUDED.sede_id,
+        fhir_id = COALESCE(EXCLUDED.fhir_id, u.fhir_id),
+        password_hash = CASE WHEN u.password_hash = '{utils.HASH_INUTILIZABLE}'
+                             THEN EXCLUDED.password_hash ELSE u.password_hash END,
+        version = EXCLUDED.version,
+        actualizado_en = now()
+    WHERE u.rol_id = :rol_id AND (
+          (u.nombres, u.apellidos, u.tipo_documento_id, u.fecha_nacimiento, u.genero, u.sede_id)
+              IS DISTINCT FROM
+          (EXCLUDED.nombres, EXCLUDED.apellidos, EXCLUDED.tipo_documento_id,
+           EXCLUDED.fecha_nacimiento, EXCLUDED.genero, EXCLUDED.sede_id)
+       OR (EXCLUDED.email IS NOT NULL AND EXCLUDED.email IS DISTINCT FROM u.email)
+       OR (EXCLUDED.telefono IS NOT NULL AND EXCLUDED.telefono IS DISTINCT FROM u.telefono)
+       OR (EXCLUDED.fhir_id IS NOT NULL AND EXCLUDED.fhir_id IS DISTINCT FROM u.fhir_id)
+       OR (u.password_hash = '{utils.HASH_INUTILIZABLE}'
+           AND EXCLUDED.password_hash <> '{utils.HASH_INUTILIZABLE}'))
+    RETURNING u.id, u.numero_documento
+""")
+
+class FilaInvalida(ValueError):
+    pass
+
+@dataclass
+class Reporte:
+    leidas: int = 0
+    insertadas: int = 0
+    actualizadas: int = 0
+    sin_cambios: int = 0
+    duplicadas: int = 0     # Mismo documento repetido en un lote: queda la última
+    rechazadas: int = 0
+    rechazos: list = field(default_factory=list)   # (línea, documento, motivo)
+    segundos: float = 0.0
+
+    @property
+    def filas_por_segundo(self):
+        return self.leidas / self.segundos if self.segundos else 0.0
+
+    def rechazar(self, linea, documento, motivo):
+        self.rechazadas += 1
+        if len(self.rechazos) < IMPORTACION_MAX_RECHAZOS:
+            self.rechazos.append((linea, documento, motivo))
+
+    def como_dict(self):
+        return {
+            "leidas": self.leidas, "insertadas": self.insertadas, "actualizadas": self.actualizadas,
+            "sin_cambios": self.sin_cambios, "duplicadas": self.duplicadas, "rechazadas": self.rechazadas,
+            "rechazos": [{"linea": l, "documento": d, "motivo": m} for l, d, m in self.rechazos],
+            "segundos": round(self.segundos, 3), "filas_por_segundo": round(self.filas_por_segundo, 1),
+        }
+
+_estado = {"filas": 0, "rechazadas": 0}
+
+metricas.registrar("hce_importacion_filas_total", "counter",
+                   "Filas de pacientes leídas por importaciones masivas", lambda: _estado["filas"])
+metricas.registrar("hce_importacion_rechazadas_total", "counter",
+                   "Filas de pacientes rechazadas por validación", lambda: _estado["rechazadas"])
+
+# --- Catálogos ---
+
+class Catalogos:
+    """Tipos de documento y sedes en memoria: ninguna consulta por fila"""
+
+    def __init__(self, db):
+        self.tipos_documento = {}
+        for td in db.query(models.TipoDocumento):
+            self.tipos_documento[td.prefijo.upper()] = td.id
+            self.tipos_documento[td.nombre.upper()] = td.id
+        self.sedes = {}
+        for sede in db.query(models.Sede):
+            self.sedes[str(sede.id)] = sede.id
+            self.sedes[sede.nombre.upper()] = sede.id
+            self.sedes.setdefault(sede.ciudad.upper(), sede.id)
+        self.rol_paciente = db.query(models.Rol.id).filter(models.Rol.nombre == "Paciente").scalar()
+
+# --- Lectura y validación en streaming ---
+
+def leer(archivo, formato):
+    """
+    Genera (línea, dict) desde un archivo de texto CSV (con encabezado) o
+    NDJSON. Una línea ilegible se entrega como (línea, FilaInvalida).
+    """
+    if formato == "csv":
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, fila
+    elif formato == "ndjson":
+        for linea, texto in enumerate(archivo, start=1):
+            if not texto.strip():
+                continue
+            try:
+                fila = json.loads(texto)
+            except ValueError:
+                yield linea, FilaInvalida("JSON inválido")
+                continue
+            yield linea, fila if isinstance(fila, dict) else FilaInvalida("Se esperaba un objeto JSON")
+    else:
+        raise ValueError(f"Formato no soportado: {formato} (csv o ndjson)")
+
+def formato_de(nombre_archivo):
+    return "ndjson" if nombre_archivo.lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+def _texto(fila, clave, requerido=False):
+    valor = fila.get(clave)
+    valor = str(valor).strip() if valor is not None else ""
+    if requerido and not valor:
+        raise FilaInvalida(f"Falta {clave}")
+    return valor or None
+
+def validar(fila, catalogos, sede_por_defecto):
+    """dict crudo -> dict con las columnas de `usuarios` (password en claro aparte)"""
+    documento = _texto(fila, "numero_documento", requerido=True)
+    if any(c.isspace() for c in documento):
+        raise FilaInvalida("numero_documento con espacios")
+
+    tipo = _texto(fila, "tipo_documento", requerido=True).upper()
+    if tipo not in catalogos.tipos_documento:
+        raise FilaInvalida(f"tipo_documento desconocido: {tipo}")
+
+    try:
+        nacimiento = date.fromisoformat(_texto(fila, "fecha_nacimiento", requerido=True))
+    except ValueError:
+        raise FilaInvalida("fecha_nacimiento debe ser AAAA-MM-DD")
+    if nacimiento > date.today():
+        raise FilaInvalida("fecha_nacimiento en el futuro")
+
+    genero = GENEROS.get(_texto(fila, "genero", requerido=True).upper())
+    if genero is None:
+        raise FilaInvalida("genero debe ser M o F")
+
+    sede = _texto(fila, "sede")
+    if sede is None:
+        sede_id = sede_por_defecto
+    else:
+        sede_id = catalogos.sedes.get(sede.upper())
+    if sede_id is None:
+        raise FilaInvalida(f"sede desconocida: {sede}" if sede else "Falta sede")
+
+    email = _texto(fila, "email")
+    if email and "@" not in email:
+        raise FilaInvalida("email inválido")
+
+    return {
+        "nombres": _texto(fila, "nombres", requerido=True),
+        "apellidos": _texto(fila, "apellidos", requerido=True),
+        "tipo_documento_id": catalogos.tipos_documento[tipo],
+        "numero_documento": documento,
+        "fecha_nacimiento": nacimiento.isoformat(),
+        "genero": genero,
+        "email": email,
+        "telefono": _texto(fila, "telefono"),
+        "sede_id": sede_id,
+        "password": _texto(fila, "password"),
+        # Id del recurso en el servidor FHIR de origen (ver app/ingesta_fhir.py)
+        "fhir_id": _texto(fila, "fhir_id"),
+    }
+
+# --- Carga ---
+
+def _con_password_utilizable(conn, documentos):
+    """Documentos que ya tienen contraseña: la del archivo se ignoraría, no se hashea"""
+    return set(conn.execute(
+        text("SELECT numero_documento FROM usuarios WHERE numero_documento = ANY(:docs) "
+             "AND password_hash <> :inutilizable"),
+        {"docs": documentos, "inutilizable": utils.HASH_INUTILIZABLE},
+    ).scalars())
+
+def _hashear_lote(conn, filas, pool):
+    """En la transacción del lote: lo que se consulta es lo que el upsert verá"""
+    con_password = [f for f in filas if f["password"]]
+    if con_password:
+        ya_tienen = _con_password_utilizable(conn, [f["numero_documento"] for f in con_password])
+        con_password = [f for f in con_password if f["numero_documento"] not in ya_tienen]
+    hashes = pool.map(utils._hashear, [f["password"] for f in con_password], chunksize=16) if pool else []
+    for fila, hash_ in zip(con_password, hashes):
+        fila["password_hash"] = hash_
+    for fila in filas:
+        fila.setdefault("password_hash", utils.HASH_INUTILIZABLE)
+        del fila["password"]
+
+def _fhir_id_ocupados(conn, filas):
+    """
+    {documento: motivo} de las filas cuyo fhir_id ya es de otro documento (en
+    la base o antes en el mismo lote): violarían ux_usuarios_fhir_id
+    """
+    duenos, rechazos = {}, {}
+    for fila in filas:
+        if fila["fhir_id"]:
+            if duenos.setdefault(fila["fhir_id"], fila["numero_documento"]) != fila["numero_documento"]:
+                rechazos[fila["numero_documento"]] = f"fhir_id {fila['fhir_id']} repetido en el archivo"
+    if duenos:
+        for fhir_id, documento in conn.execute(
+            text("SELECT fhir_id, numero_documento FROM usuarios WHERE fhir_id = ANY(:ids)"),
+            {"ids": list(duenos)},
+        ):
+            if duenos[fhir_id] != documento:
+                rechazos[duenos[fhir_id]] = f"fhir_id {fhir_id} ya pertenece al documento {documento}"
+    return rechazos
+
+def _copiar(conn, buffer):
+    """
+    COPY ... FROM STDIN con el driver de la URL: psycopg2 (copy_expert) o
+    psycopg 3 (cursor.copy), que es el que SQLAlchemy 2 usa para postgresql://
+    """
+    dbapi = conn.dialect.loaded_dbapi
+    try:
+        with conn.connection.cursor() as cursor:
+            if conn.dialect.driver == "psycopg2":
+                cursor.copy_expert(SQL_COPY, buffer)
+                return
+            with cursor.copy(SQL_COPY) as copia:
+                while bloque := buffer.read(1 << 16):
+                    copia.write(bloque)
+    except dbapi.Error as e:
+        # El cursor crudo no pasa por SQLAlchemy: se traduce el error del driver
+        # (DataError, IntegrityError...) para que _vaciar lo reconozca
+        raise DBAPIError.instance(SQL_COPY, None, e, dbapi.Error, dialect=conn.dialect) from e
+
+def _cargar_lote(filas, catalogos, reporte, pool=None):
+    """Hash de contraseñas, COPY a la tabla temporal, upsert y encolado FHIR, en una transacción"""
+    documentos = [f["numero_documento"] for f in filas]
+    with engine.begin() as conn:
+        existentes = dict(conn.execute(
+            text("SELECT numero_documento, rol_id FROM usuarios WHERE numero_documento = ANY(:docs)"),
+            {"docs": documentos},
+        ).all())
+
+        # El upsert tampoco los actualiza (u.rol_id = :rol_id); aquí se reportan
+        rechazos = {d: "El documento pertenece a un usuario que no es paciente"
+                    for d, rol in existentes.items() if rol != catalogos.rol_paciente}
+        rechazos.update(_fhir_id_ocupados(conn, filas))
+        rechazadas = [f for f in filas if f["numero_documento"] in rechazos]
+        filas = [f for f in filas if f["numero_documento"] not in rechazos]
+
+        cambiados = []
+        if filas:
+            _hashear_lote(conn, filas, pool)
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            for fila in filas:
+                escritor.writerow([fila[c] for c in COLUMNAS])
+            buffer.seek(0)
+
+            conn.execute(SQL_TEMPORAL)
+            _copiar(conn, buffer)
+            cambiados = conn.execute(SQL_UPSERT, {"rol_id": catalogos.rol_paciente}).all()
+
+            fhir_outbox.encolar_lote(conn, "Patient", cambiados)
+
+    # Después del commit: si el lote falla, quien llama lo rechaza completo
+    for fila in rechazadas:
+        reporte.rechazar(fila["linea"], fila["numero_documento"], rechazos[fila["numero_documento"]])
+    actualizados = [f.numero_documento for f in cambiados if f.numero_documento in existentes]
+    reporte.insertadas += len(cambiados) - len(actualizados)
+    reporte.actualizadas += len(actualizados)
+    reporte.sin_cambios += len(filas) - len(cambiados)
+    # El principal en caché (nombre, sede) de los pacientes modificados
+    for documento in actualizados:
+        auth.invalidar_principal(documento)
+
+def importar(archivo, formato, sede_por_defecto=None, lote=IMPORTACION_LOTE, progreso=False):
+    """
+    Importa pacientes desde `archivo` (texto). Retorna un Reporte.
+    `sede_por_defecto` se usa en las filas sin columna `sede`.
+    """
+    return importar_filas(leer(archivo, formato), sede_por_defecto, lote, progreso)
+
+def importar_filas(entradas, sede_por_defecto=None, lote=IMPORTACION_LOTE, progreso=False):
+    """Igual que `importar`, desde un iterable de (línea, dict | FilaInvalida)"""
+    reporte = Reporte()
+    inicio = time.perf_counter()
+
+    db = SessionLocal()
+    try:
+        catalogos = Catalogos(db)
+    finally:
+        db.close()
+
+    pool = None
+    pendientes = {}
+
+    def _vaciar():
+        nonlocal pool
+        filas = list(pendientes.values())
+        pendientes.clear()
+        if pool is None and any(f["password"] for f in filas):
+            # Se crea dentro de una petición: forkserver, no fork (ver utils._obtener_pool)
+            pool = ProcessPoolExecutor(max_workers=IMPORTACION_HASH_WORKERS,
+                                       mp_context=multiprocessing.get_context("forkserver"))
+        try:
+            _cargar_lote(filas, catalogos, reporte, pool)
+        except (IntegrityError, DataError) as e:
+            # Conflicto con una escritura concurrente (IntegrityError) o un valor
+            # que la base no acepta (DataError): se rechaza el lote y se sigue
+            motivo = f"Lote rechazado por la base de datos: {str(e.orig).splitlines()[0]}"
+            for fila in filas:
+                reporte.rechazar(fila["linea"], fila["numero_documento"], motivo)
+        if progreso:
+            print(f"--- {reporte.leidas} filas ({reporte.leidas / (time.perf_counter() - inicio):.0f}/s), "
+                  f"{reporte.rechazadas} rechazadas ---")
+
+    try:
+        for linea, fila in entradas:
+            reporte.leidas += 1
+            if isinstance(fila, FilaInvalida):
+                reporte.rechazar(linea, None, str(fila))
+                continue
+            try:
+                valida = validar(fila, catalogos, sede_por_defecto)
+            except FilaInvalida as e:
+                reporte.rechazar(linea, fila.get("numero_documento"), str(e))
+                continue
+
+            valida["linea"] = linea
+            if valida["numero_documento"] in pendientes:
+                reporte.duplicadas += 1
+            pendientes[valida["numero_documento"]] = valida
+            if len(pendientes) >= lote:
+                _vaciar()
+        if pendientes:
+            _vaciar()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        reporte.segundos = time.perf_counter() - inicio
+        _estado["filas"] += reporte.leidas
+        _estado["rechazadas"] += reporte.rechazadas
+
+    return reporte
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Importación masiva de pacientes")
+    parser.add_argument("archivo")
+    parser.add_argument("--formato", choices=["csv", "ndjson"])
+    parser.add_argument("--sede", help="id o nombre de la sede para filas sin columna sede")
+    parser.add_argument("--lote", type=int, default=IMPORTACION_LOTE)
+    parser.add_argument("--rechazos", help="archivo CSV donde escribir las filas rechazadas")
+    args = parser.parse_args()
+
+    sede_id = None
+    if args.sede:
+        db = SessionLocal()
+        try:
+            sede_id = Catalogos(db).sedes.get(args.sede.upper())
+        finally:
+            db.close()
+        if sede_id is None:
+            raise SystemExit(f"Sede desconocida: {args.sede}")
+
+    with open(args.archivo, encoding="utf-8-sig", newline="") as archivo:
+        r = importar(archivo, args.formato or formato_de(args.archivo), sede_id, args.lote, progreso=True)
+
+    if args.rechazos and r.rechazos:
+        with open(args.rechazos, "w", newline="", encoding="utf-8") as salida:
+            escritor = csv.writer(salida)
+            escritor.writerow(["linea", "documento", "motivo"])
+            escritor.writerows(r.rechazos)
+
+    print(f"✅ {r.leidas} filas en {r.segundos:.1f}s ({r.filas_por_segundo:.0f} filas/s): "
+          f"{r.insertadas} insertadas, {r.actualizadas} actualizadas, {r.sin_cambios} sin cambios, "
+          f"{r.duplicadas} duplicadas, {r.rechazadas} rechazadas")
+    for linea, documento, motivo in r.rechazos[:20]:
+        print(f"   ❌ línea {linea} ({documento or '-'}): {motivo}")
@@ -0,0 +1,133 @@
+import json
+import re
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from . import auth, busqueda, historial_api, timeline
+from .database import SessionLocal
+
+# ---------------------------------------------------------
+# VERIFICACIÓN DE ÍNDICES
+# ---------------------------------------------------------
+# Los índices se declaran en models.py (__table_args__) y los crea la
+# migración 0006 con CREATE INDEX CONCURRENTLY. Este chequeo corre EXPLAIN
+# sobre las consultas calientes y falla (código 1) si alguna recorre completa
+# una tabla clínica. Debe correrse contra una base con datos realistas: con
+# tablas casi vacías el planificador prefiere, con razón, un Seq Scan (para
+# una base de pruebas: python -m app.citus sembrar).
+# Uso: python -m app.indices
+
+# Tablas en las que un recorrido completo en una consulta caliente es un error
+TABLAS_VIGILADAS = {"usuarios", "encuentros_medicos", "observaciones_clinicas"}
+
+def consultas_calientes(db, paciente_id, encuentro_id, documento):
+    """
+    Las consultas de las vistas de historial, de la API y de la búsqueda,
+    tomadas de los módulos que las ejecutan: si una cambia de forma, el
+    chequeo revisa la forma nueva
+    """
+    version = timeline._consultas_version(db, paciente_id)
+    return {
+        "timeline_encuentros": timeline._consulta_encuentros(db, paciente_id),
+        "timeline_observaciones": timeline._consulta_observaciones(db, paciente_id),
+        "timeline_observaciones_lote": timeline._consulta_observaciones(db, paciente_id, [encuentro_id]),
+        "version_usuario": version["usuario"],
+        "version_encuentros": version["encuentros"],
+        "version_observaciones": version["observaciones"],
+        "api_encuentros": historial_api.consulta_encuentros(paciente_id),
+        "api_observaciones_del_encuentro": historial_api.consulta_observaciones(paciente_id, encuentro_id=encuentro_id),
+        "usuario_por_documento": auth._consulta_usuario(db, documento),
+        "busqueda_documento": busqueda.consulta(documento, busqueda.DOCUMENTO, rol="Paciente"),
+        "busqueda_nombre": busqueda.consulta("ana gom", busqueda.NOMBRE, rol="Paciente"),
+    }
+
+def _recorridos_secuenciales(nodo, indice):
+    """
+    Busca recorridos completos en el plan (incluye los planes remotos de
+    Citus): Seq Scan, o un recorrido de índice cuya condición no restringe
+    la primera columna del índice (sin condición solo aprovecha el orden del
+    índice; con condición sobre otra columna lo lee entero).
+    `indice(nombre)` -> (tabla, primera columna o None si es una expresión)
+    """
+    if isinstance(nodo, dict):
+        tipo = nodo.get("Node Type")
+        if tipo == "Seq Scan":
+            yield nodo.get("Relation Name", "")
+        elif tipo in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+            tabla, columna = indice(nodo.get("Index Name", ""))
+            condicion = nodo.get("Index Cond", "")
+            if not condicion or (columna and not re.search(rf"\b{columna}\b", condicion)):
+                yield nodo.get("Relation Name", tabla)
+        for valor in nodo.values():
+            yield from _recorridos_secuenciales(valor, indice)
+    elif isinstance(nodo, list):
+        for valor in nodo:
+            yield from _recorridos_secuenciales(valor, indice)
+
+def _indices(db):
+    """{índice: (tabla, primera columna o None)} de las tablas vigiladas"""
+    filas = db.execute(text("""
+        SELECT ci.relname AS indice, ct.relname AS tabla, a.attname AS columna
+        FROM pg_index i
+        JOIN pg_class ci ON ci.oid = i.indexrelid
+        JOIN pg_class ct ON ct.oid = i.indrelid
+        LEFT JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE ct.relname = ANY(:tablas)
+    """), {"tablas": sorted(TABLAS_VIGILADAS)})
+    return {f.indice: (f.tabla, f.columna) for f in filas}
+
+def _muestra(db):
+    """(paciente_id, encuentro_id, documento) de un paciente con historial"""
+    fila = db.execute(text("""
+        SELECT e.paciente_id, e.id, u.numero_documento
+        FROM encuentros_medicos e JOIN usuarios u ON u.id = e.paciente_id
+        LIMIT 1
+    """)).first()
+    if fila is None:
+        sys.exit("❌ La base no tiene datos: cargue un conjunto de prueba antes de verificar")
+    return tuple(fila)
+
+def sql_literal(query):
+    """SQL de una Query del ORM o un select() de Core con los parámetros en línea (para EXPLAIN)"""
+    # paramstyle "named": con el de psycopg2 los % de los LIKE saldrían
+    # duplicados y text() los volvería a duplicar
+    return str(getattr(query, "statement", query).compile(
+        dialect=postgresql.dialect(paramstyle="named"), compile_kwargs={"literal_binds": True}))
+
+def revisar(db, paciente_id, encuentro_id, documento):
+    """{consulta: tablas vigiladas recorridas completas} para las consultas calientes"""
+    catalogo = _indices(db)
+
+    def indice(nombre):
+        # En Citus los shards (y sus índices) se llaman <nombre>_<id de shard>
+        return catalogo.get(nombre) or catalogo.get(re.sub(r"_\d+$", "", nombre), ("", None))
+
+    recorridos = {}
+    for nombre, query in consultas_calientes(db, paciente_id, encuentro_id, documento).items():
+        plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql_literal(query)}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        tablas = _recorridos_secuenciales(plan, indice)
+        recorridos[nombre] = {re.sub(r"_\d+$", "", t) for t in tablas} & TABLAS_VIGILADAS
+    return recorridos
+
+def verificar():
+    db = SessionLocal()
+    fallas = []
+    try:
+        for nombre, tablas in revisar(db, *_muestra(db)).items():
+            if tablas:
+                fallas.append(nombre)
+                print(f"❌ {nombre}: recorrido completo de {', '.join(sorted(tablas))}")
+            else:
+                print(f"✅ {nombre}: usa índices")
+    finally:
+        db.close()
+
+    if fallas:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    verificar()
@@ -0,0 +1,442 @@
+import gzip
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from . import fhir_outbox, importar_pacientes, models
+from .database import SessionLocal, engine
+from .importar_pacientes import FilaInvalida
+
+# ---------------------------------------------------------
+# INGESTA FHIR -> SQL (archivos NDJSON de Bulk Data $export)
+# ---------------------------------------------------------
+# Para incorporar una sede que ya tiene su historia en otro servidor FHIR.
+# Lee los archivos NDJSON de un $export (Patient, Encounter, Observation;
+# también .ndjson.gz) línea por línea, convierte cada recurso con el inverso
+# de los constructores de fhir_client y escribe por lotes con upserts
+# idempotentes: el id del recurso en el origen queda en la columna `fhir_id`
+# (migración 0009), así que repetir la ingesta actualiza en lugar de duplicar
+# y las filas sin cambios no se tocan.
+#
+# La memoria no depende del tamaño de los archivos: solo se mantiene un lote
+# de INGESTA_LOTE recursos, y las referencias (Patient/x, Encounter/y) se
+# resuelven con una consulta por lote. Los archivos se procesan en orden
+# Patient -> Encounter -> Observation para que las referencias ya existan.
+#
+# Los pacientes pasan por importar_pacientes (misma validación, COPY y
+# upsert por numero_documento). Lo insertado o modificado se encola en el
+# outbox y llega a nuestro HAPI como cualquier otro registro.
+#
+# Lo que el modelo SQL no tiene se pierde (participantes, periodos, códigos
+# LOINC distintos de la descripción...). Encounter no trae quién atendió en
+# un campo que podamos mapear a un Usuario: todos los encuentros importados
+# quedan a nombre del médico indicado con --medico.
+#
+# Uso: python -m app.ingesta_fhir --sede "Sede Norte" --medico 1010 Patient.ndjson Encounter.ndjson Observation.ndjson
+
+INGESTA_LOTE = int(os.getenv("INGESTA_LOTE", "2000"))
+# Tipo de documento para identificadores que no siguen nuestro sistema
+INGESTA_TIPO_DOCUMENTO = os.getenv("INGESTA_TIPO_DOCUMENTO", "CC")
+
+RECURSOS = ["Patient", "Encounter", "Observation"]
+
+# Inversos de fhir_client.construir_*
+SISTEMA_IDENTIFICACION = re.compile(r"/identificacion/([^/]+)$")
+GENEROS_FHIR = {"male": "M", "female": "F"}
+SNOMED = "http://snomed.info/sct"
+CLASES_ENCUENTRO = {"AMB": "Consulta General", "EMER": "Urgencia"}
+
+@dataclass
+class Avance:
+    recurso: str
+    leidos: int = 0
+    cambiados: int = 0      # insertados o actualizados
+    sin_cambios: int = 0
+    rechazados: int = 0
+    segundos: float = 0.0
+
+    @property
+    def por_segundo(self):
+        return self.leidos / self.segundos if self.segundos else 0.0
+
+    def __str__(self):
+        return (f"{self.recurso}: {self.leidos} leídos en {self.segundos:.1f}s ({self.por_segundo:.0f}/s) | "
+                f"{self.cambiados} insertados o actualizados, {self.sin_cambios} sin cambios, "
+                f"{self.rechazados} rechazados")
+
+# --- Lectura ---
+
+def abrir(ruta):
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rt", encoding="utf-8")
+    return open(ruta, encoding="utf-8")
+
+def recurso_de_archivo(ruta):
+    """Patient.ndjson, Patient.000.ndjson.gz, 1.Encounter.ndjson... -> tipo de recurso"""
+    partes = os.path.basename(ruta).split(".")
+    return next((p for p in partes if p in RECURSOS), None)
+
+def recursos(ruta, tipo):
+    """Genera (línea, recurso | FilaInvalida) sin cargar el archivo en memoria"""
+    with abrir(ruta) as archivo:
+        for linea, texto in enumerate(archivo, start=1):
+            if not texto.strip():
+                continue
+            try:
+                recurso = json.loads(texto)
+            except ValueError:
+                yield linea, FilaInvalida("JSON inválido")
+                continue
+            if not isinstance(recurso, dict) or recurso.get("resourceType") != tipo:
+                yield linea, FilaInvalida(f"Se esperaba un {tipo}")
+                continue
+            yield linea, recurso
+
+def _id_referencia(referencia, tipo):
+    """{"reference": "Patient/abc"} -> "abc" (o None si apunta a otro tipo)"""
+    valor = (referencia or {}).get("reference") or ""
+    prefijo = f"{tipo}/"
+    if valor.startswith(prefijo):
+        return valor[len(prefijo):]
+    return None
+
+def _fecha(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    except ValueError:
+        raise FilaInvalida(f"Fecha inválida: {valor}")
+
+def _concepto(concepto):
+    """Texto de un CodeableConcept: text o el display del primer coding"""
+    concepto = concepto or {}
+    return concepto.get("text") or next(
+        (c.get("display") for c in concepto.get("coding", []) if c.get("display")), None
+    )
+
+# --- Patient -> Usuario ---
+
+def fila_paciente(recurso):
+    """Patient -> fila de importar_pacientes (la validación la hace importar_pacientes.validar)"""
+    identificadores = recurso.get("identifier") or [{}]
+    identificador = next(
+        (i for i in identificadores if SISTEMA_IDENTIFICACION.search(i.get("system") or "")),
+        identificadores[0],
+    )
+    sistema = SISTEMA_IDENTIFICACION.search(identificador.get("system") or "")
+
+    nombre = next((n for n in recurso.get("name", []) if n.get("use") == "official"),
+                  (recurso.get("name") or [{}])[0])
+    telecom = {t.get("system"): t.get("value") for t in recurso.get("telecom", [])}
+
+    return {
+        "fhir_id": recurso.get("id"),
+        "numero_documento": identificador.get("value"),
+        "tipo_documento": sistema.group(1) if sistema else INGESTA_TIPO_DOCUMENTO,
+        "nombres": " ".join(nombre.get("given", [])) or nombre.get("text"),
+        "apellidos": nombre.get("family"),
+        "genero": GENEROS_FHIR.get(recurso.get("gender"), recurso.get("gender")),
+        "fecha_nacimiento": recurso.get("birthDate"),
+        "email": telecom.get("email"),
+        "telefono": telecom.get("phone"),
+    }
+
+def ingerir_pacientes(entradas, sede_id, lote):
+    inicio = time.perf_counter()
+    filas = ((linea, r if isinstance(r, FilaInvalida) else fila_paciente(r)) for linea, r in entradas)
+    reporte = importar_pacientes.importar_filas(filas, sede_id, lote, progreso=True)
+    return Avance(
+        "Patient", leidos=reporte.leidas, cambiados=reporte.insertadas + reporte.actualizadas,
+        sin_cambios=reporte.sin_cambios + reporte.duplicadas, rechazados=reporte.rechazadas,
+        segundos=time.perf_counter() - inicio,
+    )
+
+# --- Encounter / Observation ---
+
+class Contexto:
+    """Catálogos y valores fijos de la ingesta, cargados una vez"""
+
+    def __init__(self, db, sede_id, medico_documento):
+        self.sede_id = sede_id
+        self.tipos_encuentro = {t.nombre.upper(): t.id for t in db.query(models.TipoEncuentro)}
+        self.tipo_por_defecto = self.tipos_encuentro.get("CONSULTA GENERAL") or next(iter(self.tipos_encuentro.values()), None)
+        self.medico_id = None
+        if medico_documento:
+            self.medico_id = db.query(models.Usuario.id).filter(
+                models.Usuario.numero_documento == medico_documento).scalar()
+            if self.medico_id is None:
+                raise SystemExit(f"❌ Médico {medico_documento} no encontrado")
+
+    def tipo_encuentro(self, nombre):
+        return self.tipos_encuentro.get((nombre or "").upper(), self.tipo_por_defecto)
+
+def _pacientes(conn, referencias):
+    """ids de Patient en el origen -> usuarios.id (por fhir_id, o pac-<documento> de este sistema)"""
+    referencias = set(referencias)
+    resultado = dict(conn.execute(
+        select(models.Usuario.fhir_id, models.Usuario.id).where(models.Usuario.fhir_id.in_(list(referencias)))
+    ).all())
+    propios = {r[len("pac-"):]: r for r in referencias - resultado.keys() if r.startswith("pac-")}
+    if propios:
+        for documento, id_ in conn.execute(
+            select(models.Usuario.numero_documento, models.Usuario.id)
+            .where(models.Usuario.numero_documento.in_(list(propios)))
+        ):
+            resultado[propios[documento]] = id_
+    return resultado
+
+def _encuentros(conn, pares):
+    """(paciente_id, id de Encounter en el origen) -> encuentros_medicos.id"""
+    E = models.EncuentroMedico
+    pares = set(pares)
+    resultado = {}
+    if pares:
+        for paciente_id, fhir_id, id_ in conn.execute(
+            select(E.paciente_id, E.fhir_id, E.id).where(
+                E.paciente_id.in_(list({p for p, _ in pares})),
+                E.fhir_id.in_(list({f for _, f in pares})),
+            )
+        ):
+            resultado[(paciente_id, fhir_id)] = id_
+    # enc-<id> de este mismo sistema
+    propios = {int(f[len("enc-"):]): (p, f) for p, f in pares - resultado.keys()
+               if f.startswith("enc-") and f[len("enc-"):].isdigit()}
+    if propios:
+        for id_, paciente_id in conn.execute(
+            select(E.id, E.paciente_id).where(E.id.in_(list(propios)))
+        ):
+            if propios[id_][0] == paciente_id:
+                resultado[propios[id_]] = id_
+    return resultado
+
+def fila_encuentro(recurso, ctx, pacientes):
+    paciente_id = pacientes.get(_id_referencia(recurso.get("subject"), "Patient"))
+    if paciente_id is None:
+        raise FilaInvalida("subject no apunta a un Patient importado")
+
+    razon = (recurso.get("reasonCode") or [{}])[0]
+    snomed = next((c.get("code") for c in razon.get("coding", []) if c.get("system") == SNOMED), None)
+    tipo = _concepto((recurso.get("type") or [{}])[0]) or CLASES_ENCUENTRO.get((recurso.get("class") or {}).get("code"))
+
+    return {
+        "fhir_id": recurso["id"],
+        "paciente_id": paciente_id,
+        "fecha": _fecha((recurso.get("period") or {}).get("start")),
+        "diagnostico": _concepto(razon) or "Sin diagnóstico registrado",
+        "codigo_snomed": snomed,
+        "tipo_id": ctx.tipo_encuentro(tipo),
+        "sede_id": ctx.sede_id,
+        "medico_id": ctx.medico_id,
+    }
+
+def fila_observacion(recurso, ctx, pacientes, encuentros):
+    paciente_id = pacientes.get(_id_referencia(recurso.get("subject"), "Patient"))
+    if paciente_id is None:
+        raise FilaInvalida("subject no apunta a un Patient importado")
+    encuentro_id = encuentros.get((paciente_id, _id_referencia(recurso.get("encounter"), "Encounter")))
+    if encuentro_id is None:
+        raise FilaInvalida("encounter no apunta a un Encounter importado del mismo paciente")
+
+    if "valueQuantity" in recurso:
+        cantidad = recurso["valueQuantity"]
+        valor, unidad = cantidad.get("value"), cantidad.get("unit") or cantidad.get("code")
+    else:
+        valor = recurso.get("valueString") or _concepto(recurso.get("valueCodeableConcept"))
+        unidad = None
+    if valor is None:
+        raise FilaInvalida("Observation sin valor")
+
+    descripcion = _concepto(recurso.get("code"))
+    if not descripcion:
+        raise FilaInvalida("Observation sin code")
+
+    return {
+        "fhir_id": recurso["id"],
+        "paciente_id": paciente_id,
+        "encuentro_id": encuentro_id,
+        "fecha": _fecha(recurso.get("effectiveDateTime") or recurso.get("issued")),
+        "descripcion": descripcion,
+        "valor": str(valor),
+        "unidad": unidad,
+        "interpretacion": _concepto((recurso.get("interpretation") or [{}])[0]),
+        "sede_id": ctx.sede_id,
+    }
+
+# Columnas que se comparan para decidir si la fila cambió
+COMPARADAS = {
+    "Encounter": ["fecha", "diagnostico", "codigo_snomed", "tipo_id", "sede_id", "medico_id"],
+    "Observation": ["fecha", "encuentro_id", "descripcion", "valor", "unidad", "interpretacion", "sede_id"],
+}
+
+def _upsert(conn, recurso, filas):
+    """
+    INSERT ... ON CONFLICT (paciente_id, fhir_id) DO UPDATE solo si algo cambió.
+    Las filas sin fecha en el origen se insertan con now() y al repetir la
+    ingesta conservan la que ya tienen: con now() en la comparación toda
+    repetición las reescribiría (y las reenviaría a FHIR).
+    """
+    modelo = models.EncuentroMedico if recurso == "Encounter" else models.ObservacionClinica
+    con_fecha = [f for f in filas if f.get("fecha") is not None]
+    sin_fecha = [f for f in filas if f.get("fecha") is None]
+    cambiados = []
+    if con_fecha:
+        cambiados += _upsert_grupo(conn, modelo.__table__, COMPARADAS[recurso], con_fecha, conservar_fecha=False)
+    if sin_fecha:
+        cambiados += _upsert_grupo(conn, modelo.__table__, COMPARADAS[recurso], sin_fecha, conservar_fecha=True)
+    return cambiados
+
+def _upsert_grupo(conn, tabla, columnas, filas, conservar_fecha):
+    for fila in filas:
+        # En la lista VALUES Citus evalúa nextval en el coordinador (no en cada shard)
+        fila["version"] = models.cambios_seq.next_value()
+        if conservar_fecha:
+            fila["fecha"] = func.now()
+
+    stmt = pg_insert(tabla).values(filas)
+    actualizar = {c: stmt.excluded[c] for c in columnas}
+    if conservar_fecha:
+        columnas = [c for c in columnas if c != "fecha"]
+        actualizar["fecha"] = func.coalesce(tabla.c.fecha, stmt.excluded.fecha)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["paciente_id", "fhir_id"],
+        set_={**actualizar, "version": stmt.excluded.version, "actualizado_en": func.now()},
+        where=or_(*(tabla.c[c].is_distinct_from(stmt.excluded[c]) for c in columnas)),
+    )
+    return conn.execute(stmt.returning(tabla.c.id, tabla.c.paciente_id)).all()
+
+def _cargar_lote(recurso, lote, ctx, avance):
+    try:
+        cambiados, rechazados = _escribir_lote(recurso, lote, ctx, avance)
+    except (IntegrityError, DataError) as e:
+        # Una fila que viola una restricción no tumba el lote: se reintenta fila
+        # por fila (cada una en su transacción) y solo se rechazan las culpables
+        print(f"   ⚠️ {recurso}: lote de {len(lote)} con conflicto, reintentando fila por fila: {str(e.orig).strip()}")
+        cambiados, rechazados = [], 0
+        for linea, r in lote:
+            try:
+                cambiada, rechazada = _escribir_lote(recurso, [(linea, r)], ctx, avance)
+            except (IntegrityError, DataError) as e:
+                cambiada, rechazada = [], 1
+                if avance.rechazados + rechazados < 20:
+                    print(f"   ❌ {recurso} línea {linea} ({r.get('id')}): {str(e.orig).strip()}")
+            cambiados += cambiada
+            rechazados += rechazada
+
+    avance.rechazados += rechazados
+    avance.cambiados += len(cambiados)
+    # Incluye los repetidos dentro del lote
+    avance.sin_cambios += len(lote) - rechazados - len(cambiados)
+
+def _escribir_lote(recurso, lote, ctx, avance):
+    """Resuelve referencias, upsert y encolado FHIR en una transacción. Retorna (cambiados, rechazados)."""
+    with engine.begin() as conn:
+        pacientes = _pacientes(conn, {_id_referencia(r.get("subject"), "Patient") for _, r in lote} - {None})
+        encuentros = {}
+        if recurso == "Observation":
+            pares = set()
+            for _, r in lote:
+                paciente_id = pacientes.get(_id_referencia(r.get("subject"), "Patient"))
+                encuentro = _id_referencia(r.get("encounter"), "Encounter")
+                if paciente_id is not None and encuentro:
+                    pares.add((paciente_id, encuentro))
+            encuentros = _encuentros(conn, pares)
+
+        filas, rechazados = {}, 0
+        for linea, r in lote:
+            try:
+                if recurso == "Encounter":
+                    fila = fila_encuentro(r, ctx, pacientes)
+                else:
+                    fila = fila_observacion(r, ctx, pacientes, encuentros)
+            except FilaInvalida as e:
+                rechazados += 1
+                if avance.rechazados + rechazados <= 20:
+                    print(f"   ❌ {recurso} línea {linea} ({r.get('id')}): {e}")
+                continue
+            # Un mismo recurso dos veces en el lote: queda el último
+            filas[(fila["paciente_id"], fila["fhir_id"])] = fila
+
+        cambiados = _upsert(conn, recurso, list(filas.values())) if filas else []
+        fhir_outbox.encolar_lote(conn, recurso, cambiados)
+    return cambiados, rechazados
+
+def ingerir_clinicos(recurso, entradas, ctx, tamano_lote):
+    avance = Avance(recurso)
+    inicio = time.perf_counter()
+    lote = []
+    for linea, r in entradas:
+        avance.leidos += 1
+        if isinstance(r, FilaInvalida) or not r.get("id"):
+            avance.rechazados += 1
+            continue
+        lote.append((linea, r))
+        if len(lote) >= tamano_lote:
+            _cargar_lote(recurso, lote, ctx, avance)
+            lote = []
+            avance.segundos = time.perf_counter() - inicio
+            print(f"--- {avance.recurso}: {avance.leidos} ({avance.por_segundo:.0f}/s) ---")
+    if lote:
+        _cargar_lote(recurso, lote, ctx, avance)
+    avance.segundos = time.perf_counter() - inicio
+    return avance
+
+def ingerir(rutas, sede_id, medico_documento=None, tamano_lote=INGESTA_LOTE):
+    """Procesa los archivos en orden Patient -> Encounter -> Observation. Retorna [Avance]."""
+    por_recurso = {tipo: [] for tipo in RECURSOS}
+    for ruta in rutas:
+        tipo = recurso_de_archivo(ruta)
+        if tipo is None:
+            raise SystemExit(f"❌ No se reconoce el tipo de recurso de {ruta} (se espera Patient/Encounter/Observation en el nombre)")
+        por_recurso[tipo].append(ruta)
+    if por_recurso["Encounter"] and not medico_documento:
+        raise SystemExit("❌ Los Encounter requieren --medico (documento del médico al que se asignan)")
+
+    db = SessionLocal()
+    try:
+        ctx = Contexto(db, sede_id, medico_documento)
+    finally:
+        db.close()
+
+    avances = []
+    for tipo in RECURSOS:
+        for ruta in por_recurso[tipo]:
+            print(f"📥 {ruta}")
+            if tipo == "Patient":
+                avance = ingerir_pacientes(recursos(ruta, tipo), sede_id, tamano_lote)
+            else:
+                avance = ingerir_clinicos(tipo, recursos(ruta, tipo), ctx, tamano_lote)
+            print(f"✅ {avance}")
+            avances.append(avance)
+    return avances
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingesta de NDJSON FHIR (Bulk Data) a la base SQL")
+    parser.add_argument("archivos", nargs="+")
+    parser.add_argument("--sede", required=True, help="id o nombre de la sede que se incorpora")
+    parser.add_argument("--medico", help="documento del médico al que se asignan los encuentros")
+    parser.add_argument("--lote", type=int, default=INGESTA_LOTE)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        sede_id = importar_pacientes.Catalogos(db).sedes.get(args.sede.upper())
+    finally:
+        db.close()
+    if sede_id is None:
+        raise SystemExit(f"❌ Sede desconocida: {args.sede}")
+
+    inicio = time.perf_counter()
+    avances = ingerir(args.archivos, sede_id, args.medico, args.lote)
+    total = sum(a.leidos for a in avances)
+    segundos = time.perf_counter() - inicio
+    print(f"🏁 {total} recursos en {segundos:.1f}s ({total / segundos if segundos else 0:.0f}/s)")
@@ -1,14 +1,10 @@
-from .database import SessionLocal, engine, Base
+from .database import SessionLocal
 from . import models
 from .utils import get_password_hash
 import datetime
 
 def init_db():
-    # Crear todas las tablas primero
-    print("Creando tablas en la base de datos...")
-    Base.metadata.create_all(bind=engine)
-    print("✅ Tablas creadas!")
-    
+    # Las tablas las crean las migraciones (alembic upgrade head)
     db = SessionLocal()
     
     try:
@@ -1,30 +1,56 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, PlainTextResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy.orm import Session, joinedload
 from typing import Optional
-from . import fhir_client
-from io import BytesIO 
-from datetime import timedelta, date, datetime
-from xhtml2pdf import pisa# Para la fecha en el PDF
+from . import fhir_client, fhir_outbox
+from datetime import datetime
+import io
 
-# Importar WeasyPrint
-# from weasyprint import HTML
+from .database import get_db, DB_ASYNC
+from . import models, auth, schemas, utils, timeline, cambios, metricas, pdf, cola_pdf, replicas, busqueda, historial_api, importar_pacientes
+from .replicas import get_db_lectura
+from .plantillas import templates
 
-from .database import engine, Base, get_db
-from . import models, auth, schemas, utils
-
-# Crear tablas
-Base.metadata.create_all(bind=engine)
+# El esquema lo administran las migraciones (alembic upgrade head en el
+# entrypoint); la aplicación no ejecuta DDL al arrancar.
 
 app = FastAPI(title="HCE Interoperable")
 
 # 1. Configuración de Archivos Estáticos y Plantillas
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+
+# Lecturas en réplicas: tras un COMMIT el navegador lee de la primaria un rato
+app.middleware("http")(replicas.fijar_primaria)
+
+# Con DB_ASYNC=1 las rutas de historial, registro y exportación se atienden
+# con AsyncSession (asyncpg); se registran primero para tomar precedencia
+# sobre sus equivalentes síncronas definidas más abajo.
+if DB_ASYNC:
+    from . import rutas_async
+    app.include_router(rutas_async.router)
+
+# 2. Workers del outbox FHIR (envían a HAPI fuera de las peticiones)
+@app.on_event("startup")
+def iniciar_outbox():
+    fhir_outbox.pool.iniciar()
+    replicas.monitor.iniciar()
+
+@app.on_event("shutdown")
+def detener_outbox():
+    fhir_outbox.pool.detener()
+    replicas.monitor.detener()
+    fhir_client.cliente.cerrar()
+    utils.cerrar_pool()
+    cola_pdf.cerrar_pool()
+
+def _cargar_usuario(db: Session, user_id: int):
+    """Registro completo del usuario (con catálogos) para las vistas que muestran su ficha"""
+    return db.query(models.Usuario).options(
+        joinedload(models.Usuario.tipo_documento),
+        joinedload(models.Usuario.sede),
+    ).filter(models.Usuario.id == user_id).first()
 
 # --- RUTA RAÍZ ---
 
@@ -35,16 +61,41 @@ def root():
 
 # --- RUTAS DE API (Backend puro) ---
 
+def _autenticar(db: Session, documento: str, password: str):
+    """
+    Retorna el usuario si la contraseña es correcta (o None). Si el hash se
+    generó con otro costo de bcrypt, lo reemplaza por uno nuevo.
+    Puede lanzar utils.LoginSaturado si el pool de hashing está lleno.
+    """
+    user = db.query(models.Usuario).options(
+        joinedload(models.Usuario.rol),
+        joinedload(models.Usuario.sede),
+    ).filter(models.Usuario.numero_documento == documento).first()
+    if not user:
+        return None
+
+    valido, nuevo_hash = utils.verify_and_update_password(password, user.password_hash)
+    if not valido:
+        return None
+    if nuevo_hash:
+        user.password_hash = nuevo_hash
+        db.commit()
+    return user
+
 @app.post("/token", response_model=schemas.Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login para clientes API (Swagger, Postman, Móvil)"""
-    user = db.query(models.Usuario).filter(models.Usuario.numero_documento == form_data.username).first()
-    if not user or not utils.verify_password(form_data.password, user.password_hash):
+    try:
+        user = _autenticar(db, form_data.username, form_data.password)
+    except utils.LoginSaturado as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "2"})
+    if not user:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
     
     access_token = auth.create_access_token(
         data={"sub": user.numero_documento, "role": user.rol.nombre}
     )
+    auth.guardar_principal(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- RUTAS DE FRONTEND (Vistas HTML) ---
@@ -62,10 +113,16 @@ def login_web(
     db: Session = Depends(get_db)
 ):
     """Procesa el formulario HTML, crea cookie y redirige"""
-    user = db.query(models.Usuario).filter(models.Usuario.numero_documento == username).first()
-    
     # Validación
-    if not user or not utils.verify_password(password, user.password_hash):
+    try:
+        user = _autenticar(db, username, password)
+    except utils.LoginSaturado:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "El sistema está recibiendo muchos inicios de sesión. Intente de nuevo en unos segundos."
+        }, status_code=429)
+
+    if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Usuario o contraseña incorrectos"
@@ -75,6 +132,7 @@ def login_web(
     access_token = auth.create_access_token(
         data={"sub": user.numero_documento, "role": user.rol.nombre}
     )
+    auth.guardar_principal(user)
     
     # Redirigir al Dashboard (que haremos luego) guardando el token en Cookie
     response = RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
@@ -82,7 +140,7 @@ def login_web(
     return response
 
 @app.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request, db: Session = Depends(get_db)):
+def dashboard(request: Request, db: Session = Depends(get_db_lectura)):
     """
     Ruta protegida:
     1. Verifica la cookie.
@@ -102,57 +160,9 @@ def dashboard(request: Request, db: Session = Depends(get_db)):
     if rol == "Medico":
         return templates.TemplateResponse("dashboard_medico.html", context)
     elif rol == "Paciente":
-        # Obtener encuentros médicos desde la base de datos local
-        encuentros_db = db.query(models.EncuentroMedico).filter(
-            models.EncuentroMedico.paciente_id == user.id
-        ).order_by(models.EncuentroMedico.fecha.desc()).all()
-        
-        historial_agrupado = []
-
-        for encuentro in encuentros_db:
-            # Extraer diagnóstico completo que puede contener: "Enfermedad | Tx: ... | Obs: ..."
-            texto_completo = encuentro.diagnostico
-            
-            # Valores por defecto
-            diag_final = texto_completo
-            tx_final = "No especificado"
-            obs_final = ""
-
-            # Separar las partes del diagnóstico
-            if " | " in texto_completo:
-                partes = texto_completo.split(" | ")
-                diag_final = partes[0]  # Primera parte es el diagnóstico
-                
-                for parte in partes[1:]:
-                    if parte.startswith("Tx: "):
-                        tx_final = parte.replace("Tx: ", "")
-                    elif parte.startswith("Obs: "):
-                        obs_final = parte.replace("Obs: ", "")
-
-            # Obtener observaciones clínicas (signos vitales) asociadas al encuentro
-            observaciones = db.query(models.ObservacionClinica).filter(
-                models.ObservacionClinica.encuentro_id == encuentro.id
-            ).all()
-            
-            signos_vitales = []
-            for obs in observaciones:
-                signo = f"{obs.descripcion}: {obs.valor}"
-                if obs.unidad:
-                    signo += f" {obs.unidad}"
-                signos_vitales.append(signo)
-
-            historial_agrupado.append({
-                "fecha": encuentro.fecha.strftime("%Y-%m-%d %H:%M"),
-                "sede": f"{encuentro.sede.nombre} - {encuentro.sede.ciudad}",
-                "tipo_encuentro": encuentro.tipo.nombre,
-                "medico": f"{encuentro.medico.nombres} {encuentro.medico.apellidos}",
-                "diagnostico": diag_final,
-                "tratamiento": tx_final,
-                "observaciones": obs_final,
-                "signos_vitales": signos_vitales
-            })
-            
-        context["historial_paciente"] = historial_agrupado
+        # La ficha del paciente (modal "Mis Datos") necesita el registro completo
+        context["user"] = _cargar_usuario(db, user.id)
+        context["historial_paciente"] = timeline.construir_timeline(db, user.id)
         return templates.TemplateResponse("dashboard_paciente.html", context)
     else:
         # Administrador y Admisionista
@@ -167,6 +177,7 @@ def registrar_atencion(
     diagnostico: str = Form(...),
     tratamiento: str = Form(...),
     observaciones_generales: str = Form(""), # <--- Nuevo campo (opcional)
+    codigo_snomed: str = Form(""),
     obs_desc: str = Form(...),
     obs_valor: str = Form(...),
     obs_unidad: str = Form(...),
@@ -188,25 +199,20 @@ def registrar_atencion(
     # 3. Crear Encuentro en SQL
     tipo_consulta = db.query(models.TipoEncuentro).first()
     
-    # --- ESTRATEGIA DE INTEROPERABILIDAD ---
-    # Para FHIR: Concatenamos todo para que viaje en el recurso Encounter (reasonCode)
-    # y el paciente pueda leerlo todo junto en su timeline.
-    info_completa_fhir = f"{diagnostico} | Tx: {tratamiento}"
-    if observaciones_generales:
-        info_completa_fhir += f" | Obs: {observaciones_generales}"
-    
+    # Cada parte de la atención va en su propia columna; el diagnóstico
+    # viaja a FHIR como reasonCode (codificado si se indicó concepto SNOMED).
     nuevo_encuentro = models.EncuentroMedico(
-        diagnostico=info_completa_fhir, # En SQL guardamos el string completo o solo el dx segun prefieras. 
-                                        # Aquí guardo el completo para consistencia con FHIR.
-        observaciones_generales=observaciones_generales, # Guardamos copia limpia en columna nueva
+        diagnostico=diagnostico,
+        tratamiento=tratamiento,
+        observaciones_generales=observaciones_generales,
+        codigo_snomed=codigo_snomed or None,
         tipo_id=tipo_consulta.id,
         sede_id=medico.sede_id,
         medico_id=medico.id,
         paciente_id=paciente.id
     )
     db.add(nuevo_encuentro)
-    db.commit()
-    db.refresh(nuevo_encuentro)
+    db.flush() # Obtener el id sin cerrar la transacción
 
     # 4. Crear Observación (Signos Vitales) en SQL
     nueva_obs = models.ObservacionClinica(
@@ -214,74 +220,23 @@ def registrar_atencion(
         valor=obs_valor,
         unidad=obs_unidad,
         sede_id=medico.sede_id,
-        encuentro_id=nuevo_encuentro.id
+        encuentro_id=nuevo_encuentro.id,
+        paciente_id=paciente.id
     )
     db.add(nueva_obs)
-    db.commit()
-    db.refresh(nueva_obs)
+    db.flush()
 
     # 5. --- INTEROPERABILIDAD FHIR ---
-    try:
-        # La función sync usará el campo .diagnostico (que ya tiene todo concatenado)
-        ok_enc = fhir_client.sync_encounter_to_fhir(nuevo_encuentro)
-        ok_obs = fhir_client.sync_observation_to_fhir(nueva_obs, paciente.numero_documento)
-        status_fhir = "✅ Sincronizado con FHIR" if (ok_enc and ok_obs) else "⚠️ Guardado localmente, error en FHIR"
-    except Exception as e:
-        status_fhir = f"⚠️ Error conexión FHIR: {str(e)}"
+    # Se encola en la misma transacción; los workers del outbox lo envían a HAPI.
+    fhir_outbox.encolar(db, "Encounter", nuevo_encuentro)
+    fhir_outbox.encolar(db, "Observation", nueva_obs)
+    db.commit()
+    status_fhir = "🕒 Sincronización FHIR en cola"
 
     # 6. --- RECARGAR HISTORIAL DESDE BASE DE DATOS ---
-    encuentros_db = db.query(models.EncuentroMedico).filter(
-        models.EncuentroMedico.paciente_id == paciente.id
-    ).order_by(models.EncuentroMedico.fecha.desc()).all()
-    
-    historial_agrupado = []
-
-    for encuentro in encuentros_db:
-        # Extraer diagnóstico completo
-        texto_completo = encuentro.diagnostico
-        
-        # Valores por defecto
-        diag_final = texto_completo
-        tx_final = "No especificado"
-        obs_final = ""
-
-        # Separar las partes del diagnóstico
-        if " | " in texto_completo:
-            partes = texto_completo.split(" | ")
-            diag_final = partes[0]
-            
-            for parte in partes[1:]:
-                if parte.startswith("Tx: "):
-                    tx_final = parte.replace("Tx: ", "")
-                elif parte.startswith("Obs: "):
-                    obs_final = parte.replace("Obs: ", "")
-
-        # Obtener observaciones clínicas (signos vitales)
-        observaciones = db.query(models.ObservacionClinica).filter(
-            models.ObservacionClinica.encuentro_id == encuentro.id
-        ).all()
-        
-        signos_vitales = []
-        for obs in observaciones:
-            signo = f"{obs.descripcion}: {obs.valor}"
-            if obs.unidad:
-                signo += f" {obs.unidad}"
-            signos_vitales.append(signo)
-
-        historial_agrupado.append({
-            "fecha": encuentro.fecha.strftime("%Y-%m-%d %H:%M"),
-            "sede": f"{encuentro.sede.nombre} - {encuentro.sede.ciudad}",
-            "tipo_encuentro": encuentro.tipo.nombre,
-            "medico": f"{encuentro.medico.nombres} {encuentro.medico.apellidos}",
-            "diagnostico": diag_final,
-            "tratamiento": tx_final,
-            "observaciones": obs_final,
-            "signos_vitales": signos_vitales
-        })
-
     context["msg"] = f"✅ Registro guardado para {paciente.nombres}. ({status_fhir})"
     context["paciente_actual"] = paciente
-    context["historial_clinico"] = historial_agrupado
+    context["historial_clinico"] = timeline.construir_timeline(db, paciente.id)
     
     return templates.TemplateResponse("dashboard_medico.html", context)
 
@@ -289,7 +244,7 @@ def registrar_atencion(
 def medico_buscar_paciente(
     request: Request,
     q_doc: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_lectura)
 ):
     """
     Permite al médico buscar un paciente para ver su historial cronológico
@@ -309,58 +264,8 @@ def medico_buscar_paciente(
         return templates.TemplateResponse("dashboard_medico.html", context)
     
     # 2. Si existe, traemos sus ANTECEDENTES desde la base de datos local
-    encuentros_db = db.query(models.EncuentroMedico).filter(
-        models.EncuentroMedico.paciente_id == paciente.id
-    ).order_by(models.EncuentroMedico.fecha.desc()).all()
-    
-    historial_agrupado = []
-
-    for encuentro in encuentros_db:
-        # Extraer diagnóstico completo
-        texto_completo = encuentro.diagnostico
-        
-        # Valores por defecto
-        diag_final = texto_completo
-        tx_final = "No especificado"
-        obs_final = ""
-
-        # Separar las partes del diagnóstico
-        if " | " in texto_completo:
-            partes = texto_completo.split(" | ")
-            diag_final = partes[0]
-            
-            for parte in partes[1:]:
-                if parte.startswith("Tx: "):
-                    tx_final = parte.replace("Tx: ", "")
-                elif parte.startswith("Obs: "):
-                    obs_final = parte.replace("Obs: ", "")
-
-        # Obtener observaciones clínicas (signos vitales)
-        observaciones = db.query(models.ObservacionClinica).filter(
-            models.ObservacionClinica.encuentro_id == encuentro.id
-        ).all()
-        
-        signos_vitales = []
-        for obs in observaciones:
-            signo = f"{obs.descripcion}: {obs.valor}"
-            if obs.unidad:
-                signo += f" {obs.unidad}"
-            signos_vitales.append(signo)
-
-        historial_agrupado.append({
-            "fecha": encuentro.fecha.strftime("%Y-%m-%d %H:%M"),
-            "sede": f"{encuentro.sede.nombre} - {encuentro.sede.ciudad}",
-            "tipo_encuentro": encuentro.tipo.nombre,
-            "medico": f"{encuentro.medico.nombres} {encuentro.medico.apellidos}",
-            "diagnostico": diag_final,
-            "tratamiento": tx_final,
-            "observaciones": obs_final,
-            "signos_vitales": signos_vitales
-        })
-
-    # Enviamos los datos al template
     context["paciente_actual"] = paciente
-    context["historial_clinico"] = historial_agrupado
+    context["historial_clinico"] = timeline.construir_timeline(db, paciente.id)
     
     return templates.TemplateResponse("dashboard_medico.html", context)
 
@@ -369,7 +274,7 @@ def medico_buscar_paciente(
 def buscar_paciente(
     request: Request,
     q_doc: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_lectura)
 ):
     """Busca un paciente para editarlo o ver sus identificadores"""
     admin_user = auth.get_current_user_from_cookie(request, db)
@@ -416,17 +321,14 @@ def actualizar_paciente(
     paciente.email = email
     paciente.telefono = telefono
     
+    # 3. --- INTEROPERABILIDAD: ACTUALIZAR EN FHIR ---
+    # El outbox reenvía el Patient con el mismo ID, así que
+    # el servidor HAPI lo trata como UPDATE (PUT).
+    fhir_outbox.encolar(db, "Patient", paciente)
     db.commit()
     db.refresh(paciente)
-
-    # 3. --- INTEROPERABILIDAD: ACTUALIZAR EN FHIR ---
-    # Al llamar a sync_patient_to_fhir nuevamente con el mismo ID,
-    # el servidor HAPI entiende que es un UPDATE (PUT) y actualiza los datos.
-    try:
-        fhir_ok = fhir_client.sync_patient_to_fhir(paciente)
-        status_fhir = "✅ Actualizado en FHIR" if fhir_ok else "⚠️ Error al actualizar FHIR"
-    except Exception as e:
-        status_fhir = f"Error FHIR: {e}"
+    auth.invalidar_principal(paciente.numero_documento)
+    status_fhir = "🕒 Actualización FHIR en cola"
 
     context = {
         "request": request, 
@@ -440,114 +342,63 @@ def actualizar_paciente(
 @app.get("/exportar_pdf")
 def exportar_pdf(request: Request, db: Session = Depends(get_db)):
     """
-    Genera la Historia Clínica en PDF usando xhtml2pdf (Compatible con Windows).
-    Permite a los pacientes descargar su historia clínica completa.
+    Historia Clínica en PDF. Si ya existe para la versión actual del historial
+    se descarga de inmediato; si no, se encola y se redirige a la página de espera.
+    La versión se lee de la primaria, de donde también lee el pool que genera
+    el PDF: con una réplica atrasada el archivo llevaría una versión que no
+    corresponde a su contenido.
     """
     user = auth.get_current_user_from_cookie(request, db)
     
     if not user or user.rol.nombre != "Paciente":
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
-    # 1. Obtener Encuentros Médicos de la BD Local
-    encuentros = db.query(models.EncuentroMedico).filter(
-        models.EncuentroMedico.paciente_id == user.id
-    ).order_by(models.EncuentroMedico.fecha.desc()).all()
-    
-    encuentros_data = []
-    for enc in encuentros:
-        # Separar el diagnóstico completo en sus partes
-        texto_completo = enc.diagnostico
-        diag_final = texto_completo
-        tx_final = "No especificado"
-        obs_final = ""
-
-        if " | " in texto_completo:
-            partes = texto_completo.split(" | ")
-            diag_final = partes[0]
-            
-            for parte in partes[1:]:
-                if parte.startswith("Tx: "):
-                    tx_final = parte.replace("Tx: ", "")
-                elif parte.startswith("Obs: "):
-                    obs_final = parte.replace("Obs: ", "")
-
-        encuentros_data.append({
-            "fecha": enc.fecha.strftime("%Y-%m-%d %H:%M"),
-            "tipo": enc.tipo.nombre,
-            "medico": f"{enc.medico.nombres} {enc.medico.apellidos}",
-            "sede": enc.sede.nombre,
-            "diagnostico": diag_final,
-            "tratamiento": tx_final,
-            "observaciones": obs_final
-        })
-    
-    # 2. Obtener Observaciones Clínicas de la BD Local
-    observaciones_locales = []
-    for enc in encuentros:
-        obs_list = db.query(models.ObservacionClinica).filter(
-            models.ObservacionClinica.encuentro_id == enc.id
-        ).all()
-        for obs in obs_list:
-            observaciones_locales.append({
-                "fecha": enc.fecha.strftime("%Y-%m-%d"),
-                "tipo": obs.descripcion,
-                "valor": obs.valor,
-                "unidad": obs.unidad or ""
-            })
-
-    # 3. Obtener Datos FHIR
-    try:
-        observaciones_fhir = fhir_client.get_patient_observations(user.numero_documento)
-        historial_fhir = []
-        for entry in observaciones_fhir:
-            resource = entry.get('resource', {})
-            fecha_raw = resource.get('meta', {}).get('lastUpdated', 'N/A')
-            fecha = fecha_raw[:10] if len(fecha_raw) >= 10 else fecha_raw
-            
-            try:
-                tipo = resource.get('code', {}).get('coding', [{}])[0].get('display', 'Observación')
-            except:
-                tipo = "Observación"
-
-            valor = resource.get('valueQuantity', {}).get('value') or resource.get('valueString', 'N/A')
-            unidad = resource.get('valueQuantity', {}).get('unit', '')
-
-            historial_fhir.append({
-                "fecha": fecha, "tipo": tipo, "valor": valor, "unidad": unidad
-            })
-    except:
-        historial_fhir = []
-
-    # 4. Preparar Contexto
-    context = {
-        "request": request,
-        "user": user,
-        "encuentros": encuentros_data,
-        "observaciones": observaciones_locales,
-        "historial_fhir": historial_fhir,
-        "today": date.today().strftime("%Y-%m-%d")
-    }
-    
-    # 5. Renderizar HTML
-    html_content = templates.TemplateResponse("pdf_template.html", context).body.decode("utf-8")
-    
-    # 6. Generar PDF con xhtml2pdf (pisa)
-    pdf_file = BytesIO()
-    pisa_status = pisa.CreatePDF(html_content, dest=pdf_file)
-    
-    if pisa_status.err:
+    trabajo_id, ruta = cola_pdf.solicitar(db, user.id)
+    if ruta:
+        return pdf.respuesta_pdf(ruta, user.numero_documento)
+    return RedirectResponse(url=f"/exportar_pdf/{trabajo_id}", status_code=status.HTTP_303_SEE_OTHER)
+
+@app.get("/exportar_pdf/{trabajo_id}")
+def descargar_pdf(trabajo_id: str, request: Request, db: Session = Depends(get_db)):
+    """Página de espera (se recarga sola) hasta que el PDF esté listo; luego lo descarga"""
+    user = auth.get_current_user_from_cookie(request, db)
+    if not user or user.rol.nombre != "Paciente":
+        return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+    if not cola_pdf.pertenece(trabajo_id, user.id):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    estado = cola_pdf.estado(trabajo_id)
+    if estado["estado"] == cola_pdf.LISTO:
+        return pdf.respuesta_pdf(cola_pdf.ruta_de(trabajo_id), user.numero_documento)
+    if estado["estado"] == cola_pdf.DESCONOCIDO:
+        # El historial cambió o el trabajo se perdió: se vuelve a solicitar
+        return RedirectResponse(url="/exportar_pdf", status_code=status.HTTP_303_SEE_OTHER)
+    if estado["estado"] == cola_pdf.ERROR:
         return HTMLResponse("Error generando PDF", status_code=500)
+    return templates.TemplateResponse("pdf_espera.html", {"request": request, "user": user, "trabajo": estado})
 
-    pdf_file.seek(0)
-    
-    # 7. Enviar al navegador para descarga
-    filename = f"Historia_Clinica_{user.numero_documento}.pdf"
-    
-    return Response(
-        content=pdf_file.read(),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+@app.get("/api/pdf/{trabajo_id}", response_model=schemas.EstadoPdf)
+def estado_pdf(trabajo_id: str, request: Request, db: Session = Depends(get_db)):
+    """Estado de un trabajo de generación de PDF"""
+    user = auth.get_current_user_from_cookie(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    if not cola_pdf.pertenece(trabajo_id, user.id):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return cola_pdf.estado(trabajo_id)
+
+@app.get("/exportar_historia")
+def exportar_historia(request: Request, db: Session = Depends(get_db)):
+    """
+    Historia Clínica en HTML para imprimir (misma plantilla del PDF). Se envía
+    mientras se genera, leyendo los encuentros por lotes, así que la memoria
+    no depende de la longitud de la historia.
+    """
+    user = auth.get_current_user_from_cookie(request, db)
+    if not user or user.rol.nombre != "Paciente":
+        return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    return StreamingResponse(pdf.html_en_streaming(user.id), media_type="text/html; charset=utf-8")
 
 @app.post("/admision/registrar_paciente", response_class=HTMLResponse)
 def registrar_paciente(
@@ -600,14 +451,14 @@ def registrar_paciente(
         )
         
         db.add(nuevo_paciente)
-        db.commit()
-        db.refresh(nuevo_paciente)
+        db.flush()
 
         # 5. --- INTEROPERABILIDAD FHIR ---
-        # En cuanto se crea en SQL, se manda a HAPI FHIR
-        fhir_ok = fhir_client.sync_patient_to_fhir(nuevo_paciente)
-        
-        msg_fhir = "✅ Sincronizado con FHIR" if fhir_ok else "⚠️ Error al sincronizar con FHIR"
+        # Se encola junto con el INSERT; el outbox lo manda a HAPI FHIR
+        fhir_outbox.encolar(db, "Patient", nuevo_paciente)
+        db.commit()
+
+        msg_fhir = "🕒 Sincronización FHIR en cola"
         context["msg"] = f"✅ Paciente {nombres} {apellidos} creado correctamente en Citus. ({msg_fhir})"
 
     except Exception as e:
@@ -616,6 +467,182 @@ def registrar_paciente(
 
     return templates.TemplateResponse("dashboard_admin.html", context)
 
+@app.post("/admision/importar", response_model=schemas.ResultadoImportacion)
+def importar_pacientes_archivo(
+    request: Request,
+    archivo: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Importación masiva de pacientes desde CSV (con encabezado) o NDJSON.
+    Columnas: nombres, apellidos, tipo_documento, numero_documento,
+    fecha_nacimiento, genero y opcionales email, telefono, sede, password.
+    Las filas sin sede quedan en la sede de quien importa.
+    """
+    admin_user = auth.get_current_user_from_cookie(request, db)
+    if not admin_user or admin_user.rol.nombre not in ["Administrador", "Admisionista"]:
+        raise HTTPException(status_code=403, detail="Sin permisos")
+
+    texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+    try:
+        reporte = importar_pacientes.importar(
+            texto, importar_pacientes.formato_de(archivo.filename or ""), admin_user.sede_id
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Archivo inválido: {e}")
+    finally:
+        texto.detach()
+    return reporte.como_dict()
+
+@app.get("/fhir/estado/{fhir_id}", response_model=schemas.EstadoSincronizacion)
+def estado_sincronizacion(fhir_id: str, request: Request, db: Session = Depends(get_db)):
+    """Estado de sincronización con HAPI de un recurso (pac-..., enc-..., obs-...)"""
+    user = auth.get_current_user_from_cookie(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    entrada = fhir_outbox.estado_recurso(db, fhir_id)
+    if not entrada:
+        raise HTTPException(status_code=404, detail="Recurso sin registro de sincronización")
+    return entrada
+
+@app.get("/fhir/pacientes/{documento}/{recurso}")
+def recursos_fhir_paciente(documento: str, recurso: str, user: auth.Principal = Depends(auth.get_current_user)):
+    """
+    Encuentros u observaciones del paciente tal como están en HAPI (Bundle
+    searchset). Se sirven desde la caché de búsquedas de fhir_client, que se
+    revalida con HAPI al vencer y se invalida con cada envío del outbox.
+    """
+    if user.rol.nombre == "Paciente" and user.numero_documento != documento:
+        raise HTTPException(status_code=403, detail="Sin permisos")
+    if recurso not in ("Encounter", "Observation"):
+        raise HTTPException(status_code=400, detail=f"Recurso no soportado: {recurso}")
+
+    try:
+        entries = fhir_client.buscar_por_paciente(recurso, documento)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"HAPI FHIR no disponible: {e}")
+    return {"resourceType": "Bundle", "type": "searchset", "total": len(entries), "entry": entries}
+
+@app.get("/api/cambios", response_model=schemas.FeedCambios)
+def feed_cambios(
+    recurso: str,
+    since: int = 0,
+    limit: int = 500,
+    user: auth.Principal = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Filas de Patient/Encounter/Observation modificadas desde la versión
+    `since`, hasta el horizonte seguro (las recientes llegan con hasta
+    CAMBIOS_MARGEN segundos de retraso; ver app/cambios.py)
+    """
+    if user.rol.nombre == "Paciente":
+        raise HTTPException(status_code=403, detail="Sin permisos")
+    if recurso not in cambios.MODELOS:
+        raise HTTPException(status_code=400, detail=f"Recurso no soportado: {recurso}")
+
+    filas = cambios.cambios_desde(db, recurso, since, min(limit, 5000))
+    return {
+        "recurso": recurso,
+        "desde": since,
+        "hasta": filas[-1].version if filas else since,
+        "cambios": [cambios.serializar(f) for f in filas],
+    }
+
+@app.get("/api/pacientes", response_model=schemas.ResultadoBusqueda)
+def buscar_pacientes(
+    request: Request,
+    q: str,
+    modo: str = busqueda.AUTO,
+    rol: Optional[str] = "Paciente",
+    sede_id: Optional[int] = None,
+    limite: int = busqueda.BUSQUEDA_LIMITE,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db_lectura)
+):
+    """
+    Búsqueda por prefijo de documento, por nombre (sin tildes) o aproximada.
+    Para la página siguiente se repite la petición con `cursor=siguiente`.
+    """
+    user = auth.get_current_user_from_cookie(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    if user.rol.nombre not in ["Administrador", "Admisionista", "Medico"]:
+        raise HTTPException(status_code=403, detail="Sin permisos")
+
+    try:
+        return busqueda.buscar(db, q, modo, rol=rol or None, sede_id=sede_id, limite=limite, cursor=cursor)
+    except busqueda.BusquedaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _pagina_historial(request, user, db, documento, funcion, catalogo, esquema, campos, **parametros):
+    """
+    Página de encuentros u observaciones de un paciente con ETag. Un
+    If-None-Match vigente se responde con 304 sin leer la página.
+    """
+    if user.rol.nombre == "Paciente" and user.numero_documento != documento:
+        raise HTTPException(status_code=403, detail="Sin permisos")
+    paciente_id = db.query(models.Usuario.id).filter(models.Usuario.numero_documento == documento).scalar()
+    if paciente_id is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+    try:
+        campos = historial_api.campos_de(campos, catalogo)
+        valor_etag = historial_api.etag(db, paciente_id, request.url.path, campos, sorted(parametros.items()))
+        cabeceras = {"ETag": valor_etag, "Cache-Control": "private, no-cache"}
+        if historial_api.coincide(request.headers.get("if-none-match"), valor_etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabeceras)
+        pagina = funcion(db, paciente_id, campos, **parametros)
+    except historial_api.ParametroInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Solo los campos pedidos: el resto queda sin asignar y se omite
+    cuerpo = esquema(paciente=documento, **pagina).model_dump(mode="json", exclude_unset=True)
+    return JSONResponse(cuerpo, headers=cabeceras)
+
+@app.get("/api/pacientes/{documento}/encuentros", response_model=schemas.PaginaEncuentros,
+         response_model_exclude_unset=True)
+def api_encuentros(
+    documento: str,
+    request: Request,
+    campos: Optional[str] = None,
+    limite: int = historial_api.API_LIMITE,
+    cursor: Optional[str] = None,
+    user: auth.Principal = Depends(auth.get_current_user),
+    db: Session = Depends(get_db_lectura)
+):
+    """
+    Encuentros del paciente, del más reciente al más antiguo. `campos`:
+    lista separada por comas (por defecto todos). Para la página siguiente se
+    repite la petición con `cursor=siguiente`.
+    """
+    return _pagina_historial(request, user, db, documento, historial_api.encuentros,
+                             historial_api.CAMPOS_ENCUENTRO, schemas.PaginaEncuentros, campos,
+                             limite=limite, cursor=cursor)
+
+@app.get("/api/pacientes/{documento}/observaciones", response_model=schemas.PaginaObservaciones,
+         response_model_exclude_unset=True)
+def api_observaciones(
+    documento: str,
+    request: Request,
+    campos: Optional[str] = None,
+    limite: int = historial_api.API_LIMITE,
+    cursor: Optional[str] = None,
+    encuentro_id: Optional[int] = None,
+    user: auth.Principal = Depends(auth.get_current_user),
+    db: Session = Depends(get_db_lectura)
+):
+    """Observaciones del paciente (opcionalmente de un encuentro), igual que /encuentros"""
+    return _pagina_historial(request, user, db, documento, historial_api.observaciones,
+                             historial_api.CAMPOS_OBSERVACION, schemas.PaginaObservaciones, campos,
+                             limite=limite, cursor=cursor, encuentro_id=encuentro_id)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Métricas para Prometheus"""
+    return metricas.exportar()
+
 @app.get("/logout")
 def logout():
     """Cierra sesión borrando la cookie"""
@@ -0,0 +1,30 @@
+# ---------------------------------------------------------
+# MÉTRICAS (formato de texto de Prometheus)
+# ---------------------------------------------------------
+# Registro mínimo sin dependencias: cada módulo registra una función que
+# devuelve el valor actual y GET /metrics las expone para el scraper.
+# Una función puede devolver un número o un dict {etiquetas: valor}.
+
+_metricas = []
+
+def registrar(nombre, tipo, ayuda, funcion):
+    """tipo: "gauge" o "counter" """
+    _metricas.append((nombre, tipo, ayuda, funcion))
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in etiquetas) + "}"
+
+def exportar():
+    lineas = []
+    for nombre, tipo, ayuda, funcion in _metricas:
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        valor = funcion()
+        if isinstance(valor, dict):
+            for etiquetas, v in valor.items():
+                lineas.append(f"{nombre}{_etiquetas(etiquetas)} {v}")
+        else:
+            lineas.append(f"{nombre} {valor}")
+    return "\n".join(lineas) + "\n"
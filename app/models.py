@@ -1,8 +1,20 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Date, ForeignKey, ForeignKeyConstraint, Float, DateTime, Sequence, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from .database import Base
 
+# 0. Seguimiento de cambios (sincronización delta)
+
+# Secuencia global: cada INSERT/UPDATE de un registro clínico toma el siguiente
+# número. Las versiones se asignan al escribir pero se confirman en otro
+# orden: los lectores de "version > N" deben respetar el horizonte de
+# app/cambios.py para no saltarse filas.
+cambios_seq = Sequence("hce_cambios_seq", metadata=Base.metadata)
+
+class SeguimientoCambios:
+    actualizado_en = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False, index=True)
+    version = Column(BigInteger, cambios_seq, onupdate=cambios_seq.next_value(), nullable=False, index=True)
+
 # 1. Catálogos (Tablas Maestras)
 
 class Rol(Base):
@@ -29,8 +41,20 @@ class TipoEncuentro(Base):
 
 # 2. Usuarios (Centralizados)
 
-class Usuario(Base):
+class Usuario(SeguimientoCambios, Base):
     __tablename__ = "usuarios"
+    __table_args__ = (
+        Index("ix_usuarios_sede_id", "sede_id"),
+        Index("ix_usuarios_rol_id", "rol_id"),
+        # Búsqueda de pacientes (app/busqueda.py): prefijo de documento y nombre sin tildes
+        Index("ix_usuarios_documento_patron", "numero_documento",
+              postgresql_ops={"numero_documento": "text_pattern_ops"}),
+        Index("ix_usuarios_nombre_trgm",
+              text("f_unaccent(lower(nombres || ' ' || apellidos)) gin_trgm_ops"),
+              postgresql_using="gin"),
+        # Ingesta FHIR -> SQL: id del Patient en el servidor de origen
+        Index("ux_usuarios_fhir_id", "fhir_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     nombres = Column(String, nullable=False)
@@ -49,6 +73,7 @@ class Usuario(Base):
     rol_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
     
     password_hash = Column(String, nullable=False) # Guardaremos la contraseña encriptada aquí
+    fhir_id = Column(String, nullable=True) # Id en el servidor FHIR de origen (solo importados)
     
     # Relaciones para navegar fácilmente
     rol = relationship("Rol")
@@ -56,20 +81,38 @@ class Usuario(Base):
     tipo_documento = relationship("TipoDocumento")
 
 # 3. Datos Clínicos (Historia Clínica)
+# En Citus estas tablas se distribuyen por paciente_id y quedan co-ubicadas
+# (ver app/citus.py): toda la historia de un paciente vive en un mismo shard.
+# Por eso paciente_id forma parte de la llave primaria y de la llave foránea
+# observación -> encuentro.
 
-class EncuentroMedico(Base):
+class EncuentroMedico(SeguimientoCambios, Base):
     __tablename__ = "encuentros_medicos"
+    __table_args__ = (
+        # Línea de tiempo y API: WHERE paciente_id = ? ORDER BY fecha DESC, id DESC.
+        # Cubre version: max(version) del paciente (timeline.version_historial,
+        # clave de los ETag y del caché de PDF) se lee solo del índice
+        Index("ix_encuentros_medicos_paciente_fecha_id", "paciente_id", text("fecha DESC"), text("id DESC"),
+              postgresql_include=["version"]),
+        Index("ix_encuentros_medicos_medico_id", "medico_id"),
+        Index("ix_encuentros_medicos_sede_id", "sede_id"),
+        Index("ix_encuentros_medicos_tipo_id", "tipo_id"),
+        Index("ux_encuentros_medicos_fhir_id", "paciente_id", "fhir_id", unique=True),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     fecha = Column(DateTime(timezone=True), server_default=func.now())
-    diagnostico = Column(String, nullable=False)
+    diagnostico = Column(String, nullable=False, index=True)
+    tratamiento = Column(String, nullable=True)
     observaciones_generales = Column(String, nullable=True)
+    codigo_snomed = Column(String, nullable=True) # Concepto SNOMED CT opcional del diagnóstico
+    fhir_id = Column(String, nullable=True) # Id en el servidor FHIR de origen (solo importados)
 
     # ... (el resto de relaciones sigue igual: tipo_id, sede_id, etc.)
     tipo_id = Column(Integer, ForeignKey("tipos_encuentro.id"), nullable=False)
     sede_id = Column(Integer, ForeignKey("sedes.id"), nullable=False)
     medico_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
-    paciente_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    paciente_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
     
     medico = relationship("Usuario", foreign_keys=[medico_id])
     paciente = relationship("Usuario", foreign_keys=[paciente_id])
@@ -77,20 +120,59 @@ class EncuentroMedico(Base):
     tipo = relationship("TipoEncuentro")
     
     observaciones = relationship("ObservacionClinica", back_populates="encuentro")
-    
-    observaciones = relationship("ObservacionClinica", back_populates="encuentro")
 
-class ObservacionClinica(Base):
+class ObservacionClinica(SeguimientoCambios, Base):
     __tablename__ = "observaciones_clinicas"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["encuentro_id", "paciente_id"],
+            ["encuentros_medicos.id", "encuentros_medicos.paciente_id"],
+        ),
+        # Observaciones del paciente agrupadas por encuentro (línea de tiempo)
+        Index("ix_observaciones_clinicas_paciente_encuentro", "paciente_id", "encuentro_id"),
+        # API del historial: páginas por (fecha, id) del más reciente al más antiguo
+        Index("ix_observaciones_clinicas_paciente_fecha", "paciente_id", text("fecha DESC"), text("id DESC")),
+        Index("ix_observaciones_clinicas_encuentro_id", "encuentro_id"),
+        Index("ix_observaciones_clinicas_sede_id", "sede_id"),
+        Index("ux_observaciones_clinicas_fhir_id", "paciente_id", "fhir_id", unique=True),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     fecha = Column(DateTime(timezone=True), server_default=func.now())
     descripcion = Column(String, nullable=False) # Ej: Frecuencia Cardiaca
     valor = Column(String, nullable=False)       # Ej: 80
     unidad = Column(String, nullable=True)       # Ej: bpm
     interpretacion = Column(String, nullable=True) # Ej: Normal
+    fhir_id = Column(String, nullable=True) # Id en el servidor FHIR de origen (solo importados)
     
     sede_id = Column(Integer, ForeignKey("sedes.id"), nullable=False)
-    encuentro_id = Column(Integer, ForeignKey("encuentros_medicos.id"), nullable=False)
+    encuentro_id = Column(Integer, nullable=False)
+    paciente_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True) # Columna de distribución
     
-    encuentro = relationship("EncuentroMedico", back_populates="observaciones")
\ No newline at end of file
+    encuentro = relationship("EncuentroMedico", back_populates="observaciones")
+# 4. Interoperabilidad (Bandeja de salida hacia FHIR)
+
+class SincronizacionFhir(Base):
+    """Outbox transaccional: una fila por recurso FHIR pendiente de enviar a HAPI"""
+    __tablename__ = "fhir_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recurso = Column(String, nullable=False)            # Patient, Encounter, Observation
+    recurso_id = Column(Integer, nullable=False)        # id de la fila en SQL
+    fhir_id = Column(String, unique=True, nullable=False, index=True) # pac-..., enc-..., obs-...
+
+    estado = Column(String, nullable=False, default="pendiente", index=True) # pendiente, en_proceso, error, sincronizado, fallido
+    intentos = Column(Integer, nullable=False, default=0)
+    proximo_intento = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    ultimo_error = Column(String, nullable=True)
+
+    creado = Column(DateTime(timezone=True), server_default=func.now())
+    actualizado = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class PuntoControlSync(Base):
+    """Marca de agua de la sincronización masiva: última versión enviada de cada tipo de recurso"""
+    __tablename__ = "sync_checkpoints"
+
+    recurso = Column(String, primary_key=True)           # Patient, Encounter, Observation
+    ultima_version = Column(BigInteger, nullable=False, default=0)
+    actualizado = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,143 @@
+import os
+import threading
+
+# ---------------------------------------------------------
+# MOTORES DE PDF
+# ---------------------------------------------------------
+# PDF_ENGINE elige cómo se convierte el HTML de la historia en PDF:
+#   - "xhtml2pdf" (por defecto): Python puro, CSS limitado.
+#   - "weasyprint": mejor soporte de CSS; la configuración de fuentes y la
+#     hoja de estilos ya parseada se comparten entre renders del proceso.
+# Solo se importa la librería del motor elegido, y recién cuando se genera
+# el primer PDF (en los procesos de cola_pdf), no al arrancar el servidor.
+# Los dos motores fallan igual: `renderizar` lanza ErrorPdf.
+
+PDF_ENGINE = os.getenv("PDF_ENGINE", "xhtml2pdf")
+
+ESTILOS = os.path.join(os.path.dirname(__file__), "templates", "pdf_estilos.css")
+
+class ErrorPdf(Exception):
+    """El motor no pudo generar el PDF"""
+
+class MotorXhtml2pdf:
+    nombre = "xhtml2pdf"
+    # xhtml2pdf no recibe hojas de estilo externas: van en la plantilla
+    estilos_en_linea = True
+
+    def __init__(self):
+        from xhtml2pdf import pisa
+        self._pisa = pisa
+
+    def renderizar(self, html, destino):
+        """html: archivo binario (UTF-8) ya posicionado al inicio. Lanza ErrorPdf si falla."""
+        try:
+            resultado = self._pisa.CreatePDF(html, dest=destino, encoding="utf-8")
+        except Exception as e:
+            raise ErrorPdf(f"xhtml2pdf: {e}") from e
+        # pisa no lanza por errores del documento: los cuenta en `err`
+        if resultado.err:
+            raise ErrorPdf(f"xhtml2pdf: {resultado.err} errores al convertir el HTML")
+
+class MotorWeasyPrint:
+    nombre = "weasyprint"
+    estilos_en_linea = False
+
+    def __init__(self):
+        import weasyprint
+        from weasyprint.text.fonts import FontConfiguration
+
+        self._weasyprint = weasyprint
+        # Fuentes y CSS se resuelven una sola vez y se reutilizan en cada render
+        self._fuentes = FontConfiguration()
+        self._estilos = weasyprint.CSS(filename=ESTILOS, font_config=self._fuentes)
+
+    def renderizar(self, html, destino):
+        try:
+            self._weasyprint.HTML(file_obj=html, encoding="utf-8").write_pdf(
+                destino, stylesheets=[self._estilos], font_config=self._fuentes
+            )
+        except Exception as e:
+            raise ErrorPdf(f"WeasyPrint: {e}") from e
+
+MOTORES = {
+    MotorXhtml2pdf.nombre: MotorXhtml2pdf,
+    MotorWeasyPrint.nombre: MotorWeasyPrint,
+}
+
+_motores = {}
+_lock = threading.Lock()
+
+def motor(nombre=None):
+    """Instancia (única por proceso) del motor `nombre` o del configurado en PDF_ENGINE"""
+    nombre = nombre or PDF_ENGINE
+    with _lock:
+        if nombre not in _motores:
+            if nombre not in MOTORES:
+                raise ValueError(f"PDF_ENGINE desconocido: {nombre} (opciones: {', '.join(MOTORES)})")
+            _motores[nombre] = MOTORES[nombre]()
+        return _motores[nombre]
+
+# --- Comparación de motores ---
+
+def _medir(nombre, paciente_id, repeticiones):
+    """Se ejecuta en un proceso nuevo por motor para que el pico de memoria sea solo suyo"""
+    import resource
+    import time
+    from tempfile import TemporaryFile
+
+    from . import pdf, timeline
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        context = pdf.contexto_pdf(pdf.cargar_paciente(db, paciente_id), timeline.construir_timeline(db, paciente_id))
+    finally:
+        db.close()
+
+    inicio = time.perf_counter()
+    seleccionado = motor(nombre)
+    carga = time.perf_counter() - inicio
+
+    tiempos = []
+    for _ in range(repeticiones):
+        with TemporaryFile() as destino:
+            inicio = time.perf_counter()
+            pdf.renderizar_pdf(context, destino, seleccionado)
+            tiempos.append(time.perf_counter() - inicio)
+            tamano = destino.tell()
+
+    return {
+        "encuentros": len(context["encuentros"]),
+        "import": carga,
+        "primero": tiempos[0],
+        "promedio": sum(tiempos) / len(tiempos),
+        "kb": tamano / 1024,
+        "pico_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB en Linux
+    }
+
+if __name__ == "__main__":
+    # Uso: python -m app.motores_pdf <numero_documento> [repeticiones]
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    from . import models
+    from .database import SessionLocal
+
+    documento = sys.argv[1]
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    db = SessionLocal()
+    try:
+        paciente = db.query(models.Usuario).filter(models.Usuario.numero_documento == documento).first()
+        if not paciente:
+            sys.exit(f"Paciente {documento} no encontrado")
+        paciente_id = paciente.id
+    finally:
+        db.close()
+
+    for nombre in MOTORES:
+        with ProcessPoolExecutor(max_workers=1) as proceso:
+            r = proceso.submit(_medir, nombre, paciente_id, repeticiones).result()
+        print(f"{nombre:>11}: {r['encuentros']} encuentros | import {r['import']:.2f}s | "
+              f"primero {r['primero']:.2f}s | promedio {r['promedio']:.2f}s | "
+              f"{r['kb']:.0f} KB | pico RSS {r['pico_mb']:.0f} MB")
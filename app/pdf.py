@@ -0,0 +1,79 @@
+import os
+from datetime import date
+from tempfile import SpooledTemporaryFile
+
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import joinedload
+
+from . import models, motores_pdf, timeline
+from .plantillas import templates
+
+# ---------------------------------------------------------
+# EXPORTACIÓN DE LA HISTORIA CLÍNICA EN PDF
+# ---------------------------------------------------------
+# `encuentros` en el contexto puede ser una lista (construir_timeline) o un
+# timeline.HistorialEnStreaming: la plantilla se renderiza por fragmentos
+# (Template.generate / stream), así que con el segundo la memoria no crece
+# con la longitud de la historia.
+
+# Bytes de HTML que se mantienen en memoria antes de pasar a disco
+PDF_SPOOL_MAX = int(os.getenv("PDF_SPOOL_MAX", str(8 * 1024 * 1024)))
+
+# Fragmentos de la plantilla agrupados por cada envío al navegador
+HTML_BUFFER = int(os.getenv("HTML_BUFFER", "64"))
+
+def cargar_paciente(db, paciente_id):
+    """Usuario con los catálogos que muestra el encabezado del documento"""
+    return db.query(models.Usuario).options(
+        joinedload(models.Usuario.tipo_documento),
+        joinedload(models.Usuario.sede),
+    ).filter(models.Usuario.id == paciente_id).first()
+
+def contexto_pdf(user, historial):
+    return {
+        "user": user,
+        "encuentros": historial,
+        "today": date.today().strftime("%Y-%m-%d"),
+        "estilos_en_linea": True,
+    }
+
+def renderizar_pdf(context, destino, motor=None):
+    """
+    HTML con Jinja y PDF con el motor configurado (motores_pdf.PDF_ENGINE),
+    escrito en `destino` (archivo binario abierto). El HTML se acumula en un
+    archivo temporal que pasa a disco al superar PDF_SPOOL_MAX. Lanza
+    motores_pdf.ErrorPdf si el motor falla.
+    """
+    motor = motor or motores_pdf.motor()
+    context = dict(context, estilos_en_linea=motor.estilos_en_linea)
+    with SpooledTemporaryFile(max_size=PDF_SPOOL_MAX, mode="w+b") as html:
+        for fragmento in templates.get_template("pdf_template.html").generate(context):
+            html.write(fragmento.encode("utf-8"))
+        html.seek(0)
+        motor.renderizar(html, destino)
+
+def html_en_streaming(paciente_id):
+    """
+    Versión HTML para imprimir, generada mientras se envía. Abre su propia
+    sesión: el generador sigue leyendo de la base después de que la ruta
+    retornó la StreamingResponse.
+    """
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        context = contexto_pdf(cargar_paciente(db, paciente_id), timeline.HistorialEnStreaming(db, paciente_id))
+        stream = templates.get_template("pdf_template.html").stream(context)
+        stream.enable_buffering(HTML_BUFFER)
+        yield from stream
+    finally:
+        db.close()
+
+def respuesta_pdf(ruta, numero_documento):
+    """Envía al navegador, para descarga, el PDF ya generado en disco"""
+    filename = f"Historia_Clinica_{numero_documento}.pdf"
+    return FileResponse(
+        ruta,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
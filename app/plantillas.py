@@ -0,0 +1,25 @@
+import os
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+
+# Plantillas Jinja compartidas por las rutas (sync y async) y la exportación PDF
+templates = Jinja2Templates(directory="app/templates")
+
+# Las plantillas compiladas se guardan en disco: los procesos nuevos (workers
+# de uvicorn, pool de PDF) las cargan sin volver a parsear el HTML.
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "/tmp/hce_jinja")
+
+class _CacheEnDisco(FileSystemBytecodeCache):
+    """Crea el directorio al guardar la primera plantilla compilada, no al importar"""
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+templates.env.bytecode_cache = _CacheEnDisco(JINJA_CACHE_DIR)
+
+def precompilar(*nombres):
+    """Carga (y compila) las plantillas por adelantado"""
+    for nombre in nombres:
+        templates.get_template(nombre)
@@ -0,0 +1,188 @@
+import contextvars
+import itertools
+import os
+import threading
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+
+from . import metricas
+from .database import (
+    SessionLocal, engine, _pools, PoolMedido, connect_args_psycopg, opciones_pool,
+)
+
+# ---------------------------------------------------------
+# RÉPLICAS DE LECTURA
+# ---------------------------------------------------------
+# Las rutas que solo leen (dashboard, búsquedas, API del historial) usan
+# get_db_lectura: su sesión envía las consultas a una réplica en streaming
+# y cualquier escritura (flush, INSERT/UPDATE/DELETE) a la primaria. Cada
+# sesión elige una réplica al primer SELECT y se queda con ella, para no
+# mezclar instantáneas de réplicas distintas en una misma petición.
+#
+# La réplica se elige por turno entre las que responden y tienen un retraso
+# de replicación menor a DB_REPLICA_LAG_MAX; el retraso lo mide un hilo en
+# segundo plano cada DB_REPLICA_INTERVALO segundos. Si ninguna califica
+# (o aún no se midió) se lee de la primaria.
+#
+# Leer lo propio: cuando una petición hace COMMIT, la respuesta lleva la
+# cookie COOKIE_PRIMARIA durante DB_STICKY_SEGUNDOS y, mientras exista, las
+# lecturas de ese navegador van a la primaria. Así el médico que acaba de
+# registrar una atención no ve un historial sin ella.
+#
+# Sin DATABASE_REPLICA_URLS todo va a la primaria, como antes. Las rutas
+# async (DB_ASYNC=1) siguen leyendo de la primaria.
+
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+DB_REPLICA_LAG_MAX = float(os.getenv("DB_REPLICA_LAG_MAX", "5"))
+DB_REPLICA_INTERVALO = float(os.getenv("DB_REPLICA_INTERVALO", "2"))
+DB_STICKY_SEGUNDOS = int(os.getenv("DB_STICKY_SEGUNDOS", "10"))
+
+COOKIE_PRIMARIA = "hce_primaria"
+
+# En la primaria el retraso es 0. En una réplica conectada (receptor de WAL
+# en streaming) sin WAL pendiente también; con WAL pendiente, o sin conexión
+# con la primaria, es cuánto hace que se aplicó la última transacción: una
+# réplica desconectada no recibe WAL y "sin WAL pendiente" no significaría
+# que está al día. NULL (nunca aplicó nada) = no disponible.
+# Ver `status` de pg_stat_wal_receiver requiere superusuario o pg_read_all_stats.
+SQL_RETRASO = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+             AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+replicas = []
+for _url in DATABASE_REPLICA_URLS:
+    _motor = create_engine(_url, poolclass=PoolMedido, connect_args=connect_args_psycopg(), **opciones_pool())
+    _pools.append(_motor.pool)
+    replicas.append(_motor)
+
+_retrasos = [None] * len(replicas)  # segundos, o None si no responde / sin medir
+_turno = itertools.count()
+_estado = {"replica": 0, "primaria": 0}
+_estado_lock = threading.Lock()
+
+def _disponibles():
+    return [m for m, r in zip(replicas, _retrasos) if r is not None and r <= DB_REPLICA_LAG_MAX]
+
+def elegir_motor():
+    """Siguiente réplica al día (por turno), o la primaria si no hay ninguna"""
+    disponibles = _disponibles()
+    with _estado_lock:
+        if not disponibles:
+            _estado["primaria"] += 1
+            return engine
+        _estado["replica"] += 1
+        return disponibles[next(_turno) % len(disponibles)]
+
+class SesionEnrutada(Session):
+    """Lecturas a una réplica, escrituras a la primaria"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            return engine
+        if "motor" not in self.info:
+            self.info["motor"] = elegir_motor()
+        return self.info["motor"]
+
+SessionLectura = sessionmaker(class_=SesionEnrutada, autocommit=False, autoflush=False)
+
+# --- Leer lo propio ---
+
+_escritura = contextvars.ContextVar("hce_escritura", default=None)
+
+@event.listens_for(Session, "after_commit")
+def _marcar_escritura(session):
+    # Solo cuenta si la transacción tocó algo (un COMMIT de solo lectura no)
+    if session.info.pop("escribio", False):
+        marca = _escritura.get()
+        if marca is not None:
+            marca["commit"] = True
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_escritura(session):
+    session.info.pop("escribio", None)
+
+@event.listens_for(Session, "after_flush")
+def _flush(session, contexto):
+    session.info["escribio"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _dml(estado):
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        estado.session.info["escribio"] = True
+
+async def fijar_primaria(request, call_next):
+    """Middleware: tras un COMMIT, las lecturas del mismo navegador van a la primaria por un rato"""
+    marca = {"commit": False}
+    _escritura.set(marca)
+    response = await call_next(request)
+    if marca["commit"] and replicas:
+        response.set_cookie(COOKIE_PRIMARIA, "1", max_age=DB_STICKY_SEGUNDOS, httponly=True)
+    return response
+
+def get_db_lectura(request: Request):
+    """Dependencia para rutas de solo lectura"""
+    if not replicas or request.cookies.get(COOKIE_PRIMARIA):
+        db = SessionLocal()
+    else:
+        db = SessionLectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# --- Monitor de retraso ---
+
+class MonitorReplicas:
+    def __init__(self, intervalo=DB_REPLICA_INTERVALO):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def medir(self):
+        for i, motor in enumerate(replicas):
+            try:
+                with motor.connect() as conn:
+                    retraso = conn.execute(SQL_RETRASO).scalar()
+                if retraso is None and _retrasos[i] is not None:
+                    print(f"⚠️ Réplica {i} sin transacciones aplicadas ni conexión con la primaria")
+                _retrasos[i] = None if retraso is None else float(retraso)
+            except Exception as e:
+                if _retrasos[i] is not None:
+                    print(f"⚠️ Réplica {i} fuera de servicio: {e}")
+                _retrasos[i] = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self.medir()
+            self._detener.wait(self.intervalo)
+
+    def iniciar(self):
+        if not replicas or self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="replicas-monitor", daemon=True)
+        self._hilo.start()
+        print(f"🔄 Réplicas de lectura: {len(replicas)} configuradas")
+
+    def detener(self, espera=5.0):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=espera)
+            self._hilo = None
+
+monitor = MonitorReplicas()
+
+metricas.registrar("hce_db_replica_retraso_segundos", "gauge",
+                   "Retraso de replicación medido por réplica (-1 = no responde)",
+                   lambda: {(("replica", str(i)),): -1 if r is None else r for i, r in enumerate(_retrasos)})
+metricas.registrar("hce_db_lecturas_total", "counter",
+                   "Sesiones de lectura por destino",
+                   lambda: {(("destino", k),): v for k, v in _estado.items()})
@@ -0,0 +1,215 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Request, Form, status
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from . import auth, cola_pdf, fhir_outbox, models, pdf, timeline, utils
+from .database import get_async_db
+from .plantillas import templates
+
+# ---------------------------------------------------------
+# RUTAS ASÍNCRONAS (DB_ASYNC=1)
+# ---------------------------------------------------------
+# Versiones `async def` de las rutas de historial, búsqueda, registro y
+# exportación sobre AsyncSession + asyncpg. Mientras esperan a la base de
+# datos no ocupan un hilo del threadpool de Starlette. main.py registra este
+# router antes que las rutas síncronas, así que lo reemplaza en los mismos
+# paths. La lógica compartida (timeline, outbox, principal) se reutiliza con
+# `run_sync`; el PDF se genera en el pool de procesos de cola_pdf.
+
+router = APIRouter()
+
+async def _buscar_usuario(db, **filtros):
+    resultado = await db.execute(
+        select(models.Usuario).options(
+            joinedload(models.Usuario.tipo_documento),
+            joinedload(models.Usuario.sede),
+        ).filter_by(**filtros)
+    )
+    return resultado.scalars().first()
+
+@router.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request, db=Depends(get_async_db)):
+    user = await auth.get_current_user_from_cookie_async(request, db)
+    if not user:
+        return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    rol = user.rol.nombre
+    context = {"request": request, "user": user}
+
+    if rol == "Medico":
+        return templates.TemplateResponse("dashboard_medico.html", context)
+    elif rol == "Paciente":
+        context["user"] = await _buscar_usuario(db, id=user.id)
+        context["historial_paciente"] = await db.run_sync(timeline.construir_timeline, user.id)
+        return templates.TemplateResponse("dashboard_paciente.html", context)
+    else:
+        return templates.TemplateResponse("dashboard_admin.html", context)
+
+@router.post("/medico/registrar", response_class=HTMLResponse)
+async def registrar_atencion(
+    request: Request,
+    paciente_doc: str = Form(...),
+    diagnostico: str = Form(...),
+    tratamiento: str = Form(...),
+    observaciones_generales: str = Form(""),
+    codigo_snomed: str = Form(""),
+    obs_desc: str = Form(...),
+    obs_valor: str = Form(...),
+    obs_unidad: str = Form(...),
+    db=Depends(get_async_db)
+):
+    medico = await auth.get_current_user_from_cookie_async(request, db)
+    if not medico or medico.rol.nombre != "Medico":
+        return RedirectResponse(url="/login", status_code=303)
+
+    paciente = await _buscar_usuario(db, numero_documento=paciente_doc)
+    context = {"request": request, "user": medico}
+
+    if not paciente:
+        context["msg"] = f"❌ Error: El paciente con documento {paciente_doc} no existe."
+        return templates.TemplateResponse("dashboard_medico.html", context)
+
+    tipo_consulta = (await db.execute(select(models.TipoEncuentro).limit(1))).scalars().first()
+
+    nuevo_encuentro = models.EncuentroMedico(
+        diagnostico=diagnostico,
+        tratamiento=tratamiento,
+        observaciones_generales=observaciones_generales,
+        codigo_snomed=codigo_snomed or None,
+        tipo_id=tipo_consulta.id,
+        sede_id=medico.sede_id,
+        medico_id=medico.id,
+        paciente_id=paciente.id
+    )
+    db.add(nuevo_encuentro)
+    await db.flush()
+
+    nueva_obs = models.ObservacionClinica(
+        descripcion=obs_desc,
+        valor=obs_valor,
+        unidad=obs_unidad,
+        sede_id=medico.sede_id,
+        encuentro_id=nuevo_encuentro.id,
+        paciente_id=paciente.id
+    )
+    db.add(nueva_obs)
+    await db.flush()
+
+    def encolar(sesion):
+        fhir_outbox.encolar(sesion, "Encounter", nuevo_encuentro)
+        fhir_outbox.encolar(sesion, "Observation", nueva_obs)
+
+    await db.run_sync(encolar)
+    await db.commit()
+
+    context["msg"] = f"✅ Registro guardado para {paciente.nombres}. (🕒 Sincronización FHIR en cola)"
+    context["paciente_actual"] = paciente
+    context["historial_clinico"] = await db.run_sync(timeline.construir_timeline, paciente.id)
+    return templates.TemplateResponse("dashboard_medico.html", context)
+
+@router.get("/medico/buscar_paciente", response_class=HTMLResponse)
+async def medico_buscar_paciente(request: Request, q_doc: str, db=Depends(get_async_db)):
+    medico = await auth.get_current_user_from_cookie_async(request, db)
+    if not medico or medico.rol.nombre != "Medico":
+        return RedirectResponse(url="/login", status_code=303)
+
+    paciente = await _buscar_usuario(db, numero_documento=q_doc)
+    context = {"request": request, "user": medico}
+
+    if not paciente:
+        context["msg"] = f"⚠️ Paciente con documento {q_doc} no encontrado en la base de datos."
+        return templates.TemplateResponse("dashboard_medico.html", context)
+
+    context["paciente_actual"] = paciente
+    context["historial_clinico"] = await db.run_sync(timeline.construir_timeline, paciente.id)
+    return templates.TemplateResponse("dashboard_medico.html", context)
+
+@router.get("/admision/buscar", response_class=HTMLResponse)
+async def buscar_paciente(request: Request, q_doc: str, db=Depends(get_async_db)):
+    admin_user = await auth.get_current_user_from_cookie_async(request, db)
+    if not admin_user or admin_user.rol.nombre not in ["Administrador", "Admisionista"]:
+        return RedirectResponse(url="/login", status_code=303)
+
+    paciente = await _buscar_usuario(db, numero_documento=q_doc)
+    context = {"request": request, "user": admin_user}
+
+    if paciente:
+        context["paciente_encontrado"] = paciente
+        context["msg"] = "✅ Paciente encontrado. Puede actualizar datos o generar identificadores."
+    else:
+        context["msg"] = f"⚠️ No se encontró ningún paciente con el documento {q_doc}."
+
+    return templates.TemplateResponse("dashboard_admin.html", context)
+
+@router.post("/admision/registrar_paciente", response_class=HTMLResponse)
+async def registrar_paciente(
+    request: Request,
+    nombres: str = Form(...),
+    apellidos: str = Form(...),
+    tipo_doc: str = Form(...),
+    num_doc: str = Form(...),
+    fecha_nac: str = Form(...),
+    genero: str = Form(...),
+    email: str = Form(None),
+    password: str = Form(...),
+    db=Depends(get_async_db)
+):
+    admin_user = await auth.get_current_user_from_cookie_async(request, db)
+    if not admin_user or admin_user.rol.nombre not in ["Administrador", "Admisionista"]:
+        return RedirectResponse(url="/login", status_code=303)
+
+    context = {"request": request, "user": admin_user}
+
+    if await _buscar_usuario(db, numero_documento=num_doc):
+        context["msg"] = f"⚠️ Error: El paciente con documento {num_doc} ya existe."
+        return templates.TemplateResponse("dashboard_admin.html", context)
+
+    try:
+        td_obj = (await db.execute(
+            select(models.TipoDocumento).filter(models.TipoDocumento.prefijo == tipo_doc)
+        )).scalars().first()
+        rol_paciente = (await db.execute(
+            select(models.Rol).filter(models.Rol.nombre == "Paciente")
+        )).scalars().first()
+
+        nuevo_paciente = models.Usuario(
+            nombres=nombres,
+            apellidos=apellidos,
+            tipo_documento_id=td_obj.id,
+            numero_documento=num_doc,
+            fecha_nacimiento=datetime.strptime(fecha_nac, "%Y-%m-%d").date(),
+            genero=genero,
+            email=email,
+            sede_id=admin_user.sede_id,
+            rol_id=rol_paciente.id,
+            password_hash=await utils.get_password_hash_async(password)
+        )
+        db.add(nuevo_paciente)
+        await db.flush()
+
+        # construir_patient (en el worker del outbox) solo necesita el documento
+        await db.run_sync(lambda sesion: fhir_outbox.encolar(sesion, "Patient", nuevo_paciente))
+        await db.commit()
+
+        context["msg"] = f"✅ Paciente {nombres} {apellidos} creado correctamente en Citus. (🕒 Sincronización FHIR en cola)"
+
+    except Exception as e:
+        await db.rollback()
+        context["msg"] = f"❌ Error interno: {str(e)}"
+
+    return templates.TemplateResponse("dashboard_admin.html", context)
+
+@router.get("/exportar_pdf")
+async def exportar_pdf(request: Request, db=Depends(get_async_db)):
+    user = await auth.get_current_user_from_cookie_async(request, db)
+    if not user or user.rol.nombre != "Paciente":
+        return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+
+    # La generación corre en el pool de cola_pdf; aquí solo se consulta la versión
+    trabajo_id, ruta = await db.run_sync(cola_pdf.solicitar, user.id)
+    if ruta:
+        return pdf.respuesta_pdf(ruta, user.numero_documento)
+    return RedirectResponse(url=f"/exportar_pdf/{trabajo_id}", status_code=status.HTTP_303_SEE_OTHER)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List
-from datetime import date
+from typing import Optional, List, Any, Dict
+from datetime import date, datetime
 
 # 1. Esquemas para Autenticación (Token)
 class Token(BaseModel):
@@ -23,4 +23,99 @@ class UsuarioOut(UsuarioBase):
     numero_documento: str
     
     class Config:
-        from_attributes = True # Permite leer desde los modelos de SQLAlchemy
\ No newline at end of file
+        from_attributes = True # Permite leer desde los modelos de SQLAlchemy
+
+# 3. Esquemas de Interoperabilidad (estado de sincronización FHIR)
+class EstadoSincronizacion(BaseModel):
+    recurso: str
+    fhir_id: str
+    estado: str
+    intentos: int
+    proximo_intento: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+    actualizado: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# 4. Feed de cambios (sincronización delta)
+class FeedCambios(BaseModel):
+    recurso: str
+    desde: int
+    hasta: int              # Usar como `since` en la siguiente llamada
+    cambios: List[Dict[str, Any]]
+
+# 5. Generación de PDF en segundo plano
+class EstadoPdf(BaseModel):
+    trabajo_id: str
+    estado: str             # en_proceso, listo, error, desconocido
+    error: Optional[str] = None
+
+# 6. Búsqueda de pacientes (paginación por cursor)
+class PacienteResumen(BaseModel):
+    id: int
+    numero_documento: str
+    nombres: str
+    apellidos: str
+    fecha_nacimiento: date
+    sede_id: int
+    similitud: Optional[float] = None   # Solo en modo aproximado
+
+    class Config:
+        from_attributes = True
+
+class ResultadoBusqueda(BaseModel):
+    modo: str               # documento, nombre o aproximado
+    resultados: List[PacienteResumen]
+    siguiente: Optional[str] = None     # Pasar como `cursor` para la página siguiente
+
+# 7. API del historial (los campos no pedidos en `campos` se omiten)
+class EncuentroApi(BaseModel):
+    id: Optional[int] = None
+    fecha: Optional[datetime] = None
+    tipo: Optional[str] = None
+    sede: Optional[str] = None
+    medico: Optional[str] = None
+    diagnostico: Optional[str] = None
+    codigo_snomed: Optional[str] = None
+    tratamiento: Optional[str] = None
+    observaciones_generales: Optional[str] = None
+    version: Optional[int] = None
+
+class ObservacionApi(BaseModel):
+    id: Optional[int] = None
+    fecha: Optional[datetime] = None
+    encuentro_id: Optional[int] = None
+    descripcion: Optional[str] = None
+    valor: Optional[str] = None
+    unidad: Optional[str] = None
+    interpretacion: Optional[str] = None
+    sede_id: Optional[int] = None
+    version: Optional[int] = None
+
+class PaginaEncuentros(BaseModel):
+    paciente: str
+    resultados: List[EncuentroApi]
+    siguiente: Optional[str] = None     # Pasar como `cursor` para la página siguiente
+
+class PaginaObservaciones(BaseModel):
+    paciente: str
+    resultados: List[ObservacionApi]
+    siguiente: Optional[str] = None
+
+# 8. Importación masiva de pacientes
+class RechazoImportacion(BaseModel):
+    linea: int
+    documento: Optional[str] = None
+    motivo: str
+
+class ResultadoImportacion(BaseModel):
+    leidas: int
+    insertadas: int
+    actualizadas: int
+    sin_cambios: int
+    duplicadas: int
+    rechazadas: int
+    rechazos: List[RechazoImportacion]   # Hasta IMPORTACION_MAX_RECHAZOS
+    segundos: float
+    filas_por_segundo: float
@@ -1,23 +1,171 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from . import cambios
 from .database import SessionLocal
-from .models import Usuario
-from .fhir_client import sync_patient_to_fhir
+from .models import Usuario, Rol, EncuentroMedico, ObservacionClinica, PuntoControlSync
+from .fhir_client import (
+    construir_patient, construir_encounter, construir_observation,
+    enviar_bundle, FHIR_BUNDLE_SIZE,
+)
+
+# ---------------------------------------------------------
+# SINCRONIZACIÓN MASIVA SQL -> FHIR (reanudable)
+# ---------------------------------------------------------
+# Recorre las tablas con un cursor del lado del servidor (yield_per), arma
+# Bundles batch y los envía en paralelo con un número acotado de workers.
+# Las filas se leen en orden de `version` hasta el horizonte seguro (ver
+# app/cambios.py) y tras cada Bundle confirmado se guarda la marca de agua
+# (última versión enviada) en `sync_checkpoints`: una caída reanuda donde
+# quedó y una nueva ejecución solo envía las filas creadas o modificadas
+# desde entonces.
+# Uso: python -m app.sync_fhir --workers 4 --tamano-bundle 100
+
+SYNC_WORKERS = int(os.getenv("FHIR_SYNC_WORKERS", "4"))
+SYNC_LOTE_DB = int(os.getenv("FHIR_SYNC_LOTE_DB", "1000"))
+
+# Orden obligatorio: los Encounter referencian Patient y las Observation, Encounter
+RECURSOS = ["Patient", "Encounter", "Observation"]
+
+def _consulta(db, recurso, desde_version):
+    if recurso == "Patient":
+        # Solo pacientes: médicos y personal de admisión no son recursos Patient
+        rol_paciente = select(Rol.id).where(Rol.nombre == "Paciente").scalar_subquery()
+        query = db.query(Usuario).options(joinedload(Usuario.tipo_documento)).filter(Usuario.rol_id == rol_paciente)
+        modelo = Usuario
+    elif recurso == "Encounter":
+        query = db.query(EncuentroMedico).options(
+            joinedload(EncuentroMedico.paciente),
+            joinedload(EncuentroMedico.sede),
+        )
+        modelo = EncuentroMedico
+    else:
+        query = db.query(ObservacionClinica).options(
+            joinedload(ObservacionClinica.encuentro).joinedload(EncuentroMedico.paciente)
+        )
+        modelo = ObservacionClinica
+    return query.filter(*cambios.filtro_seguro(db, modelo, desde_version)).order_by(modelo.version)
+
+def _construir(recurso, fila):
+    if recurso == "Patient":
+        return construir_patient(fila)
+    if recurso == "Encounter":
+        return construir_encounter(fila)
+    return construir_observation(fila, fila.encuentro.paciente.numero_documento)
 
-def sync_all_patients():
+def leer_checkpoint(recurso):
     db = SessionLocal()
     try:
-        # Buscamos solo los usuarios que sean pacientes o todos si quieres probar
-        # En este caso enviaremos TODOS para que queden registrados como Personas en el sistema FHIR
-        usuarios = db.query(Usuario).all()
-        
-        print(f"Encontrados {len(usuarios)} usuarios para sincronizar...")
-        
-        for u in usuarios:
-            sync_patient_to_fhir(u)
-            
-    except Exception as e:
-        print(f"Error general: {e}")
+        punto = db.get(PuntoControlSync, recurso)
+        return punto.ultima_version if punto else 0
     finally:
         db.close()
 
+def guardar_checkpoint(recurso, ultima_version):
+    db = SessionLocal()
+    try:
+        punto = db.get(PuntoControlSync, recurso)
+        if punto is None:
+            punto = PuntoControlSync(recurso=recurso)
+            db.add(punto)
+        punto.ultima_version = ultima_version
+        db.commit()
+    finally:
+        db.close()
+
+def sincronizar_recurso(recurso, workers=SYNC_WORKERS, tamano_bundle=FHIR_BUNDLE_SIZE, lote_db=SYNC_LOTE_DB):
+    """Envía las filas de `recurso` posteriores a su marca de agua. Retorna (enviados, fallidos)."""
+    desde_version = leer_checkpoint(recurso)
+    print(f"🔄 {recurso}: sincronizando cambios con versión > {desde_version}")
+
+    enviados = 0
+    fallidos = 0
+    inicio = time.monotonic()
+
+    # Lotes en vuelo en orden de lectura: [ultima_version, future]. La marca de agua
+    # solo avanza sobre el prefijo de lotes terminados sin errores.
+    en_vuelo = []
+    marca = desde_version
+    detenido = False
+
+    def avanzar_marca():
+        nonlocal marca, detenido, enviados, fallidos
+        while en_vuelo and en_vuelo[0][1].done():
+            ultima_version, futuro = en_vuelo.pop(0)
+            resultados = futuro.result()
+            errores = [r for r in resultados if not r.ok]
+            enviados += len(resultados) - len(errores)
+            fallidos += len(errores)
+            if errores:
+                detenido = True  # Se reintentará desde aquí en la próxima ejecución
+            if not detenido:
+                marca = ultima_version
+                guardar_checkpoint(recurso, marca)
+
+    db = SessionLocal()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            lote, ultima_version = [], desde_version
+            for fila in _consulta(db, recurso, desde_version).yield_per(lote_db):
+                lote.append(_construir(recurso, fila))
+                ultima_version = fila.version
+                if len(lote) < tamano_bundle:
+                    continue
+
+                # Contrapresión: no más de 2 Bundles por worker esperando. Solo se
+                # espera a los pendientes: los terminados detrás de un lote lento
+                # siguen en en_vuelo y harían que wait() retorne de inmediato.
+                while True:
+                    pendientes = [f for _, f in en_vuelo if not f.done()]
+                    if len(pendientes) < workers * 2:
+                        break
+                    wait(pendientes, return_when=FIRST_COMPLETED)
+                en_vuelo.append([ultima_version, pool.submit(enviar_bundle, lote, "batch")])
+                lote = []
+                avanzar_marca()
+
+            if lote:
+                en_vuelo.append([ultima_version, pool.submit(enviar_bundle, lote, "batch")])
+
+            wait([f for _, f in en_vuelo])
+            avanzar_marca()
+    finally:
+        db.close()
+
+    duracion = time.monotonic() - inicio
+    print(f"✅ {recurso}: {enviados} enviados, {fallidos} fallidos en {duracion:.1f}s (marca de agua: {marca})")
+    return enviados, fallidos
+
+def sincronizar(recursos=RECURSOS, workers=SYNC_WORKERS, tamano_bundle=FHIR_BUNDLE_SIZE,
+                lote_db=SYNC_LOTE_DB, desde_cero=False):
+    total_fallidos = 0
+    for recurso in recursos:
+        if desde_cero:
+            guardar_checkpoint(recurso, 0)
+        _, fallidos = sincronizar_recurso(recurso, workers, tamano_bundle, lote_db)
+        total_fallidos += fallidos
+    return total_fallidos
+
 if __name__ == "__main__":
-    sync_all_patients()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sincronización masiva SQL -> HAPI FHIR")
+    parser.add_argument("--recursos", default=",".join(RECURSOS),
+                        help="Tipos a sincronizar, separados por coma (Patient,Encounter,Observation)")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="Bundles enviados en paralelo")
+    parser.add_argument("--tamano-bundle", type=int, default=FHIR_BUNDLE_SIZE, help="Recursos por Bundle")
+    parser.add_argument("--lote-db", type=int, default=SYNC_LOTE_DB, help="Filas leídas por vuelta del cursor")
+    parser.add_argument("--desde-cero", action="store_true", help="Ignora las marcas de agua y reenvía todo")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    recursos = [r.strip() for r in args.recursos.split(",") if r.strip()]
+    desconocidos = [r for r in recursos if r not in RECURSOS]
+    if desconocidos:
+        parser.error(f"Recursos no soportados: {', '.join(desconocidos)}")
+    fallidos = sincronizar(recursos, args.workers, args.tamano_bundle, args.lote_db, args.desde_cero)
+    raise SystemExit(1 if fallidos else 0)
@@ -0,0 +1,170 @@
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, List, Optional
+from collections import defaultdict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+from . import models
+
+# ---------------------------------------------------------
+# LÍNEA DE TIEMPO CLÍNICA (Historial del Paciente)
+# ---------------------------------------------------------
+# Todas las vistas de historial (dashboard del paciente, antecedentes del
+# médico y PDF) usan esta estructura. Se carga en dos consultas:
+#   1. Encuentros + sede + tipo + médico (JOIN)
+#   2. Observaciones del paciente (filtradas por paciente_id)
+# en lugar de 4 consultas por cada encuentro. Ambas filtran por la columna
+# de distribución, así que en Citus se resuelven en un único shard.
+
+@dataclass
+class SignoVital:
+    descripcion: str
+    valor: str
+    unidad: Optional[str] = None
+
+    def __str__(self):
+        texto = f"{self.descripcion}: {self.valor}"
+        if self.unidad:
+            texto += f" {self.unidad}"
+        return texto
+
+@dataclass
+class EntradaTimeline:
+    id: int
+    fecha: datetime
+    tipo_encuentro: str
+    sede_nombre: str
+    sede_ciudad: str
+    medico: str
+    diagnostico: str
+    tratamiento: str = "No especificado"
+    observaciones: str = ""
+    signos_vitales: List[SignoVital] = field(default_factory=list)
+
+    @property
+    def fecha_texto(self):
+        return self.fecha.strftime("%Y-%m-%d %H:%M")
+
+    @property
+    def sede(self):
+        return f"{self.sede_nombre} - {self.sede_ciudad}"
+
+def _consulta_encuentros(db: Session, paciente_id: int):
+    return db.query(models.EncuentroMedico).options(
+        joinedload(models.EncuentroMedico.sede),
+        joinedload(models.EncuentroMedico.tipo),
+        joinedload(models.EncuentroMedico.medico),
+    ).filter(
+        models.EncuentroMedico.paciente_id == paciente_id
+    ).order_by(models.EncuentroMedico.fecha.desc(), models.EncuentroMedico.id.desc())
+
+def _consulta_observaciones(db: Session, paciente_id: int, encuentro_ids=None):
+    query = db.query(models.ObservacionClinica).filter(models.ObservacionClinica.paciente_id == paciente_id)
+    if encuentro_ids is not None:
+        query = query.filter(models.ObservacionClinica.encuentro_id.in_(encuentro_ids))
+    return query.order_by(models.ObservacionClinica.id)
+
+def _entrada(encuentro, observaciones) -> EntradaTimeline:
+    return EntradaTimeline(
+        id=encuentro.id,
+        fecha=encuentro.fecha,
+        tipo_encuentro=encuentro.tipo.nombre,
+        sede_nombre=encuentro.sede.nombre,
+        sede_ciudad=encuentro.sede.ciudad,
+        medico=f"{encuentro.medico.nombres} {encuentro.medico.apellidos}",
+        diagnostico=encuentro.diagnostico,
+        tratamiento=encuentro.tratamiento or "No especificado",
+        observaciones=encuentro.observaciones_generales or "",
+        signos_vitales=[
+            SignoVital(obs.descripcion, obs.valor, obs.unidad)
+            for obs in observaciones
+        ],
+    )
+
+def construir_timeline(db: Session, paciente_id: int) -> List[EntradaTimeline]:
+    """Devuelve el historial del paciente ordenado del más reciente al más antiguo."""
+    encuentros = _consulta_encuentros(db, paciente_id).all()
+
+    observaciones = defaultdict(list)
+    for obs in _consulta_observaciones(db, paciente_id):
+        observaciones[obs.encuentro_id].append(obs)
+
+    return [_entrada(encuentro, observaciones[encuentro.id]) for encuentro in encuentros]
+
+# --- Historial en streaming (exportaciones) ---
+# Para historias muy largas, en lugar de cargar todo en memoria los
+# encuentros se leen con un cursor del servidor (yield_per) y las
+# observaciones se piden por bloque de encuentros. La memoria queda acotada
+# por TIMELINE_LOTE, no por la longitud de la historia.
+
+TIMELINE_LOTE = int(os.getenv("TIMELINE_LOTE", "500"))
+
+def iterar_timeline(db: Session, paciente_id: int, tamano_lote: int = TIMELINE_LOTE) -> Iterator[EntradaTimeline]:
+    """Mismo contenido y orden que construir_timeline, entregado por lotes"""
+    resultado = db.execute(
+        _consulta_encuentros(db, paciente_id).statement,
+        execution_options={"yield_per": tamano_lote},
+    )
+    for lote in resultado.scalars().partitions():
+        observaciones = defaultdict(list)
+        for obs in _consulta_observaciones(db, paciente_id, [e.id for e in lote]):
+            observaciones[obs.encuentro_id].append(obs)
+
+        for encuentro in lote:
+            yield _entrada(encuentro, observaciones[encuentro.id])
+
+class HistorialEnStreaming:
+    """
+    Iterable que vuelve a recorrer la base en cada `for`, para plantillas que
+    pasan más de una vez por los encuentros sin guardarlos todos en memoria.
+    """
+
+    def __init__(self, db: Session, paciente_id: int, tamano_lote: int = TIMELINE_LOTE):
+        self.db = db
+        self.paciente_id = paciente_id
+        self.tamano_lote = tamano_lote
+
+    def __iter__(self):
+        return iterar_timeline(self.db, self.paciente_id, self.tamano_lote)
+
+def _consultas_version(db: Session, paciente_id: int):
+    return {
+        "usuario": db.query(models.Usuario.version).filter(models.Usuario.id == paciente_id),
+        "encuentros": db.query(func.max(models.EncuentroMedico.version)).filter(
+            models.EncuentroMedico.paciente_id == paciente_id),
+        "observaciones": db.query(func.max(models.ObservacionClinica.version)).filter(
+            models.ObservacionClinica.paciente_id == paciente_id),
+    }
+
+def version_historial(db: Session, paciente_id: int) -> int:
+    """
+    Mayor `version` entre el paciente, sus encuentros y sus observaciones.
+    Cambia con cualquier alta o edición que afecte el historial, así que
+    sirve como clave de caché de los documentos generados a partir de él.
+    """
+    return max(query.scalar() or 0 for query in _consultas_version(db, paciente_id).values())
+
+if __name__ == "__main__":
+    # Verificación rápida: python -m app.timeline <numero_documento>
+    import sys
+    from .database import SessionLocal, engine, contar_consultas
+
+    db = SessionLocal()
+    try:
+        paciente = db.query(models.Usuario).filter(
+            models.Usuario.numero_documento == sys.argv[1]
+        ).first()
+        if not paciente:
+            sys.exit(f"Paciente {sys.argv[1]} no encontrado")
+
+        with contar_consultas(engine) as consultas:
+            timeline = construir_timeline(db, paciente.id)
+
+        print(f"{len(timeline)} encuentros cargados en {consultas.total} consultas")
+        if consultas.total > 2:
+            sys.exit("❌ El historial debería cargarse en máximo 2 consultas")
+    finally:
+        db.close()
@@ -1,12 +1,186 @@
-from passlib.context import CryptContext
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 
-# Configuración para encriptar contraseñas usando Bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from . import metricas
+
+# Costo de bcrypt. Al cambiarlo, los hashes existentes se regeneran en el
+# siguiente login exitoso (ver verify_and_update_password).
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    """
+    Configuración para encriptar contraseñas usando Bcrypt. passlib se
+    importa aquí: el hashing corre en el pool de procesos, así que el
+    servidor web no paga ese import al arrancar.
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
+
+# ---------------------------------------------------------
+# POOL DE HASHING (bcrypt fuera de los hilos de las peticiones)
+# ---------------------------------------------------------
+# bcrypt consume CPU por diseño. Se ejecuta en un pool de procesos de tamaño
+# fijo y con un cupo máximo de operaciones en espera: si en un cambio de
+# turno llegan más logins de los que el pool puede atender, los excedentes
+# esperan como máximo HASH_ESPERA_ADMISION segundos y luego se rechazan
+# (LoginSaturado), en lugar de ocupar todos los hilos del servidor y
+# bloquear las demás rutas.
+# Si un worker muere (OOM killer, señal) el executor queda roto para
+# siempre: se descarta, se crea otro y la operación se reintenta una vez
+# (verificar y hashear no tienen efectos, repetirlas es seguro).
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDIENTES = int(os.getenv("HASH_MAX_PENDIENTES", "16"))
+HASH_ESPERA_ADMISION = float(os.getenv("HASH_ESPERA_ADMISION", "0.5"))
+
+class LoginSaturado(Exception):
+    """Demasiadas verificaciones de contraseña en curso"""
+
+_pool = None
+_pool_lock = threading.Lock()
+_cupos = threading.BoundedSemaphore(HASH_MAX_PENDIENTES)
+_estado_lock = threading.Lock()
+_estado = {"pendientes": 0, "rechazos": 0, "reinicios": 0}
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver y no fork: el proceso de uvicorn ya tiene hilos (outbox,
+            # monitor de réplicas, ejecutores) y un fork copiaría sus locks tomados
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+def _descartar_pool(roto):
+    """Reemplaza el pool si sigue siendo `roto` (otro hilo pudo haberlo hecho ya)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not roto:
+            return
+        _pool = None
+    _ajustar("reinicios", 1)
+    print("⚠️ Pool de hashing roto (un worker terminó inesperadamente); se crea uno nuevo")
+    roto.shutdown(wait=False, cancel_futures=True)
+
+def _ajustar(clave, delta):
+    with _estado_lock:
+        _estado[clave] += delta
+
+def _admitir():
+    if not _cupos.acquire(timeout=HASH_ESPERA_ADMISION):
+        _ajustar("rechazos", 1)
+        raise LoginSaturado("Demasiados inicios de sesión simultáneos, intente de nuevo")
+    _ajustar("pendientes", 1)
+
+def _liberar():
+    _ajustar("pendientes", -1)
+    _cupos.release()
+
+def ejecutar_en_pool(funcion, *args):
+    """Ejecuta `funcion(*args)` en el pool de hashing respetando el cupo de admisión"""
+    _admitir()
+    try:
+        for intento in range(2):
+            pool = _obtener_pool()
+            try:
+                return pool.submit(funcion, *args).result()
+            except BrokenProcessPool:
+                _descartar_pool(pool)
+                if intento:
+                    raise
+    finally:
+        _liberar()
+
+async def ejecutar_en_pool_async(funcion, *args):
+    """Versión para rutas async: espera el cupo y el resultado sin bloquear el event loop"""
+    limite = time.monotonic() + HASH_ESPERA_ADMISION
+    while not _cupos.acquire(blocking=False):
+        if time.monotonic() >= limite:
+            _ajustar("rechazos", 1)
+            raise LoginSaturado("Demasiados inicios de sesión simultáneos, intente de nuevo")
+        await asyncio.sleep(0.01)
+    _ajustar("pendientes", 1)
+    try:
+        for intento in range(2):
+            pool = _obtener_pool()
+            try:
+                return await asyncio.wrap_future(pool.submit(funcion, *args))
+            except BrokenProcessPool:
+                _descartar_pool(pool)
+                if intento:
+                    raise
+    finally:
+        _liberar()
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+metricas.registrar("hce_hash_pendientes", "gauge",
+                   "Operaciones bcrypt en cola o en ejecución", lambda: _estado["pendientes"])
+metricas.registrar("hce_hash_rechazos_total", "counter",
+                   "Operaciones bcrypt rechazadas por control de admisión", lambda: _estado["rechazos"])
+metricas.registrar("hce_hash_pool_reinicios_total", "counter",
+                   "Pools de hashing recreados tras la muerte de un worker", lambda: _estado["reinicios"])
+
+# Funciones ejecutadas dentro de los procesos del pool (deben ser de nivel de módulo)
+
+def _verificar(plain_password, hashed_password):
+    return pwd_context().verify(plain_password, hashed_password)
+
+def _verificar_y_actualizar(plain_password, hashed_password):
+    return pwd_context().verify_and_update(plain_password, hashed_password)
+
+def _hashear(password):
+    return pwd_context().hash(password)
+
+# API pública
+
+# Hash de las cuentas sin contraseña (p. ej. pacientes de una importación
+# masiva): ninguna contraseña lo verifica y no se envía al pool
+HASH_INUTILIZABLE = "!"
+
+def hash_utilizable(hashed_password):
+    return bool(hashed_password) and not hashed_password.startswith(HASH_INUTILIZABLE)
 
 def verify_password(plain_password, hashed_password):
     """Verifica si una contraseña plana coincide con el hash guardado."""
-    return pwd_context.verify(plain_password, hashed_password)
+    if not hash_utilizable(hashed_password):
+        return False
+    return ejecutar_en_pool(_verificar, plain_password, hashed_password)
+
+def verify_and_update_password(plain_password, hashed_password):
+    """Verifica la contraseña y, si el hash usa otro costo, retorna (True, nuevo_hash)."""
+    if not hash_utilizable(hashed_password):
+        return False, None
+    return ejecutar_en_pool(_verificar_y_actualizar, plain_password, hashed_password)
 
 def get_password_hash(password):
     """Genera un hash seguro de la contraseña."""
-    return pwd_context.hash(password)
\ No newline at end of file
+    return ejecutar_en_pool(_hashear, password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    if not hash_utilizable(hashed_password):
+        return False, None
+    return await ejecutar_en_pool_async(_verificar_y_actualizar, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await ejecutar_en_pool_async(_hashear, password)
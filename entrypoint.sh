@@ -12,10 +12,19 @@ done
 
 echo "✅ PostgreSQL está listo!"
 
-# Inicializar base de datos (catálogos y usuarios de prueba)
+# Migraciones del esquema (tablas, columnas, backfill por lotes e índices
+# CONCURRENTLY). La aplicación ya no ejecuta DDL al arrancar.
+echo "🗄️ Aplicando migraciones..."
+alembic upgrade head
+
+# Catálogos y usuarios de prueba
 echo "📊 Inicializando datos de la base de datos..."
 python -m app.init_db
 
+# Tablas de referencia y distribución por paciente en Citus
+echo "🧩 Distribuyendo tablas clínicas en Citus..."
+python -m app.citus
+
 # Construir URL de FHIR desde variables de entorno
 FHIR_URL="http://${FHIR_HOST}:${FHIR_PORT}/fhir"
 
@@ -35,9 +44,10 @@ done
 
 if curl -s "${FHIR_URL}/metadata" > /dev/null 2>&1; then
   echo "✅ FHIR está listo!"
-  # Sincronizar usuarios con FHIR
-  echo "🔄 Sincronizando datos con servidor FHIR..."
-  python -m app.sync_fhir
+  # Sincronizar con FHIR en segundo plano: Uvicorn no espera a que termine
+  # y una ejecución interrumpida se reanuda desde su marca de agua.
+  echo "🔄 Sincronizando datos con servidor FHIR (en segundo plano)..."
+  python -m app.sync_fhir &
 else
   echo "⚠️ Saltando sincronización FHIR."
 fi
@@ -0,0 +1,7 @@
+#!/bin/bash
+set -e
+
+# Permite conexiones de replicación (pg_basebackup y streaming) desde la red
+# de Docker, para la réplica de lectura del perfil "replicas". Solo corre al
+# inicializar un volumen nuevo; en uno existente agregue la línea a mano.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,62 @@
+import os
+import time
+
+from alembic import op
+from sqlalchemy import inspect
+
+# ---------------------------------------------------------
+# AYUDAS PARA MIGRACIONES EN LÍNEA
+# ---------------------------------------------------------
+# Patrones para cambiar el esquema sin detener la aplicación:
+#   - índices con CREATE INDEX CONCURRENTLY (no bloquea escrituras; no puede
+#     ir dentro de una transacción, por eso usa autocommit_block),
+#   - backfill de columnas en lotes pequeños, cada uno confirmado por
+#     separado, para no mantener bloqueos de fila durante minutos.
+# Todas las operaciones son idempotentes: una base creada antes de Alembic
+# (con create_all y los jobs sueltos) pasa por `alembic upgrade head` y cada
+# paso omite lo que ya existe.
+
+MIGRACION_LOTE = int(os.getenv("MIGRACION_LOTE", "1000"))
+MIGRACION_PAUSA = float(os.getenv("MIGRACION_PAUSA", "0"))
+
+def existe_tabla(tabla):
+    return inspect(op.get_bind()).has_table(tabla)
+
+def existe_columna(tabla, columna):
+    return any(c["name"] == columna for c in inspect(op.get_bind()).get_columns(tabla))
+
+def crear_indice_concurrente(nombre, tabla, columnas, unico=False, metodo=None, incluir=None):
+    """
+    columnas: SQL de la lista, p. ej. "paciente_id, fecha DESC"; metodo: "gin",
+    "gist"...; incluir: columnas que solo se guardan en las hojas (INCLUDE)
+    """
+    tipo = "UNIQUE INDEX" if unico else "INDEX"
+    usando = f" USING {metodo}" if metodo else ""
+    incluidas = f" INCLUDE ({incluir})" if incluir else ""
+    with op.get_context().autocommit_block():
+        op.execute(f"CREATE {tipo} CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla}{usando} ({columnas}){incluidas}")
+
+def eliminar_indice_concurrente(nombre):
+    with op.get_context().autocommit_block():
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+
+def por_lotes(procesar, descripcion, tamano=MIGRACION_LOTE, pausa=MIGRACION_PAUSA):
+    """
+    Llama `procesar(conn, desde_id, tamano)` hasta que retorne None. Debe
+    retornar el último id procesado. Corre en autocommit: cada lote queda
+    confirmado al terminar y una interrupción se reanuda sin repetir trabajo.
+    """
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        ultimo_id = 0
+        lotes = 0
+        while True:
+            siguiente = procesar(conn, ultimo_id, tamano)
+            if siguiente is None:
+                break
+            lotes += 1
+            ultimo_id = siguiente
+            print(f"--- {descripcion}: lote {lotes} (hasta id {ultimo_id}) ---")
+            if pausa:
+                time.sleep(pausa)
+    print(f"✅ {descripcion}: {lotes} lotes procesados")
@@ -0,0 +1,50 @@
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from app.database import SQLALCHEMY_DATABASE_URL, Base
+from app import models  # noqa: F401  (registra las tablas en Base.metadata)
+
+# ---------------------------------------------------------
+# ENTORNO DE MIGRACIONES
+# ---------------------------------------------------------
+# Misma URL que la aplicación (DATABASE_URL). Base.metadata solo se usa para
+# `alembic revision --autogenerate`; las migraciones se escriben a mano cuando
+# necesitan pasos en línea (índices CONCURRENTLY, backfill por lotes).
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Genera el SQL sin conectarse (alembic upgrade head --sql)"""
+    context.configure(
+        url=SQLALCHEMY_DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    # Cada versión en su propia transacción: si una falla, las anteriores
+    # quedan aplicadas y registradas en alembic_version
+    conectable = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    with conectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            transaction_per_migration=True,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,90 @@
+"""Esquema inicial: catálogos, usuarios y datos clínicos
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import existe_tabla
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Tal como lo creaba Base.metadata.create_all antes de las migraciones.
+# En bases que ya lo tenían no hace nada.
+
+def _catalogo(tabla, *columnas):
+    if existe_tabla(tabla):
+        return
+    op.create_table(
+        tabla,
+        sa.Column("id", sa.Integer, primary_key=True),
+        *columnas,
+    )
+    op.create_index(f"ix_{tabla}_id", tabla, ["id"])
+
+def upgrade():
+    _catalogo("roles", sa.Column("nombre", sa.String, nullable=False, unique=True))
+    _catalogo("tipos_documento",
+              sa.Column("nombre", sa.String, nullable=False, unique=True),
+              sa.Column("prefijo", sa.String, nullable=False))
+    _catalogo("sedes",
+              sa.Column("nombre", sa.String, nullable=False),
+              sa.Column("ciudad", sa.String, nullable=False))
+    _catalogo("tipos_encuentro", sa.Column("nombre", sa.String, nullable=False, unique=True))
+
+    if not existe_tabla("usuarios"):
+        op.create_table(
+            "usuarios",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("nombres", sa.String, nullable=False),
+            sa.Column("apellidos", sa.String, nullable=False),
+            sa.Column("tipo_documento_id", sa.Integer, sa.ForeignKey("tipos_documento.id"), nullable=False),
+            sa.Column("numero_documento", sa.String, nullable=False),
+            sa.Column("fecha_nacimiento", sa.Date, nullable=False),
+            sa.Column("genero", sa.String, nullable=False),
+            sa.Column("telefono", sa.String, nullable=True),
+            sa.Column("email", sa.String, nullable=True),
+            sa.Column("sede_id", sa.Integer, sa.ForeignKey("sedes.id"), nullable=False),
+            sa.Column("rol_id", sa.Integer, sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("password_hash", sa.String, nullable=False),
+        )
+        op.create_index("ix_usuarios_id", "usuarios", ["id"])
+        op.create_index("ix_usuarios_numero_documento", "usuarios", ["numero_documento"], unique=True)
+
+    if not existe_tabla("encuentros_medicos"):
+        op.create_table(
+            "encuentros_medicos",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("fecha", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("diagnostico", sa.String, nullable=False),
+            sa.Column("observaciones_generales", sa.String, nullable=True),
+            sa.Column("tipo_id", sa.Integer, sa.ForeignKey("tipos_encuentro.id"), nullable=False),
+            sa.Column("sede_id", sa.Integer, sa.ForeignKey("sedes.id"), nullable=False),
+            sa.Column("medico_id", sa.Integer, sa.ForeignKey("usuarios.id"), nullable=False),
+            sa.Column("paciente_id", sa.Integer, sa.ForeignKey("usuarios.id"), nullable=False),
+        )
+        op.create_index("ix_encuentros_medicos_id", "encuentros_medicos", ["id"])
+
+    if not existe_tabla("observaciones_clinicas"):
+        op.create_table(
+            "observaciones_clinicas",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("fecha", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("descripcion", sa.String, nullable=False),
+            sa.Column("valor", sa.String, nullable=False),
+            sa.Column("unidad", sa.String, nullable=True),
+            sa.Column("interpretacion", sa.String, nullable=True),
+            sa.Column("sede_id", sa.Integer, sa.ForeignKey("sedes.id"), nullable=False),
+            sa.Column("encuentro_id", sa.Integer, sa.ForeignKey("encuentros_medicos.id"), nullable=False),
+        )
+        op.create_index("ix_observaciones_clinicas_id", "observaciones_clinicas", ["id"])
+
+def downgrade():
+    for tabla in ["observaciones_clinicas", "encuentros_medicos", "usuarios",
+                  "tipos_encuentro", "sedes", "tipos_documento", "roles"]:
+        op.drop_table(tabla)
@@ -0,0 +1,78 @@
+"""Diagnóstico, tratamiento y observaciones en columnas propias
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente, por_lotes
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Antes se guardaba todo concatenado en encuentros_medicos.diagnostico como
+# "Dx | Tx: ... | Obs: ...". Los registros antiguos se reparten en lotes.
+
+def separar_diagnostico(texto_completo):
+    """Separa el texto "Enfermedad | Tx: ... | Obs: ..." en (diagnóstico, tratamiento, observaciones)."""
+    diag_final = texto_completo
+    tx_final = None
+    obs_final = None
+
+    if " | " in texto_completo:
+        partes = texto_completo.split(" | ")
+        diag_final = partes[0]
+
+        for parte in partes[1:]:
+            if parte.startswith("Tx: "):
+                tx_final = parte.replace("Tx: ", "", 1)
+            elif parte.startswith("Obs: "):
+                obs_final = parte.replace("Obs: ", "", 1)
+
+    return diag_final, tx_final, obs_final
+
+def migrar_lote(conn, desde_id, tamano_lote):
+    filas = conn.execute(sa.text(
+        "SELECT id, paciente_id, diagnostico, observaciones_generales FROM encuentros_medicos "
+        "WHERE id > :desde AND (diagnostico LIKE '% | Tx: %' OR diagnostico LIKE '% | Obs: %') "
+        "ORDER BY id LIMIT :limite"
+    ), {"desde": desde_id, "limite": tamano_lote}).fetchall()
+
+    if not filas:
+        return None
+
+    cambios = []
+    for fila in filas:
+        diagnostico, tratamiento, observaciones = separar_diagnostico(fila.diagnostico)
+        cambios.append({
+            "id": fila.id,
+            "paciente_id": fila.paciente_id,
+            "diagnostico": diagnostico,
+            "tratamiento": tratamiento,
+            "observaciones": fila.observaciones_generales or observaciones,
+        })
+
+    conn.execute(sa.text(
+        "UPDATE encuentros_medicos SET diagnostico = :diagnostico, "
+        "tratamiento = COALESCE(tratamiento, :tratamiento), "
+        "observaciones_generales = :observaciones "
+        "WHERE id = :id AND paciente_id = :paciente_id"
+    ), cambios)
+
+    return filas[-1].id
+
+def upgrade():
+    op.execute("ALTER TABLE encuentros_medicos ADD COLUMN IF NOT EXISTS tratamiento VARCHAR")
+    op.execute("ALTER TABLE encuentros_medicos ADD COLUMN IF NOT EXISTS codigo_snomed VARCHAR")
+
+    crear_indice_concurrente("ix_encuentros_medicos_diagnostico", "encuentros_medicos", "diagnostico")
+    por_lotes(migrar_lote, "Separación de diagnósticos")
+
+def downgrade():
+    eliminar_indice_concurrente("ix_encuentros_medicos_diagnostico")
+    op.drop_column("encuentros_medicos", "codigo_snomed")
+    op.drop_column("encuentros_medicos", "tratamiento")
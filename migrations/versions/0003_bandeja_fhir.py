@@ -0,0 +1,48 @@
+"""Bandeja de salida FHIR y marcas de agua de la sincronización masiva
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import existe_tabla
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not existe_tabla("fhir_outbox"):
+        op.create_table(
+            "fhir_outbox",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("recurso", sa.String, nullable=False),
+            sa.Column("recurso_id", sa.Integer, nullable=False),
+            sa.Column("fhir_id", sa.String, nullable=False),
+            sa.Column("estado", sa.String, nullable=False),
+            sa.Column("intentos", sa.Integer, nullable=False),
+            sa.Column("proximo_intento", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("ultimo_error", sa.String, nullable=True),
+            sa.Column("creado", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("actualizado", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_fhir_outbox_id", "fhir_outbox", ["id"])
+        op.create_index("ix_fhir_outbox_fhir_id", "fhir_outbox", ["fhir_id"], unique=True)
+        op.create_index("ix_fhir_outbox_estado", "fhir_outbox", ["estado"])
+        op.create_index("ix_fhir_outbox_proximo_intento", "fhir_outbox", ["proximo_intento"])
+
+    # La marca de agua era el último id enviado; 0004 la cambia a versión
+    if not existe_tabla("sync_checkpoints"):
+        op.create_table(
+            "sync_checkpoints",
+            sa.Column("recurso", sa.String, primary_key=True),
+            sa.Column("ultimo_id", sa.Integer, nullable=False),
+            sa.Column("actualizado", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+def downgrade():
+    op.drop_table("sync_checkpoints")
+    op.drop_table("fhir_outbox")
@@ -0,0 +1,67 @@
+"""Seguimiento de cambios: version (hce_cambios_seq) y actualizado_en
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente, existe_columna, por_lotes
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+TABLAS = ["usuarios", "encuentros_medicos", "observaciones_clinicas"]
+
+def _numerar(tabla):
+    def procesar(conn, desde_id, tamano_lote):
+        ids = conn.execute(sa.text(
+            f"UPDATE {tabla} SET version = nextval('hce_cambios_seq') WHERE id IN ("
+            f"SELECT id FROM {tabla} WHERE id > :desde AND version IS NULL ORDER BY id LIMIT :limite"
+            f") RETURNING id"
+        ), {"desde": desde_id, "limite": tamano_lote}).scalars().all()
+        return max(ids) if ids else None
+    return procesar
+
+def upgrade():
+    op.execute("CREATE SEQUENCE IF NOT EXISTS hce_cambios_seq")
+    for tabla in TABLAS:
+        # now() es estable: PostgreSQL agrega la columna sin reescribir la tabla
+        op.execute(
+            f"ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS actualizado_en "
+            f"TIMESTAMPTZ NOT NULL DEFAULT now()"
+        )
+        op.execute(f"ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS version BIGINT")
+        # Las filas nuevas ya toman versión mientras se numeran las antiguas
+        op.execute(f"ALTER TABLE {tabla} ALTER COLUMN version SET DEFAULT nextval('hce_cambios_seq')")
+
+    for tabla in TABLAS:
+        # Solo si faltan: en Citus un UPDATE con nextval() que recorre todos
+        # los shards no está permitido, así que en bases ya distribuidas se omite
+        if op.get_bind().execute(sa.text(f"SELECT 1 FROM {tabla} WHERE version IS NULL LIMIT 1")).first():
+            por_lotes(_numerar(tabla), f"Versiones de {tabla}")
+        op.execute(f"ALTER TABLE {tabla} ALTER COLUMN version SET NOT NULL")
+
+    # La marca de agua de sync_fhir pasó de "último id" a "última versión":
+    # se reinicia para que la próxima sincronización recorra por versión
+    if existe_columna("sync_checkpoints", "ultimo_id"):
+        op.alter_column("sync_checkpoints", "ultimo_id", new_column_name="ultima_version",
+                        type_=sa.BigInteger)
+        op.execute("UPDATE sync_checkpoints SET ultima_version = 0")
+
+    for tabla in TABLAS:
+        for columna in ("version", "actualizado_en"):
+            crear_indice_concurrente(f"ix_{tabla}_{columna}", tabla, columna)
+
+def downgrade():
+    for tabla in TABLAS:
+        for columna in ("version", "actualizado_en"):
+            eliminar_indice_concurrente(f"ix_{tabla}_{columna}")
+    op.alter_column("sync_checkpoints", "ultima_version", new_column_name="ultimo_id", type_=sa.Integer)
+    for tabla in TABLAS:
+        op.drop_column(tabla, "version")
+        op.drop_column(tabla, "actualizado_en")
+    op.execute("DROP SEQUENCE IF EXISTS hce_cambios_seq")
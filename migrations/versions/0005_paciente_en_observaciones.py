@@ -0,0 +1,67 @@
+"""paciente_id en observaciones y llaves compuestas para distribuir en Citus
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import existe_columna, por_lotes
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# Citus exige que las llaves primarias y foráneas entre tablas distribuidas
+# incluyan la columna de distribución (paciente_id). La distribución en sí
+# la hace app/citus.py después de las migraciones.
+
+TABLAS_DISTRIBUIDAS = ["encuentros_medicos", "observaciones_clinicas"]
+
+def completar_paciente(conn, desde_id, tamano_lote):
+    ids = conn.execute(sa.text(
+        "UPDATE observaciones_clinicas o SET paciente_id = e.paciente_id "
+        "FROM encuentros_medicos e WHERE o.encuentro_id = e.id AND o.id IN ("
+        "SELECT id FROM observaciones_clinicas WHERE id > :desde AND paciente_id IS NULL "
+        "ORDER BY id LIMIT :limite) RETURNING o.id"
+    ), {"desde": desde_id, "limite": tamano_lote}).scalars().all()
+    return max(ids) if ids else None
+
+def upgrade():
+    if not existe_columna("observaciones_clinicas", "paciente_id"):
+        op.add_column("observaciones_clinicas", sa.Column("paciente_id", sa.Integer, sa.ForeignKey("usuarios.id")))
+        por_lotes(completar_paciente, "paciente_id de observaciones")
+    op.alter_column("observaciones_clinicas", "paciente_id", nullable=False)
+
+    inspector = sa.inspect(op.get_bind())
+
+    # La FK observación -> encuentro depende de la PK de encuentros: se quita primero
+    for fk in inspector.get_foreign_keys("observaciones_clinicas"):
+        if fk["referred_table"] == "encuentros_medicos" and fk["constrained_columns"] == ["encuentro_id"]:
+            op.drop_constraint(fk["name"], "observaciones_clinicas", type_="foreignkey")
+
+    for tabla in TABLAS_DISTRIBUIDAS:
+        pk = inspector.get_pk_constraint(tabla)
+        if "paciente_id" not in pk["constrained_columns"]:
+            op.drop_constraint(pk["name"], tabla, type_="primary")
+            op.create_primary_key(f"{tabla}_pkey", tabla, ["id", "paciente_id"])
+
+    compuesta = any(
+        fk["referred_table"] == "encuentros_medicos" and set(fk["constrained_columns"]) == {"encuentro_id", "paciente_id"}
+        for fk in sa.inspect(op.get_bind()).get_foreign_keys("observaciones_clinicas")
+    )
+    if not compuesta:
+        op.create_foreign_key(
+            "observaciones_clinicas_encuentro_fkey", "observaciones_clinicas", "encuentros_medicos",
+            ["encuentro_id", "paciente_id"], ["id", "paciente_id"],
+        )
+
+def downgrade():
+    op.drop_constraint("observaciones_clinicas_encuentro_fkey", "observaciones_clinicas", type_="foreignkey")
+    for tabla in TABLAS_DISTRIBUIDAS:
+        op.drop_constraint(f"{tabla}_pkey", tabla, type_="primary")
+        op.create_primary_key(f"{tabla}_pkey", tabla, ["id"])
+    op.create_foreign_key(None, "observaciones_clinicas", "encuentros_medicos", ["encuentro_id"], ["id"])
+    op.drop_column("observaciones_clinicas", "paciente_id")
@@ -0,0 +1,34 @@
+"""Índices secundarios de las consultas de historial
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+# (nombre, tabla, columnas) — declarados también en models.py (__table_args__)
+INDICES = [
+    ("ix_usuarios_sede_id", "usuarios", "sede_id"),
+    ("ix_usuarios_rol_id", "usuarios", "rol_id"),
+    # Línea de tiempo: WHERE paciente_id = ? ORDER BY fecha DESC
+    ("ix_encuentros_medicos_paciente_fecha", "encuentros_medicos", "paciente_id, fecha DESC"),
+    ("ix_encuentros_medicos_medico_id", "encuentros_medicos", "medico_id"),
+    ("ix_encuentros_medicos_sede_id", "encuentros_medicos", "sede_id"),
+    ("ix_encuentros_medicos_tipo_id", "encuentros_medicos", "tipo_id"),
+    ("ix_observaciones_clinicas_paciente_encuentro", "observaciones_clinicas", "paciente_id, encuentro_id"),
+    ("ix_observaciones_clinicas_encuentro_id", "observaciones_clinicas", "encuentro_id"),
+    ("ix_observaciones_clinicas_sede_id", "observaciones_clinicas", "sede_id"),
+]
+
+def upgrade():
+    for nombre, tabla, columnas in INDICES:
+        crear_indice_concurrente(nombre, tabla, columnas)
+
+def downgrade():
+    for nombre, _, _ in reversed(INDICES):
+        eliminar_indice_concurrente(nombre)
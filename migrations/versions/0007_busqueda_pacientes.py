@@ -0,0 +1,46 @@
+"""Búsqueda de pacientes: pg_trgm, unaccent e índices de documento y nombre
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+# unaccent() es STABLE (depende del search_path) y no puede usarse en un
+# índice; la versión de dos argumentos con el diccionario calificado sí es
+# determinista, así que se envuelve en una función IMMUTABLE. En Citus la
+# función y las extensiones se propagan a los workers.
+F_UNACCENT = """
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+"""
+
+# (nombre, tabla, columnas, método) — declarados también en models.py (__table_args__)
+INDICES = [
+    # Prefijo de documento: numero_documento LIKE 'abc%' (el índice único
+    # usa la collation de la base y no sirve para LIKE)
+    ("ix_usuarios_documento_patron", "usuarios", "numero_documento text_pattern_ops", None),
+    # Nombre sin tildes ni mayúsculas: LIKE '%texto%' y similitud (<%)
+    ("ix_usuarios_nombre_trgm", "usuarios",
+     "f_unaccent(lower(nombres || ' ' || apellidos)) gin_trgm_ops", "gin"),
+]
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    op.execute(F_UNACCENT)
+    for nombre, tabla, columnas, metodo in INDICES:
+        crear_indice_concurrente(nombre, tabla, columnas, metodo=metodo)
+
+def downgrade():
+    for nombre, *_ in reversed(INDICES):
+        eliminar_indice_concurrente(nombre)
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
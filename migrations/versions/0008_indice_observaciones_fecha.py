@@ -0,0 +1,22 @@
+"""Índice de observaciones por paciente y fecha (API del historial)
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+# Páginas de /api/pacientes/{doc}/observaciones:
+# WHERE paciente_id = ? AND (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC
+NOMBRE = "ix_observaciones_clinicas_paciente_fecha"
+
+def upgrade():
+    crear_indice_concurrente(NOMBRE, "observaciones_clinicas", "paciente_id, fecha DESC, id DESC")
+
+def downgrade():
+    eliminar_indice_concurrente(NOMBRE)
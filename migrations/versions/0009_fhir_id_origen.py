@@ -0,0 +1,43 @@
+"""fhir_id de origen en usuarios, encuentros y observaciones (ingesta FHIR -> SQL)
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente, existe_columna
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+# Id del recurso en el servidor FHIR del que se importó (app/ingesta_fhir.py).
+# Sirve de llave para los upserts idempotentes y para resolver las
+# referencias Patient/... y Encounter/... de los recursos siguientes. En las
+# tablas distribuidas la unicidad incluye paciente_id (exigencia de Citus).
+# Las filas creadas en esta aplicación lo dejan en NULL.
+
+TABLAS = ["usuarios", "encuentros_medicos", "observaciones_clinicas"]
+
+# (nombre, tabla, columnas)
+INDICES = [
+    ("ux_usuarios_fhir_id", "usuarios", "fhir_id"),
+    ("ux_encuentros_medicos_fhir_id", "encuentros_medicos", "paciente_id, fhir_id"),
+    ("ux_observaciones_clinicas_fhir_id", "observaciones_clinicas", "paciente_id, fhir_id"),
+]
+
+def upgrade():
+    for tabla in TABLAS:
+        if not existe_columna(tabla, "fhir_id"):
+            op.add_column(tabla, sa.Column("fhir_id", sa.String, nullable=True))
+    for nombre, tabla, columnas in INDICES:
+        crear_indice_concurrente(nombre, tabla, columnas, unico=True)
+
+def downgrade():
+    for nombre, _, _ in reversed(INDICES):
+        eliminar_indice_concurrente(nombre)
+    for tabla in reversed(TABLAS):
+        op.drop_column(tabla, "fhir_id")
@@ -0,0 +1,31 @@
+"""Índice cubierto de encuentros por paciente (paciente_id, fecha DESC, id DESC) INCLUDE (version)
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+from migrations.enlinea import crear_indice_concurrente, eliminar_indice_concurrente
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+# Reemplaza ix_encuentros_medicos_paciente_fecha (0006):
+#   - id DESC en la llave: la línea de tiempo y la API ordenan por
+#     (fecha DESC, id DESC) y el índice anterior dejaba un ordenamiento
+#     incremental para los empates de fecha,
+#   - INCLUDE (version): max(version) del paciente (version_historial) se
+#     resuelve con un Index Only Scan, sin visitar la tabla.
+# El nuevo se crea antes de borrar el anterior: la línea de tiempo nunca
+# queda sin índice.
+ANTERIOR = "ix_encuentros_medicos_paciente_fecha"
+NUEVO = "ix_encuentros_medicos_paciente_fecha_id"
+
+def upgrade():
+    crear_indice_concurrente(NUEVO, "encuentros_medicos", "paciente_id, fecha DESC, id DESC", incluir="version")
+    eliminar_indice_concurrente(ANTERIOR)
+
+def downgrade():
+    crear_indice_concurrente(ANTERIOR, "encuentros_medicos", "paciente_id, fecha DESC")
+    eliminar_indice_concurrente(NUEVO)
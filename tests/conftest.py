@@ -0,0 +1,110 @@
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+# ---------------------------------------------------------
+# FIXTURES DE BASE DE DATOS
+# ---------------------------------------------------------
+# Las pruebas que usan `db` necesitan PostgreSQL (o Citus) con el esquema
+# migrado (alembic upgrade head) en DATABASE_URL; sin base disponible se
+# omiten. Cada prueba corre dentro de una transacción que se revierte al
+# terminar: no deja datos aunque use la base de desarrollo.
+
+@pytest.fixture(scope="session")
+def motor():
+    # Sin el driver de DATABASE_URL el motor ni siquiera se puede crear
+    database = pytest.importorskip("app.database", exc_type=ImportError)
+    from sqlalchemy.exc import OperationalError
+    engine = database.engine
+
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as e:
+        pytest.skip(f"Base de datos no disponible: {e.orig}")
+    return engine
+
+@pytest.fixture
+def db(motor):
+    from sqlalchemy.orm import Session
+
+    conexion = motor.connect()
+    transaccion = conexion.begin()
+    # Los commit de la sesión quedan como savepoints dentro de la transacción externa
+    sesion = Session(bind=conexion, join_transaction_mode="create_savepoint")
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+        transaccion.rollback()
+        conexion.close()
+
+def _catalogo(db, modelo, nombre, **otros):
+    fila = db.query(modelo).filter(modelo.nombre == nombre).first()
+    if fila is None:
+        fila = modelo(nombre=nombre, **otros)
+        db.add(fila)
+        db.flush()
+    return fila
+
+@pytest.fixture
+def crear_historial(db):
+    """Fábrica: paciente con `encuentros` encuentros de `observaciones` observaciones cada uno"""
+    from sqlalchemy import insert
+    from app import models, utils
+
+    def _usuario(rol, sede, tipo_documento, nombres):
+        usuario = models.Usuario(
+            nombres=nombres, apellidos="Prueba", tipo_documento_id=tipo_documento.id,
+            numero_documento=f"TEST{uuid.uuid4().hex[:12].upper()}", fecha_nacimiento=date(1980, 1, 1),
+            genero="F", sede_id=sede.id, rol_id=rol.id, password_hash=utils.HASH_INUTILIZABLE,
+        )
+        db.add(usuario)
+        return usuario
+
+    def crear(encuentros=10, observaciones=3):
+        sede = _catalogo(db, models.Sede, "Sede Pruebas", ciudad="Pruebas")
+        tipo_documento = _catalogo(db, models.TipoDocumento, "Documento de Prueba", prefijo="TP")
+        tipo = _catalogo(db, models.TipoEncuentro, "Consulta General")
+        paciente = _usuario(_catalogo(db, models.Rol, "Paciente"), sede, tipo_documento, "Paciente")
+        medico = _usuario(_catalogo(db, models.Rol, "Medico"), sede, tipo_documento, "Medico")
+        db.flush()
+
+        E, O = models.EncuentroMedico.__table__, models.ObservacionClinica.__table__
+        inicio = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        ids = db.execute(insert(E).returning(E.c.id), [
+            {"paciente_id": paciente.id, "medico_id": medico.id, "sede_id": sede.id, "tipo_id": tipo.id,
+             "fecha": inicio + timedelta(hours=i), "diagnostico": f"Diagnóstico {i}", "tratamiento": "Reposo"}
+            for i in range(encuentros)
+        ]).scalars().all() if encuentros else []
+        if ids and observaciones:
+            db.execute(insert(O), [
+                {"paciente_id": paciente.id, "encuentro_id": encuentro_id, "sede_id": sede.id,
+                 "descripcion": f"Signo {j}", "valor": str(60 + j), "unidad": "bpm"}
+                for encuentro_id in ids for j in range(observaciones)
+            ])
+        db.expire_all()
+        return paciente
+
+    return crear
+
+# ---------------------------------------------------------
+# FIXTURES FHIR
+# ---------------------------------------------------------
+# `hapi` levanta el servidor FHIR simulado de app/hapi_simulado.py y apunta
+# el cliente compartido de fhir_client a él durante la prueba.
+
+@pytest.fixture
+def hapi(monkeypatch):
+    pytest.importorskip("requests")
+    from app import fhir_client
+    from app.hapi_simulado import HapiSimulado
+
+    with HapiSimulado() as servidor:
+        cliente = fhir_client.FhirClient(base_url=servidor.url)
+        monkeypatch.setattr(fhir_client, "cliente", cliente)
+        try:
+            yield servidor
+        finally:
+            cliente.cerrar()
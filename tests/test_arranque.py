@@ -0,0 +1,28 @@
+import pytest
+
+# Sin las dependencias de la aplicación (o el driver de la base) no hay nada que medir
+pytest.importorskip("app.main", exc_type=ImportError)
+
+from app import arranque
+
+# Las dependencias pesadas se importan en su primer uso (ver app/arranque.py).
+# Un import de más en app.main o en un módulo que este importa las vuelve a
+# cargar en cada worker y en cada pod nuevo.
+DIFERIDOS = {"weasyprint", "xhtml2pdf", "passlib", "requests", "urllib3"}
+
+# Presupuesto por defecto de la prueba si ARRANQUE_PRESUPUESTO_MS no lo fija
+PRESUPUESTO_MS = arranque.PRESUPUESTO_MS or 3000
+
+@pytest.fixture(scope="module")
+def medicion():
+    # La mejor de tres: la primera calienta la caché de disco
+    return min((arranque.medir() for _ in range(3)), key=lambda m: m[0])
+
+def test_dependencias_pesadas_diferidas(medicion):
+    _, filas = medicion
+    paquetes = {nombre.strip().split(".")[0] for _, _, nombre in filas}
+    assert not paquetes & DIFERIDOS, f"Importados al arrancar: {sorted(paquetes & DIFERIDOS)}"
+
+def test_arranque_dentro_del_presupuesto(medicion):
+    total_ms, _ = medicion
+    assert total_ms <= PRESUPUESTO_MS, f"Arranque de {total_ms:.0f} ms (presupuesto {PRESUPUESTO_MS:.0f} ms)"
@@ -0,0 +1,40 @@
+import base64
+import json
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("app.database", exc_type=ImportError)
+
+from app import busqueda
+
+def _cursor(datos):
+    return base64.urlsafe_b64encode(json.dumps(datos).encode()).decode().rstrip("=")
+
+@pytest.mark.parametrize("modo, llave", [
+    (busqueda.DOCUMENTO, ["SIM000000123"]),
+    (busqueda.NOMBRE, ["Gómez Ríos", "Ana Inés", 42]),
+    (busqueda.APROXIMADO, [Decimal("0.812500"), 42]),
+])
+def test_cursor_ida_y_vuelta(modo, llave):
+    assert busqueda._decodificar_cursor(busqueda._codificar_cursor(modo, llave)) == (modo, llave)
+
+@pytest.mark.parametrize("cursor", [
+    "no es base64!",
+    _cursor([1, 2]),
+    _cursor({"m": "auto", "k": ["x"]}),
+    _cursor({"m": busqueda.DOCUMENTO}),
+    _cursor({"m": busqueda.DOCUMENTO, "k": "SIM"}),
+    _cursor({"m": busqueda.DOCUMENTO, "k": []}),
+    _cursor({"m": busqueda.DOCUMENTO, "k": [123]}),
+    _cursor({"m": busqueda.NOMBRE, "k": ["Gómez", "Ana"]}),
+    _cursor({"m": busqueda.NOMBRE, "k": ["Gómez", "Ana", "42"]}),
+    _cursor({"m": busqueda.NOMBRE, "k": ["Gómez", "Ana", True]}),
+    _cursor({"m": busqueda.APROXIMADO, "k": ["no es número", 42]}),
+    _cursor({"m": busqueda.APROXIMADO, "k": ["NaN", 42]}),
+    _cursor({"m": busqueda.APROXIMADO, "k": [0.5, 42]}),
+    _cursor({"m": [busqueda.NOMBRE], "k": []}),
+])
+def test_cursor_alterado_es_busqueda_invalida(cursor):
+    with pytest.raises(busqueda.BusquedaInvalida):
+        busqueda._decodificar_cursor(cursor)
@@ -0,0 +1,46 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("app.database", exc_type=ImportError)
+
+from app import cola_pdf
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cola_pdf, "PDF_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+def test_pertenece_compara_el_id_del_paciente():
+    assert cola_pdf.pertenece(cola_pdf.trabajo_id_de(12, 7), 12)
+    assert not cola_pdf.pertenece(cola_pdf.trabajo_id_de(123, 7), 12)
+    assert not cola_pdf.pertenece("12-v7/../../etc/passwd", 12)
+    assert not cola_pdf.pertenece("A.1-v7", 12)
+
+def test_limpia_solo_versiones_anteriores_del_mismo_paciente(cache):
+    for nombre in ("12-v3.pdf", "12-v3.error", "12-v5.pdf", "12-v9.pdf", "123-v1.pdf", "12-v4.pdf.99.tmp"):
+        (cache / nombre).write_bytes(b"x")
+
+    # Un trabajo atrasado (v5) terminando después del v9 no debe borrarlo
+    cola_pdf.limpiar_anteriores(12, 5)
+
+    assert sorted(os.listdir(cache)) == ["12-v4.pdf.99.tmp", "12-v5.pdf", "12-v9.pdf", "123-v1.pdf"]
+
+def test_un_solo_worker_toma_el_trabajo(cache):
+    assert cola_pdf._tomar("12-v5")
+    assert not cola_pdf._tomar("12-v5")
+    assert cola_pdf.estado("12-v5")["estado"] == cola_pdf.EN_PROCESO
+
+def test_bloqueo_abandonado_se_retoma(cache):
+    assert cola_pdf._tomar("12-v5")
+    viejo = time.time() - cola_pdf.PDF_BLOQUEO_TTL - 1
+    os.utime(cache / "12-v5.lock", (viejo, viejo))
+
+    assert cola_pdf.estado("12-v5")["estado"] == cola_pdf.DESCONOCIDO
+    assert cola_pdf._tomar("12-v5")
+
+def test_el_error_se_ve_desde_cualquier_worker(cache):
+    (cache / "12-v5.error").write_text("motor caído")
+
+    assert cola_pdf.estado("12-v5") == {"trabajo_id": "12-v5", "estado": cola_pdf.ERROR, "error": "motor caído"}
@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from app import fhir_client
+from app.cache import CacheTTL
+
+# Caché de búsquedas por paciente: un acierto no va a HAPI, una entrada
+# vencida se revalida (ETag con una página, _lastUpdated con varias) y los
+# envíos del outbox o de app.sync_fhir invalidan al paciente.
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CacheTTL(max_entradas=16, ttl=60)
+    monkeypatch.setattr(fhir_client, "cache_busquedas", cache)
+    return cache
+
+def _observacion(documento, i, valor=60):
+    return {
+        "resourceType": "Observation", "id": f"obs-{documento}-{i:03d}", "status": "final",
+        "subject": {"reference": f"Patient/pac-{documento}"},
+        "valueQuantity": {"value": valor, "unit": "bpm"},
+    }
+
+def _vencer(cache):
+    cache.refrescar(("1001", "Observation"), ttl=-1)
+
+def test_acierto_no_consulta_hapi(hapi, cache):
+    hapi.guardar(_observacion("1001", 1))
+
+    primera = fhir_client.buscar_por_paciente("Observation", "1001")
+    peticiones = hapi.peticiones
+    segunda = fhir_client.buscar_por_paciente("Observation", "1001")
+
+    assert len(primera) == 1 and segunda == primera
+    assert hapi.peticiones == peticiones
+
+def test_revalida_con_etag(hapi, cache):
+    hapi.guardar(_observacion("1001", 1))
+    fhir_client.buscar_por_paciente("Observation", "1001")
+    _vencer(cache)
+
+    entries = fhir_client.buscar_por_paciente("Observation", "1001")
+
+    assert len(entries) == 1
+    assert hapi.no_modificadas == 1
+
+def test_revalida_con_last_updated_si_hay_varias_paginas(hapi, cache, monkeypatch):
+    monkeypatch.setattr(fhir_client, "FHIR_PAGE_SIZE", 10)
+    for i in range(25):
+        hapi.guardar(_observacion("1001", i))
+    fhir_client.buscar_por_paciente("Observation", "1001")
+    _vencer(cache)
+
+    peticiones = hapi.peticiones
+    entries = fhir_client.buscar_por_paciente("Observation", "1001")
+
+    # Solo el conteo con _summary=count, no las 3 páginas
+    assert len(entries) == 25
+    assert hapi.peticiones == peticiones + 1
+
+    # Un cambio hecho por otro cliente se detecta al revalidar
+    hapi.guardar(_observacion("1001", 25))
+    _vencer(cache)
+    assert len(fhir_client.buscar_por_paciente("Observation", "1001")) == 26
+
+def test_envio_invalida_al_paciente(hapi, cache):
+    hapi.guardar(_observacion("1001", 1))
+    hapi.guardar(_observacion("2002", 1))
+    fhir_client.buscar_por_paciente("Observation", "1001")
+    fhir_client.buscar_por_paciente("Observation", "2002")
+
+    resultados = fhir_client.enviar_bundle([_observacion("1001", 1, valor=72)], tipo="batch")
+    assert all(r.ok for r in resultados)
+
+    assert cache.obtener(("1001", "Observation")) is None
+    assert cache.obtener(("2002", "Observation")) is not None
+    entries = fhir_client.buscar_por_paciente("Observation", "1001")
+    assert entries[0]["resource"]["valueQuantity"]["value"] == 72
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("requests")
+
+from app import fhir_client
+
+# FhirClient reutiliza las conexiones keep-alive; FhirClientAsync (httpx) se
+# comporta igual desde asyncio. La comparación de rendimiento contra el
+# servidor simulado es `python -m app.hapi_simulado`.
+
+def _paciente(i):
+    return {"resourceType": "Patient", "id": f"pac-{1000 + i}", "gender": "female"}
+
+def test_conexiones_reutilizadas(hapi):
+    for i in range(20):
+        assert fhir_client.cliente.put(f"Patient/pac-{1000 + i}", _paciente(i)).status_code == 201
+
+    assert len(hapi.recursos) == 20
+    assert hapi.conexiones == 1
+
+def test_cliente_asincrono(hapi):
+    pytest.importorskip("httpx")
+
+    async def enviar():
+        cliente = fhir_client.FhirClientAsync(base_url=hapi.url, pool_size=4)
+        try:
+            respuestas = await asyncio.gather(*(cliente.put(f"Patient/pac-{1000 + i}", _paciente(i)) for i in range(20)))
+            leido = await cliente.get("Patient/pac-1005")
+        finally:
+            await cliente.cerrar()
+        return respuestas, leido
+
+    respuestas, leido = asyncio.run(enviar())
+
+    assert all(r.status_code == 201 for r in respuestas)
+    assert leido.json()["id"] == "pac-1005"
+    assert hapi.conexiones <= 4
@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip("requests")
+
+from app import fhir_client
+
+# Las búsquedas siguen link rel="next" a medida que el consumidor avanza:
+# ningún historial se trunca en la primera página y solo hay una página en
+# memoria. Ver "BÚSQUEDAS PAGINADAS" en app/fhir_client.py.
+
+def _observaciones(hapi, documento, cantidad):
+    for i in range(cantidad):
+        hapi.guardar({
+            "resourceType": "Observation", "id": f"obs-{documento}-{i:03d}", "status": "final",
+            "subject": {"reference": f"Patient/pac-{documento}"},
+            "valueQuantity": {"value": 60 + i, "unit": "bpm"},
+        })
+
+def test_recorre_todas_las_paginas(hapi):
+    _observaciones(hapi, "1001", 25)
+    _observaciones(hapi, "2002", 3)
+
+    ids = [e["resource"]["id"] for e in fhir_client.iterar_observaciones_paciente("1001", count=10)]
+
+    assert sorted(ids) == [f"obs-1001-{i:03d}" for i in range(25)]
+    assert hapi.peticiones == 3
+
+def test_paginas_bajo_demanda(hapi):
+    _observaciones(hapi, "1001", 25)
+
+    entradas = fhir_client.iterar_observaciones_paciente("1001", count=10)
+    assert hapi.peticiones == 0
+
+    for _ in range(10):
+        next(entradas)
+    assert hapi.peticiones == 1
+
+    next(entradas)
+    assert hapi.peticiones == 2
+
+def test_parametros_reducen_la_respuesta(hapi):
+    _observaciones(hapi, "1001", 25)
+
+    entradas = list(fhir_client.iterar_observaciones_paciente("1001", count=50, elements=["subject"], sort="-_id"))
+    ids = [e["resource"]["id"] for e in entradas]
+    assert ids == sorted(ids, reverse=True)
+    assert all("valueQuantity" not in e["resource"] for e in entradas)
+
+    conteo = list(fhir_client.paginas_bundle(fhir_client.cliente.get(
+        "Observation", params=fhir_client._parametros_busqueda({"subject": "Patient/pac-1001"}, summary="count"))))
+    assert len(conteo) == 1
+    assert conteo[0]["total"] == 25 and "entry" not in conteo[0]
+
+def test_error_de_hapi(hapi):
+    with pytest.raises(RuntimeError):
+        list(fhir_client.buscar_recursos("Observation/obs-1/_history"))
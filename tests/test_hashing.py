@@ -0,0 +1,30 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("passlib")
+
+from app import utils
+
+# El hashing corre en un pool de procesos (app/utils.py). Si un worker muere
+# el executor queda roto; el siguiente login debe funcionar con un pool nuevo.
+
+@pytest.fixture(autouse=True)
+def pool():
+    yield
+    utils.cerrar_pool()
+
+def test_hash_y_verificacion():
+    hash_ = utils.get_password_hash("secreto")
+    assert utils.verify_password("secreto", hash_)
+    assert not utils.verify_password("otro", hash_)
+    assert not utils.verify_password("secreto", utils.HASH_INUTILIZABLE)
+
+def test_pool_roto_se_reemplaza():
+    roto = utils._obtener_pool()
+    with pytest.raises(BrokenProcessPool):
+        roto.submit(os._exit, 1).result()
+
+    assert utils.verify_password("secreto", utils.get_password_hash("secreto"))
+    assert utils._obtener_pool() is not roto
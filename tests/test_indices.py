@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("app.database", exc_type=ImportError)
+
+from sqlalchemy import text
+
+from app import busqueda, citus, indices, models
+
+# Volumen realista dentro de la transacción que se revierte: miles de
+# pacientes con decenas de encuentros, como en producción, y ANALYZE para
+# que el planificador decida con estadísticas reales. No se fuerza el plan
+# (nada de enable_seqscan = off): un Seq Scan aquí es el que elegiría la
+# base real, porque falta un índice o una consulta cambió de forma.
+
+PACIENTES = 4000
+MEDICOS = 20
+ENCUENTROS = 15
+OBSERVACIONES = 3
+
+def test_consultas_calientes_usan_indices(db, crear_historial):
+    # Pacientes sintéticos intercalados con MEDICOS médicos (crear_historial
+    # también crea los catálogos): como en la base real, los ids de los médicos
+    # quedan repartidos entre los de los pacientes y los encuentros entre ellos
+    for i in range(MEDICOS):
+        crear_historial(encuentros=1, observaciones=1)
+        lote = PACIENTES // MEDICOS
+        db.execute(busqueda.SQL_SEMBRAR, {"prefijo": "IDX", "desde": i * lote + 1, "hasta": (i + 1) * lote})
+    desde, hasta = db.execute(text(
+        "SELECT min(id), max(id) FROM usuarios WHERE numero_documento LIKE 'IDX%'")).one()
+    citus.sembrar_historiales(db, "IDX%", desde, hasta, ENCUENTROS, OBSERVACIONES)
+    db.execute(text("ANALYZE usuarios, encuentros_medicos, observaciones_clinicas"))
+
+    paciente = db.query(models.Usuario).filter(models.Usuario.numero_documento == "IDX000001234").one()
+    encuentro = db.query(models.EncuentroMedico).filter(
+        models.EncuentroMedico.paciente_id == paciente.id).first()
+
+    recorridos = indices.revisar(db, paciente.id, encuentro.id, paciente.numero_documento)
+
+    sin_indice = {nombre: sorted(tablas) for nombre, tablas in recorridos.items() if tablas}
+    assert not sin_indice, f"Consultas que recorren tablas completas: {sin_indice}"
@@ -0,0 +1,41 @@
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("app.database", exc_type=ImportError)
+pytest.importorskip("app.plantillas", exc_type=ImportError)
+
+from app import pdf, timeline
+from app.plantillas import templates
+
+# La exportación de la historia se renderiza en streaming (timeline.
+# HistorialEnStreaming + Template.generate): la memoria debe depender del
+# tamaño de lote, no de la longitud de la historia. Se compara el pico de
+# memoria de Python (tracemalloc, más estable que el RSS) al renderizar el
+# HTML del PDF para 1.000 y 10.000 encuentros.
+
+LOTE = 200
+
+def _pico_renderizado(db, paciente):
+    plantilla = templates.get_template("pdf_template.html")
+    tracemalloc.start()
+    try:
+        # La lectura de la historia también cuenta: el contexto se arma ya medido
+        contexto = pdf.contexto_pdf(paciente, timeline.HistorialEnStreaming(db, paciente.id, tamano_lote=LOTE))
+        caracteres = sum(len(fragmento) for fragmento in plantilla.generate(contexto))
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return caracteres, pico
+
+def test_exportacion_en_memoria_acotada(db, crear_historial):
+    corto = crear_historial(encuentros=1_000, observaciones=2)
+    largo = crear_historial(encuentros=10_000, observaciones=2)
+
+    caracteres_corto, pico_corto = _pico_renderizado(db, corto)
+    caracteres_largo, pico_largo = _pico_renderizado(db, largo)
+
+    # El documento largo sí es ~10 veces mayor...
+    assert caracteres_largo > 9 * caracteres_corto
+    # ...pero la memoria no crece con él (cargar la historia completa daría ~10x)
+    assert pico_largo < 2 * pico_corto, f"pico {pico_largo / 1e6:.1f} MB vs {pico_corto / 1e6:.1f} MB"
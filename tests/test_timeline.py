@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("app.database", exc_type=ImportError)
+
+from app import timeline
+from app.database import contar_consultas
+
+# La línea de tiempo se carga en 2 consultas sin importar cuántos encuentros
+# tenga el paciente (antes eran 4 por encuentro). Ver app/timeline.py.
+
+@pytest.mark.parametrize("encuentros", [1, 25, 200])
+def test_timeline_en_dos_consultas(db, motor, crear_historial, encuentros):
+    paciente_id = crear_historial(encuentros=encuentros, observaciones=3).id
+
+    with contar_consultas(motor) as consultas:
+        historial = timeline.construir_timeline(db, paciente_id)
+
+    assert len(historial) == encuentros
+    assert consultas.total <= 2, "\n".join(consultas.sentencias)
+
+def test_timeline_ordenado_con_signos(db, crear_historial):
+    paciente = crear_historial(encuentros=12, observaciones=3)
+
+    historial = timeline.construir_timeline(db, paciente.id)
+
+    fechas = [e.fecha for e in historial]
+    assert fechas == sorted(fechas, reverse=True)
+    assert all(len(e.signos_vitales) == 3 for e in historial)
+    assert all(e.medico and e.sede and e.tipo_encuentro for e in historial)
+
+def test_streaming_igual_a_timeline(db, crear_historial):
+    paciente = crear_historial(encuentros=23, observaciones=2)
+
+    completo = timeline.construir_timeline(db, paciente.id)
+    # Lote pequeño para cruzar varios bloques de encuentros
+    por_lotes = list(timeline.iterar_timeline(db, paciente.id, tamano_lote=5))
+
+    assert por_lotes == completo
+
+def test_paciente_sin_historial(db, crear_historial):
+    paciente = crear_historial(encuentros=0)
+    assert timeline.construir_timeline(db, paciente.id) == []